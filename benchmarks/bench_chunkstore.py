@@ -0,0 +1,96 @@
+"""Benchmark storage growth of chunked snapshots against delta chains.
+
+Writes a series of snapshots of a synthetic tree with a little churn
+between them, once as delta chains with keyframes and once as manifests
+of a chunk store, and reports the total bytes on disk and write times.
+
+Run from the project root with ``python -m benchmarks.bench_chunkstore``.
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from dir_snapshot.chunkstore import ChunkStore
+from dir_snapshot.snapshot import SnapshotData, read_snp_data, write_snp_data
+
+
+def make_snapshot(files: set[str]) -> SnapshotData:
+    """Make snapshot data with the parent directories of files.
+
+    Args:
+        files (set[str]): File paths.
+
+    Returns:
+        SnapshotData: Sorted SnapshotData model.
+    """
+    dirs = set()
+    for path in files:
+        parent = path.rpartition("/")[0]
+        while parent and parent not in dirs:
+            dirs.add(parent)
+            parent = parent.rpartition("/")[0]
+    return SnapshotData(dirs=sorted(dirs), files=sorted(files))
+
+
+def dir_size(dir: Path) -> int:
+    """Get the total size of the files below a directory.
+
+    Args:
+        dir (Path): Directory.
+
+    Returns:
+        int: Size in bytes.
+    """
+    return sum(p.stat().st_size for p in dir.rglob("*") if p.is_file())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=50_000)
+    parser.add_argument("--snapshots", type=int, default=50)
+    parser.add_argument("--churn", type=float, default=0.001)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    def new_file(i: int) -> str:
+        return f"d{rng.randrange(50):02d}/s{rng.randrange(40):02d}/f{i:07d}.dat"
+
+    files = {new_file(i) for i in range(args.entries)}
+    next_id = args.entries
+    series = []
+    for _ in range(args.snapshots):
+        series.append(make_snapshot(files))
+        changes = int(len(files) * args.churn)
+        files.difference_update(rng.sample(sorted(files), changes))
+        for _ in range(changes):
+            files.add(new_file(next_id))
+            next_id += 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("delta", "chunked"):
+            out = Path(tmp) / mode
+            out.mkdir()
+            store = ChunkStore(out / "chunks") if mode == "chunked" else None
+            base_file = None
+            start = time.perf_counter()
+            for idx, snapshot_data in enumerate(series):
+                file = os.path.join(out, f"{idx}.snp")
+                assert write_snp_data(snapshot_data, file, base_file, store=store)
+                base_file = file
+            elapsed = time.perf_counter() - start
+            assert read_snp_data(base_file).files == series[-1].files
+            print(
+                f"{mode}: {args.snapshots} snapshots of {args.entries:,} files, "
+                f"{dir_size(out) / 1024:,.0f} KiB on disk, "
+                f"{elapsed / args.snapshots * 1000:.1f}ms per snapshot"
+            )
+
+
+if __name__ == "__main__":
+    main()
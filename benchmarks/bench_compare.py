@@ -0,0 +1,69 @@
+"""Benchmark compare_snapshot on large synthetic snapshots.
+
+Run from the project root with ``python -m benchmarks.bench_compare``.
+"""
+
+import argparse
+import random
+import time
+
+from dir_snapshot.snapshot import (
+    SnapshotData,
+    compare_snapshot,
+    compute_tree_hashes,
+)
+
+
+def make_paths(entries: int, fanout: int = 100) -> list[str]:
+    """Make sorted synthetic file paths.
+
+    Args:
+        entries (int): Number of paths.
+        fanout (int): Number of files per directory.
+
+    Returns:
+        list[str]: Sorted list of paths.
+    """
+    return sorted(f"d{i // fanout:07d}/f{i:09d}.dat" for i in range(entries))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=5_000_000)
+    parser.add_argument("--churn", type=float, default=0.001)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--tree-hashes",
+        action="store_true",
+        help="record directory tree hashes so unchanged subtrees are pruned",
+    )
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    old_files = make_paths(args.entries)
+    changes = int(args.entries * args.churn)
+    removed = set(rng.sample(old_files, changes))
+    new_files = [f for f in old_files if f not in removed]
+    new_files.extend(f"zz_new/f{i:09d}.dat" for i in range(changes))
+
+    snap1 = SnapshotData(dirs=[], files=old_files)
+    snap2 = SnapshotData(dirs=[], files=new_files)
+    if args.tree_hashes:
+        for snap in (snap1, snap2):
+            snap.dirs = sorted({f.rpartition("/")[0] for f in snap.files})
+            snap.dir_tree_hashes = compute_tree_hashes(snap)
+
+    start = time.perf_counter()
+    result = compare_snapshot(snap1, snap2)
+    elapsed = time.perf_counter() - start
+
+    assert len(result.removed_files) == changes
+    assert len(result.added_files) == changes
+    print(
+        f"compare_snapshot: {args.entries:,} entries, {changes:,} changes, "
+        f"{elapsed:.3f}s ({args.entries / elapsed:,.0f} entries/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Benchmark SnapshotDB registration and lookups at growing registry sizes.
+
+Run from the project root with ``python -m benchmarks.bench_db``.
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from dir_snapshot import db
+from dir_snapshot.db import SnapshotDB
+
+
+def bench_size(num_dirs: int, lookups: int) -> tuple[float, float]:
+    """Register directories and look them up in an empty database.
+
+    Args:
+        num_dirs (int): Number of directories to register.
+        lookups (int): Number of lookups of each kind.
+
+    Returns:
+        tuple[float, float]: Seconds per registration and per lookup round.
+    """
+    snapshot_db = SnapshotDB()
+    paths = [f"/data/vol{i % 97:02d}/dir{i:08d}" for i in range(num_dirs)]
+
+    start = time.perf_counter()
+    for path in paths:
+        snapshot_db.add_snapshot_dir(path)
+    add_time = (time.perf_counter() - start) / num_dirs
+
+    step = max(1, num_dirs // lookups)
+    probes = paths[::step][:lookups]
+    start = time.perf_counter()
+    for path in probes:
+        id = snapshot_db.get_id_by_path(path)
+        snapshot_db.get_snapshot_dir(id)
+        snapshot_db.get_snapshot_dir_by_path(path)
+        snapshot_db.update_snapshot_dir(id, "bench.snp")
+    lookup_time = (time.perf_counter() - start) / len(probes)
+    return add_time, lookup_time
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000]
+    )
+    parser.add_argument("--lookups", type=int, default=1_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = Path(tmp_dir) / "bench.json"
+        db_file.touch()
+        db.get_db_file = lambda: db_file
+
+        for num_dirs in args.sizes:
+            add_time, lookup_time = bench_size(num_dirs, args.lookups)
+            print(
+                f"SnapshotDB: {num_dirs:>9,} dirs, "
+                f"add {add_time * 1e6:.2f}us, lookup round {lookup_time * 1e6:.2f}us"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Benchmark path history queries over hundreds of indexed snapshots.
+
+Run from the project root with ``python -m benchmarks.bench_pathindex``.
+"""
+
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from dir_snapshot.pathindex import PathIndex
+from dir_snapshot.snapshot import SnapshotData
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=20_000)
+    parser.add_argument("--snapshots", type=int, default=300)
+    parser.add_argument("--churn", type=float, default=0.005)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    files = {f"d{i // 100:05d}/f{i:07d}.dat" for i in range(args.entries)}
+    next_id = args.entries
+    previous = SnapshotData(dirs=[], files=[])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with PathIndex(Path(tmp) / "index.sqlite3") as index:
+            start = time.perf_counter()
+            for idx in range(args.snapshots):
+                changes = int(len(files) * args.churn)
+                files.difference_update(rng.sample(sorted(files), changes))
+                for _ in range(changes):
+                    files.add(f"d{next_id // 100:05d}/f{next_id:07d}.dat")
+                    next_id += 1
+                snapshot_data = SnapshotData(
+                    dirs=sorted({f.rpartition("/")[0] for f in files}),
+                    files=sorted(files),
+                )
+                index.add_snapshot(idx, f"{idx}.snp", previous, snapshot_data)
+                previous = snapshot_data
+            build = time.perf_counter() - start
+
+            paths = rng.sample(sorted(files), args.queries)
+            start = time.perf_counter()
+            for path in paths:
+                assert index.history(path)
+            history = (time.perf_counter() - start) / args.queries
+
+            prefixes = [path.rpartition("/")[0] + "/" for path in paths]
+            start = time.perf_counter()
+            for prefix in prefixes:
+                assert index.search(prefix)
+            search = (time.perf_counter() - start) / args.queries
+
+    print(
+        f"PathIndex: {args.snapshots} snapshots of {args.entries:,} entries "
+        f"indexed in {build:.2f}s ({build / args.snapshots * 1000:.1f}ms each)"
+    )
+    print(
+        f"history: {history * 1000:.3f}ms/query, "
+        f"prefix search: {search * 1000:.3f}ms/query"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Benchmark exclude rule evaluation with hundreds of rules.
+
+Compares the compiled PathRules matcher against checking each rule's own
+regular expression in turn, over synthetic paths that mix excluded and
+included entries.
+
+Run from the project root with ``python -m benchmarks.bench_rules``.
+"""
+
+import argparse
+import random
+import re
+import time
+
+from dir_snapshot.rules import PathRules, parse_rule, translate
+
+EXTENSIONS = ["py", "txt", "dat", "json", "md", "c", "h", "so", "log", "tmp"]
+
+
+def make_rules(count: int, rng: random.Random) -> list[str]:
+    """Make a mix of literal, suffix, anchored and recursive rules.
+
+    Args:
+        count (int): Number of rules.
+        rng (random.Random): Random generator.
+
+    Returns:
+        list[str]: Rules in .gitignore syntax.
+    """
+    rules = [".git/", "node_modules/", "__pycache__/", ".venv/", "*.pyc"]
+    while len(rules) < count:
+        kind = rng.randrange(5)
+        n = rng.randrange(1000)
+        if kind == 0:
+            rules.append(f"cache{n}/")
+        elif kind == 1:
+            rules.append(f"*.ext{n}")
+        elif kind == 2:
+            rules.append(f"/d{n:04d}/build")
+        elif kind == 3:
+            rules.append(f"d{n:04d}/**/*.{rng.choice(EXTENSIONS)}")
+        else:
+            rules.append(f"!keep{n}.pyc")
+    return rules
+
+
+def make_paths(entries: int, rng: random.Random) -> list[tuple[str, bool]]:
+    """Make synthetic paths with a few names that rules exclude.
+
+    Args:
+        entries (int): Number of paths.
+        rng (random.Random): Random generator.
+
+    Returns:
+        list[tuple[str, bool]]: Paths and whether they are directories.
+    """
+    paths = []
+    for i in range(entries):
+        parent = f"d{rng.randrange(2000):04d}/s{rng.randrange(20)}"
+        if i % 50 == 0:
+            paths.append((f"{parent}/{rng.choice(['cache1', 'node_modules'])}", True))
+        else:
+            name = f"f{i}.{rng.choice(EXTENSIONS + ['pyc', 'ext7'])}"
+            paths.append((f"{parent}/{name}", False))
+    return paths
+
+
+def naive_excluded(rules: list, path: str, is_dir: bool) -> bool:
+    """Check each rule in turn, the last match deciding.
+
+    Args:
+        rules (list): (Rule, compiled regex) pairs.
+        path (str): Relative path.
+        is_dir (bool): Whether the path is a directory.
+
+    Returns:
+        bool: True if the path is excluded.
+    """
+    subject = path + "/" if is_dir else path
+    for rule, regex in reversed(rules):
+        if regex.fullmatch(subject):
+            return not rule.negate
+    return False
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=50_000)
+    parser.add_argument("--rules", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    patterns = make_rules(args.rules, rng)
+    paths = make_paths(args.entries, rng)
+
+    start = time.perf_counter()
+    rules = PathRules(patterns)
+    compile_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    excluded = sum(rules.is_excluded(path, is_dir) for path, is_dir in paths)
+    elapsed = time.perf_counter() - start
+
+    naive = []
+    for rule in filter(None, map(parse_rule, patterns)):
+        prefix = "" if rule.anchored else "(?:.*/)?"
+        suffix = "/" if rule.dir_only else "/?"
+        naive.append((rule, re.compile(prefix + translate(rule.glob) + suffix)))
+    start = time.perf_counter()
+    naive_count = sum(naive_excluded(naive, path, is_dir) for path, is_dir in paths)
+    naive_elapsed = time.perf_counter() - start
+
+    assert excluded == naive_count
+    print(
+        f"PathRules: {len(patterns)} rules compiled in {compile_time * 1000:.1f}ms, "
+        f"{args.entries:,} paths, {excluded:,} excluded, {elapsed:.3f}s "
+        f"({args.entries / elapsed:,.0f} paths/s)"
+    )
+    print(
+        f"per-rule loop: {naive_elapsed:.3f}s "
+        f"({args.entries / naive_elapsed:,.0f} paths/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""Benchmark suite for the snapshot pipeline on synthetic trees.
+
+Each stage is timed once for throughput and once more under tracemalloc
+for peak Python memory. Results are written to a JSON file and can be
+compared against a stored baseline, exiting non-zero on regressions.
+
+Run from the project root with ``python -m benchmarks.suite``, e.g.::
+
+    python -m benchmarks.suite --entries 100000 --output results.json \\
+        --baseline benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable
+
+from benchmarks.treegen import SHAPES, generate_tree
+from dir_snapshot import db
+from dir_snapshot.db import SnapshotDB
+from dir_snapshot.snapshot import (
+    SNAPSHOT_CACHE,
+    SnapshotData,
+    compare_snapshot,
+    create_snapshot,
+    iter_snapshot,
+    read_snp_data,
+    take_snapshot,
+    write_snp_data,
+    write_snp_stream,
+)
+from dir_snapshot.walker import walk
+
+REGRESSION_THRESHOLD = 0.2
+
+
+def measure(func: Callable[[], Any], memory: bool = True) -> tuple[float, int, Any]:
+    """Time a stage, then run it again under tracemalloc for peak memory.
+
+    Args:
+        func (Callable[[], Any]): Stage to run.
+        memory (bool): Whether to measure peak memory.
+
+    Returns:
+        tuple[float, int, Any]: Seconds, peak bytes (0 if not measured) and
+            the result of the timed run.
+    """
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if memory:
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def bench_db(paths: list[str]) -> None:
+    """Register paths in an empty SnapshotDB and look each one up.
+
+    Args:
+        paths (list[str]): Directory paths.
+    """
+    snapshot_db = SnapshotDB()
+    for path in paths:
+        snapshot_db.add_snapshot_dir(path)
+    for path in paths:
+        snapshot_db.get_snapshot_dir(snapshot_db.get_id_by_path(path))
+
+
+def read_cold(snp_file: str) -> SnapshotData:
+    """Read a snapshot file, bypassing the snapshot cache.
+
+    Args:
+        snp_file (str): Snapshot file.
+
+    Returns:
+        SnapshotData: Decoded snapshot.
+    """
+    SNAPSHOT_CACHE.clear()
+    return read_snp_data(snp_file)
+
+
+def run_shape(
+    shape: str, entries: int, seed: int, work_dir: Path, memory: bool
+) -> dict[str, dict]:
+    """Generate a tree and benchmark every stage on it.
+
+    Args:
+        shape (str): Tree shape.
+        entries (int): Number of entries in the tree.
+        seed (int): Random seed.
+        work_dir (Path): Directory for the tree and snapshot files.
+        memory (bool): Whether to measure peak memory.
+
+    Returns:
+        dict[str, dict]: Results per stage.
+    """
+    tree = work_dir / f"tree-{shape}"
+    tree.mkdir()
+    generate_tree(tree, entries, shape, seed)
+    root = tree.as_posix()
+    snp_file = (work_dir / f"{shape}.snp").as_posix()
+    stream_file = (work_dir / f"{shape}-stream.snp").as_posix()
+    base_file = (work_dir / f"{shape}-base.snp").as_posix()
+    delta_file = (work_dir / f"{shape}-delta.snp").as_posix()
+
+    snap = create_snapshot(root, with_stats=True)
+    take_snapshot(root, base_file)
+    changes = max(1, len(snap.files) // 1000)
+    changed = SnapshotData(dirs=snap.dirs, files=snap.files[changes:])
+    stages = {
+        "walk": lambda: deque(walk(root, with_stats=True), maxlen=0),
+        "create": lambda: create_snapshot(root, with_stats=True),
+        "create_incremental": lambda: create_snapshot(
+            root, with_stats=True, previous=snap
+        ),
+        "write_stream": lambda: write_snp_stream(
+            iter_snapshot(root, with_stats=True), stream_file
+        ),
+        "take_delta": lambda: take_snapshot(root, delta_file, base_file),
+        "write": lambda: write_snp_data(snap, snp_file),
+        "read": lambda: read_cold(snp_file),
+        "compare": lambda: compare_snapshot(
+            SnapshotData(snap.dirs, snap.files), changed
+        ),
+        "db": lambda: bench_db([f"{root}/{path}" for path in snap.dirs]),
+    }
+
+    results = {}
+    for stage, func in stages.items():
+        elapsed, peak, _ = measure(func, memory)
+        count = len(snap.dirs) if stage == "db" else len(snap.dirs) + len(snap.files)
+        results[stage] = {
+            "entries": count,
+            "seconds": round(elapsed, 6),
+            "entries_per_sec": round(count / elapsed if elapsed else 0.0, 1),
+            "peak_bytes": peak,
+        }
+        print(
+            f"{shape:>7} {stage:<19} {count:>10,} entries {elapsed:8.3f}s "
+            f"{count / elapsed if elapsed else 0:>12,.0f}/s "
+            f"{peak / (1 << 20):8.1f} MiB"
+        )
+    return results
+
+
+def find_regressions(
+    results: dict, baseline: dict, threshold: float = REGRESSION_THRESHOLD
+) -> list[str]:
+    """Compare results against a baseline.
+
+    A stage regresses if its throughput drops, or its peak memory grows, by
+    more than threshold relative to the baseline.
+
+    Args:
+        results (dict): Results of this run.
+        baseline (dict): Baseline results.
+        threshold (float): Allowed relative change.
+
+    Returns:
+        list[str]: Descriptions of regressions.
+    """
+    regressions = []
+    for key, result in results["results"].items():
+        base = baseline["results"].get(key)
+        if base is None:
+            continue
+        if result["entries_per_sec"] < base["entries_per_sec"] * (1 - threshold):
+            regressions.append(
+                f"{key}: {result['entries_per_sec']:,.0f} entries/s, "
+                f"baseline {base['entries_per_sec']:,.0f}"
+            )
+        if (
+            result["peak_bytes"]
+            and base["peak_bytes"]
+            and result["peak_bytes"] > base["peak_bytes"] * (1 + threshold)
+        ):
+            regressions.append(
+                f"{key}: peak {result['peak_bytes']:,} bytes, "
+                f"baseline {base['peak_bytes']:,}"
+            )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--entries", type=int, default=100_000)
+    parser.add_argument("--shapes", nargs="+", choices=SHAPES, default=list(SHAPES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--output", type=Path, help="results JSON file")
+    parser.add_argument("--baseline", type=Path, help="baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument("--work-dir", type=Path, help="parent of the temp directory")
+    args = parser.parse_args()
+
+    results = {
+        "meta": {
+            "entries": args.entries,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as tmp_dir:
+        work_dir = Path(tmp_dir)
+        db_file = work_dir / "bench.json"
+        db_file.touch()
+        db.get_db_file = lambda: db_file
+        for shape in args.shapes:
+            shape_results = run_shape(
+                shape, args.entries, args.seed, work_dir, not args.no_memory
+            )
+            for stage, result in shape_results.items():
+                results["results"][f"{shape}/{stage}"] = result
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        regressions = find_regressions(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Deterministic synthetic directory tree generator for benchmarks.
+
+Run from the project root with ``python -m benchmarks.treegen DIR``.
+"""
+
+import argparse
+import os
+import random
+from collections import deque
+from pathlib import Path
+from typing import Callable, NamedTuple, Optional
+
+
+class TreeShape(NamedTuple):
+    """Shape of a synthetic tree.
+
+    fanout and files give the number of subdirectories and files of each
+    directory. Directories are expanded breadth-first, or depth-first for
+    deep trees, until the requested number of entries is reached.
+    """
+
+    fanout: Callable[[random.Random], int]
+    files: Callable[[random.Random], int]
+    depth_first: bool = False
+    max_depth: Optional[int] = None
+
+
+SHAPES = {
+    # Many files per directory and few levels.
+    "wide": TreeShape(lambda rng: 32, lambda rng: rng.randint(150, 250)),
+    # Long binary chains with few files per directory.
+    "deep": TreeShape(lambda rng: 2, lambda rng: rng.randint(4, 12), True, 48),
+    # Heavy-tailed file counts, so a few directories hold most files.
+    "skewed": TreeShape(
+        lambda rng: rng.randint(0, 6),
+        lambda rng: min(int(rng.paretovariate(1.1) * 3), 50_000),
+    ),
+}
+
+
+def _create_file(path: str) -> None:
+    """Create an empty file.
+
+    Args:
+        path (str): File path.
+    """
+    os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o644))
+
+
+def generate_tree(
+    root: Path, entries: int, shape: str = "wide", seed: int = 0
+) -> tuple[int, int]:
+    """Generate a synthetic directory tree.
+
+    The same arguments always produce the same paths.
+
+    Args:
+        root (Path): Existing directory to generate the tree in.
+        entries (int): Number of directories and files to create.
+        shape (str): One of SHAPES.
+        seed (int): Random seed.
+
+    Returns:
+        tuple[int, int]: Number of directories and files created.
+    """
+    tree_shape = SHAPES[shape]
+    rng = random.Random(seed)
+    pending = deque([(root.as_posix(), 0)])
+    num_dirs = num_files = 0
+    extra = 0
+
+    while num_dirs + num_files < entries:
+        if not pending:
+            # Every branch hit max_depth or ended, so start a new one at the root.
+            path = f"{root.as_posix()}/x{extra:06d}"
+            os.mkdir(path)
+            num_dirs += 1
+            extra += 1
+            pending.append((path, 1))
+            continue
+
+        parent, depth = pending.pop() if tree_shape.depth_first else pending.popleft()
+        for idx in range(tree_shape.files(rng)):
+            if num_dirs + num_files >= entries:
+                break
+            _create_file(f"{parent}/f{idx:06d}.dat")
+            num_files += 1
+
+        if tree_shape.max_depth is not None and depth >= tree_shape.max_depth:
+            continue
+        fanout = tree_shape.fanout(rng) if depth else max(1, tree_shape.fanout(rng))
+        for idx in range(fanout):
+            if num_dirs + num_files >= entries:
+                break
+            path = f"{parent}/d{idx:04d}"
+            os.mkdir(path)
+            num_dirs += 1
+            pending.append((path, depth + 1))
+
+    return num_dirs, num_files
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("dir", type=Path)
+    parser.add_argument("--entries", type=int, default=10_000)
+    parser.add_argument("--shape", choices=SHAPES, default="wide")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    args.dir.mkdir(parents=True, exist_ok=True)
+    num_dirs, num_files = generate_tree(args.dir, args.entries, args.shape, args.seed)
+    print(f"Generated {num_dirs:,} directories and {num_files:,} files in {args.dir}")
+
+
+if __name__ == "__main__":
+    main()
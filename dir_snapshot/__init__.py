@@ -9,9 +9,33 @@ __version__ = "0.1.0"
 APP_SETTINGS_DIR = ".dir_snapshot"
 APP_SNAPSHOT_DIR = "snapshots"
 APP_DB_FILE = "dir_snapshot.json"
+APP_SQLITE_DB_FILE = "dir_snapshot.sqlite3"
 APP_SNAPSHOT_EXT = ".snp"
+APP_HASH_CACHE_FILE = "hash_cache.db"
+APP_COMPARE_CACHE_DIR = "compare_cache"
+APP_PATH_INDEX_DIR = "path_index"
+APP_CHUNK_DIR = "chunks"
 TCSS_DIR = Path(__file__).parent / "styles"
 
+# Snapshot constants
+WALK_WORKERS = 8
+SNP_CHUNK_SIZE = 65536
+SNP_BLOCK_SIZE = 1024
+SNP_KEYFRAME_INTERVAL = 10
+# Largest base snapshot, in entries, loaded to reuse its directory listings.
+INCREMENTAL_WALK_MAX_ENTRIES = 1 << 20
+# Age in seconds below which unreferenced chunks are kept by gc.
+CHUNK_GC_GRACE = 3600
+# Coarsest mtime resolution of supported filesystems (FAT), for racy listings.
+RACY_MTIME_WINDOW_NS = 2_000_000_000
+HASH_WORKERS = 4
+HASH_BATCH_SIZE = 4096
+BATCH_WORKERS = 4
+BATCH_PROGRESS_INTERVAL = 0.25
+COMPARE_CACHE_MEMORY_BUDGET = 64 << 20
+COMPARE_CACHE_DISK_BUDGET = 256 << 20
+SNAPSHOT_CACHE_BUDGET = 256 << 20
+
 # UI constants
 APP_TITLE = "Directory Snapshot App"
 APP_SUBTITLE = __version__
@@ -1,7 +1,8 @@
 """Launcher module for Directory Snapshot App."""
 
-from dir_snapshot.app import DirSnapshotApp
+import sys
+
+from dir_snapshot.cli import main
 
 if __name__ == "__main__":
-    app = DirSnapshotApp()
-    app.run()
+    sys.exit(main())
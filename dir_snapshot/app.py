@@ -1,9 +1,12 @@
 """Application module for Directory Snapshot App."""
 
+import sqlite3
 from pathlib import Path
+from typing import Optional
 
-from textual import on
+from textual import on, work
 from textual.app import App, ComposeResult
+from textual.containers import VerticalScroll
 from textual.widgets import (
     Footer,
     Header,
@@ -14,35 +17,42 @@ from textual.widgets import (
     TabPane,
 )
 
-from dir_snapshot import APP_TITLE, APP_SUBTITLE, TCSS_DIR
-from dir_snapshot.db import SnapshotDB
-from dir_snapshot.snapshot import create_snapshot, generate_snp_filename, write_snp_data
-from dir_snapshot.ui import AddDirDialog, ConfirmDialog
+from dir_snapshot import APP_TITLE, APP_SUBTITLE, TCSS_DIR, instrument
+from dir_snapshot.chunkstore import get_snapshot_store
+from dir_snapshot.db import SnapshotDB, SQLiteSnapshotDB
+from dir_snapshot.pathindex import PathIndex, open_path_index, update_path_index
+from dir_snapshot.rules import PathRules, compile_rules
+from dir_snapshot.scheduler import (
+    BatchJob,
+    BatchResult,
+    index_batch,
+    plan_batch,
+    register_batch,
+    run_batch,
+)
+from dir_snapshot.snapshot import (
+    SnapshotCancelled,
+    SnapshotProgress,
+    SnapshotTreeCompareData,
+    compare_snapshot_files,
+    generate_snp_filename,
+    get_snp_file,
+    take_snapshot,
+)
+from dir_snapshot.watcher import DirWatcher, is_supported, take_watched_snapshot
+from dir_snapshot.ui import (
+    AddDirDialog,
+    CompareResultPanel,
+    ConfirmDialog,
+    PathHistoryDialog,
+    RulesDialog,
+    SnapshotProgressItem,
+    StatsTable,
+)
 
 MAX_SELECTED = 2
 
 
-# TODO: Temporary content. Remove them once we got dynamic content.
-COMPARISON_CONTENT = """
-# Comparison Result for Snapshot 1 and Snapshot 2
-
-## Added Directories
-- Directory 1
-- Directory 2
-
-## Added Files
-- File 1
-- File 2
-
-## Removed Directories
-- Directory 3
-- Directory 4
-
-## Removed Files
-- File 3
-- File 4
-"""
-
 HELP_CONTENT = """
 # Directory Snapshot Help
 
@@ -56,8 +66,44 @@ Click the 'Add Directory' button to add a directory to the list.
 ## Removing a Directory
 Click the 'Remove Directory' button to remove a directory from the list.
 
+## Taking a Snapshot
+Select a directory and click the 'Take Snapshot' button. Snapshots run in the
+background and their progress is shown in the 'Progress' tab, where they can
+be cancelled. Several directories can be snapshotted at the same time.
+
+## Snapshotting All Directories
+Press 'S' to take snapshots of all directories at once.
+
+## Excluding Paths
+Select a directory and press 'e' to edit its exclude rules, one per line in
+.gitignore syntax, e.g. `.git/`, `node_modules/`, `*.pyc` or `/build`. A rule
+starting with '!' includes matching paths again. Excluded directories are
+never read, so they cost nothing when taking snapshots.
+
+## Path History
+Select a directory and press 'h' to look up paths across all of its
+snapshots. Type a path or a prefix such as `src/` to list matching paths with
+the first and last snapshot containing them and the number of snapshots they
+are in.
+
+## Watching a Directory
+Select a directory and press 'w' to watch it for changes (Linux only). While a
+directory is watched, its snapshots are built from the changes journaled since
+the previous snapshot instead of walking the whole tree. Press 'w' again to
+stop watching.
+
+## Stats
+The 'Stats' tab shows time spent per stage and counters such as entries
+visited, stat calls and bytes written since the app started.
+
 ## Comparing Snapshots
-Click the 'Compare Snapshots' button to compare the selected snapshots.
+Select two snapshots and click the 'Compare Snapshots' button to compare them.
+The result lists added, removed and modified paths with counts per category.
+An added or removed directory is listed once with the number of directories,
+files and bytes below it. Move to it with the arrow keys and press Enter, or
+click it, to expand or collapse its contents.
+Type in the filter box to show only paths containing the text, and use
+Page Up and Page Down to page through the result.
 """
 
 
@@ -72,13 +118,23 @@ class DirSnapshotApp(App):
         ("a", "add_dir", "Add Directory"),
         ("r", "remove_dir", "Remove Directory"),
         ("s", "take_snapshot", "Take Snapshot"),
+        ("S", "snapshot_all", "Snapshot All"),
         ("c", "compare_snapshots", "Compare Snapshots"),
+        ("w", "toggle_watch", "Watch Directory"),
+        ("e", "edit_rules", "Edit Rules"),
+        ("h", "path_history", "Path History"),
     ]
 
     def __init__(self) -> None:
         super().__init__()
         self.selected_dir: str = ""
-        self.db: SnapshotDB = SnapshotDB()
+        self.db: Optional[SnapshotDB] = None
+        self.running_snapshots: dict[str, SnapshotProgressItem] = {}
+        self.watchers: dict[str, DirWatcher] = {}
+        # Directories whose watches are being added on a worker.
+        self.starting_watches: set[str] = set()
+        # Instrumentation state of the process, restored on unmount.
+        self._instrument_enabled = instrument.is_enabled()
 
     def compose(self) -> ComposeResult:
         yield Header()
@@ -86,25 +142,57 @@ class DirSnapshotApp(App):
         yield SelectionList[str](id="snapshots")
         with TabbedContent(initial="snapshot-result", id="content"):
             with TabPane("Snapshot Results", id="snapshot-result"):
-                yield Markdown(COMPARISON_CONTENT, id="result-content")
+                yield CompareResultPanel(id="result-content")
+            with TabPane("Progress", id="snapshot-progress"):
+                yield VerticalScroll(id="progress-content")
+            with TabPane("Stats", id="stats"):
+                yield StatsTable(id="stats-content")
             with TabPane("Help", id="help"):
                 yield Markdown(HELP_CONTENT, id="help-content")
         yield Footer()
 
     def on_mount(self) -> None:
-        self.query_one("#result-content").styles.height = "1fr"
+        # The Stats tab shows spans and counters while the app runs.
+        self._instrument_enabled = instrument.is_enabled()
+        instrument.enable()
         self.query_one("#help-content").styles.height = "1fr"
         self.query_one(OptionList).border_title = "Directories"
         self.query_one(SelectionList).border_title = "Snapshots"
 
-        self._populate_data()
+        # Open the database once the first frame is drawn.
+        self.call_after_refresh(self._load_db)
+
+    def on_unmount(self) -> None:
+        instrument.enable(self._instrument_enabled)
+
+    @work(thread=True, exclusive=True, group="db")
+    def _load_db(self) -> None:
+        """Load the snapshot database in a worker thread."""
+        db = SQLiteSnapshotDB()
+        self.call_from_thread(self._populate_data, db)
 
-    def _populate_data(self) -> None:
-        """Populate data to UI elements."""
+    def _populate_data(self, db: SnapshotDB) -> None:
+        """Populate data to UI elements.
+
+        Args:
+            db (SnapshotDB): Loaded snapshot database.
+        """
+        self.db = db
         if self.db.snapshot_dirs:
-            dir_list = self.query_one(OptionList)
-            for d in self.db.snapshot_dirs:
-                dir_list.add_option(d.path)
+            self.query_one(OptionList).add_options(
+                d.path for d in self.db.snapshot_dirs
+            )
+
+    def _is_db_loaded(self) -> bool:
+        """Check if the database is loaded, notifying the user if not.
+
+        Returns:
+            bool: True if the database is loaded.
+        """
+        if self.db is None:
+            self.notify("Loading database...", severity="warning")
+            return False
+        return True
 
     def _refresh_snapshot_list(self) -> None:
         """Refresh snapshot list widget."""
@@ -113,15 +201,21 @@ class DirSnapshotApp(App):
             snapshot_list.clear_options()
             snapshot_data = self.db.get_snapshot_dir_by_path(self.selected_dir)
             if snapshot_data.snap_files:
-                for snap_file in snapshot_data.snap_files:
-                    snapshot_list.add_option((snap_file, snap_file))
+                snapshot_list.add_options(
+                    (snap_file, snap_file) for snap_file in snapshot_data.snap_files
+                )
 
     def action_request_quit(self) -> None:
         """Action to show quit dialog."""
 
         def check_quit(quit: bool) -> None:
             if quit:
-                self.db.save_data()
+                for item in self.running_snapshots.values():
+                    item.progress.cancelled = True
+                for watcher in self.watchers.values():
+                    watcher.stop()
+                if self.db is not None:
+                    self.db.save_data()
                 self.exit()
 
         self.push_screen(ConfirmDialog("Are you sure you want to quit?"), check_quit)
@@ -150,7 +244,8 @@ class DirSnapshotApp(App):
             else:
                 self.notify("Cancelled", severity="error")
 
-        self.push_screen(AddDirDialog(), check_input_dir)
+        if self._is_db_loaded():
+            self.push_screen(AddDirDialog(), check_input_dir)
 
     def action_remove_dir(self) -> None:
         """Action to show remove directory dialog."""
@@ -173,19 +268,7 @@ class DirSnapshotApp(App):
 
         def check_confirm_snapshot(snapshot: bool) -> None:
             if snapshot:
-                dir_id = self.db.get_id_by_path(self.selected_dir)
-                if dir_id is not None:
-                    snp_file = generate_snp_filename(dir_id)
-                    snapshot_data = create_snapshot(self.selected_dir)
-                    if write_snp_data(snapshot_data, snp_file):
-                        self.db.update_snapshot_dir(dir_id, Path(snp_file).name)
-                        self._refresh_snapshot_list()
-                        self.notify(f"Created snapshot file: {snp_file}")
-                    else:
-                        self.notify(
-                            f"Failed to create snapshot file: {snp_file}",
-                            severity="error",
-                        )
+                self._start_snapshot(self.selected_dir)
             else:
                 self.notify("Cancelled")
 
@@ -197,14 +280,381 @@ class DirSnapshotApp(App):
         else:
             self.notify("No directory selected.", severity="error")
 
+    def action_toggle_watch(self) -> None:
+        """Action to start or stop watching the selected directory."""
+        if not self.selected_dir:
+            self.notify("No directory selected.", severity="error")
+            return
+        if self.selected_dir in self.starting_watches:
+            self.notify(f"Already starting to watch {self.selected_dir}")
+            return
+        watcher = self.watchers.pop(self.selected_dir, None)
+        if watcher is not None:
+            watcher.stop()
+            self.notify(f"Stopped watching {self.selected_dir}")
+            return
+        if not is_supported():
+            self.notify("Watching is not supported on this system.", severity="error")
+            return
+        self._start_watch(self.selected_dir)
+
+    def _start_watch(self, dir: str) -> None:
+        """Start watching a directory with its current rules on a worker thread.
+
+        Args:
+            dir (str): Directory to watch.
+        """
+        self.starting_watches.add(dir)
+        self._run_watch(DirWatcher(dir, self._get_rules(dir)))
+
+    @work(thread=True, group="watch")
+    def _run_watch(self, watcher: DirWatcher) -> None:
+        """Add the watches of a directory tree in a worker thread.
+
+        Args:
+            watcher (DirWatcher): Watcher to start.
+        """
+        started = watcher.start()
+        self.call_from_thread(self._finish_watch, watcher, started)
+
+    def _finish_watch(self, watcher: DirWatcher, started: bool) -> None:
+        """Register a started watcher.
+
+        Args:
+            watcher (DirWatcher): Started watcher.
+            started (bool): Whether the whole tree is watched.
+        """
+        dir = watcher.root
+        self.starting_watches.discard(dir)
+        if not started:
+            watcher.stop()
+            self.notify(f"Failed to watch {dir}", severity="error")
+            return
+        if self.db.get_snapshot_dir_by_path(dir) is None:
+            # The directory was removed while the tree was being watched.
+            watcher.stop()
+            return
+        if watcher.rules != self._get_rules(dir):
+            # The rules were edited while the tree was being watched.
+            watcher.stop()
+            self._start_watch(dir)
+            return
+        self.watchers[dir] = watcher
+        self.notify(f"Watching {dir} ({watcher.watched} directories)")
+
+    def action_edit_rules(self) -> None:
+        """Action to edit the exclude rules of the selected directory."""
+        if not self.selected_dir:
+            self.notify("No directory selected.", severity="error")
+            return
+        dir_data = self.db.get_snapshot_dir_by_path(self.selected_dir)
+
+        def check_rules(rules: list[str] | None) -> None:
+            if rules is None:
+                self.notify("Cancelled")
+                return
+            try:
+                compile_rules(rules)
+            except ValueError as e:
+                self.notify(str(e), severity="error")
+                return
+            self.db.set_snapshot_dir_rules(dir_data.id, rules)
+            self.notify(f"Set {len(rules)} rules for {dir_data.path}")
+            # Watch again, since the watched directories depend on the rules.
+            watcher = self.watchers.pop(dir_data.path, None)
+            if watcher is not None:
+                watcher.stop()
+                self._start_watch(dir_data.path)
+
+        self.push_screen(RulesDialog(dir_data.path, dir_data.rules), check_rules)
+
+    def action_path_history(self) -> None:
+        """Action to show the path history of the selected directory."""
+        if not self.selected_dir:
+            self.notify("No directory selected.", severity="error")
+            return
+        dir_data = self.db.get_snapshot_dir_by_path(self.selected_dir)
+        if not dir_data.snap_files:
+            self.notify("No snapshots taken yet.", severity="error")
+            return
+        self._open_path_history(dir_data.id, dir_data.path, list(dir_data.snap_files))
+
+    @work(thread=True, group="index")
+    def _open_path_history(self, dir_id: int, dir: str, snap_files: list[str]) -> None:
+        """Open the path index of a directory in a worker thread and show it.
+
+        Args:
+            dir_id (int): Snapshot dir id.
+            dir (str): Directory path.
+            snap_files (list[str]): Registered snapshot files, oldest first.
+        """
+        # Index snapshots registered before the index existed.
+        update_path_index(dir_id, snap_files)
+        try:
+            index = open_path_index(dir_id)
+        except (OSError, sqlite3.Error):
+            self.call_from_thread(
+                self.notify, f"Failed to open path index of {dir}", severity="error"
+            )
+            return
+        self.call_from_thread(self._show_path_history, dir, index)
+
+    def _show_path_history(self, dir: str, index: PathIndex) -> None:
+        """Show the path history dialog of a directory.
+
+        Args:
+            dir (str): Directory path.
+            index (PathIndex): Opened path index, closed by the dialog.
+        """
+        self.push_screen(PathHistoryDialog(dir, index))
+
+    def _get_rules(self, dir: str) -> Optional[PathRules]:
+        """Get the compiled exclude rules of a directory.
+
+        Args:
+            dir (str): Directory path.
+
+        Returns:
+            Optional[PathRules]: Compiled rules, None if there are none.
+        """
+        dir_data = self.db.get_snapshot_dir_by_path(dir)
+        return compile_rules(dir_data.rules) if dir_data is not None else None
+
+    def action_snapshot_all(self) -> None:
+        """Action to take snapshots of all directories."""
+
+        def check_confirm_snapshot_all(snapshot: bool) -> None:
+            if snapshot:
+                jobs = plan_batch(self.db, skip=self.running_snapshots)
+                if jobs:
+                    self.notify(f"Taking snapshots of {len(jobs)} directories")
+                    items = [self._add_progress_item(job.dir) for job in jobs]
+                    self._run_batch(jobs, [item.progress for item in items])
+            else:
+                self.notify("Cancelled")
+
+        if not self._is_db_loaded():
+            return
+        if self.db.snapshot_dirs:
+            self.push_screen(
+                ConfirmDialog("Take snapshots of all directories?"),
+                check_confirm_snapshot_all,
+            )
+        else:
+            self.notify("No directories added.", severity="error")
+
+    @work(thread=True, group="snapshots")
+    def _run_batch(
+        self, jobs: list[BatchJob], progress: list[SnapshotProgress]
+    ) -> None:
+        """Take batch snapshots in a worker thread and report back to the UI.
+
+        Args:
+            jobs (list[BatchJob]): Snapshot jobs.
+            progress (list[SnapshotProgress]): Progress shown for each job.
+        """
+        try:
+            results = run_batch(jobs, progress=progress)
+        except Exception:
+            # E.g. the worker processes cannot be started.
+            results = [
+                BatchResult(job.dir_id, job.dir, job.snp_file, None) for job in jobs
+            ]
+        registered = self.call_from_thread(self._finish_batch, results, progress)
+        index_batch(registered)
+
+    def _finish_batch(
+        self, results: list[BatchResult], progress: list[SnapshotProgress]
+    ) -> dict[int, list[str]]:
+        """Register finished batch snapshots and remove their progress items.
+
+        Args:
+            results (list[BatchResult]): Batch snapshot results.
+            progress (list[SnapshotProgress]): Final progress of each job.
+
+        Returns:
+            dict[int, list[str]]: Registered snapshot files of each updated
+                snapshot dir id, indexed by the worker.
+        """
+        for r in results:
+            item = self.running_snapshots.pop(r.dir, None)
+            if item is not None:
+                item.remove()
+        registered = register_batch(self.db, results)
+        cancelled = [
+            r.dir
+            for r, p in zip(results, progress)
+            if r.num_entries is None and p.cancelled
+        ]
+        failed = [
+            r.dir for r in results if r.num_entries is None and r.dir not in cancelled
+        ]
+        if self.selected_dir:
+            self._refresh_snapshot_list()
+        if cancelled:
+            self.notify(f"Cancelled snapshots of: {', '.join(cancelled)}")
+        if failed:
+            self.notify(f"Failed to snapshot: {', '.join(failed)}", severity="error")
+        created = len(results) - len(failed) - len(cancelled)
+        self.notify(f"Created {created} snapshot files")
+        return registered
+
+    def _add_progress_item(self, dir: str) -> SnapshotProgressItem:
+        """Mark a directory as running and show its progress.
+
+        Args:
+            dir (str): Directory being snapshotted.
+
+        Returns:
+            SnapshotProgressItem: Progress item, removed when the snapshot ends.
+        """
+        item = SnapshotProgressItem(dir, SnapshotProgress())
+        self.running_snapshots[dir] = item
+        self.query_one("#progress-content").mount(item)
+        self.query_one(TabbedContent).active = "snapshot-progress"
+        return item
+
+    def _start_snapshot(self, dir: str) -> None:
+        """Start taking a snapshot of a directory on a worker thread.
+
+        Args:
+            dir (str): Directory to snapshot.
+        """
+        dir_id = self.db.get_id_by_path(dir)
+        if dir_id is None:
+            return
+        if dir in self.running_snapshots:
+            self.notify(f"Snapshot already running for {dir}", severity="warning")
+            return
+
+        snp_file = generate_snp_filename(dir_id)
+        snap_files = self.db.get_snapshot_dir(dir_id).snap_files
+        # Store as a delta of the previous snapshot.
+        base_file = get_snp_file(snap_files[-1]) if snap_files else None
+        item = self._add_progress_item(dir)
+        self._run_snapshot(
+            dir_id, dir, snp_file, base_file, item.progress, self._get_rules(dir)
+        )
+
+    @work(thread=True, group="snapshots")
+    def _run_snapshot(
+        self,
+        dir_id: int,
+        dir: str,
+        snp_file: str,
+        base_file: Optional[str],
+        progress: SnapshotProgress,
+        rules: Optional[PathRules] = None,
+    ) -> None:
+        """Take a snapshot in a worker thread and report back to the UI.
+
+        Args:
+            dir_id (int): Snapshot dir id.
+            dir (str): Directory to snapshot.
+            snp_file (str): Snapshot file to write.
+            base_file (Optional[str]): Previous snapshot file of the directory.
+            progress (SnapshotProgress): Progress shown while running.
+            rules (Optional[PathRules]): Rules of entries to leave out.
+        """
+        watcher = self.watchers.get(dir)
+        store = get_snapshot_store()
+        try:
+            if watcher is not None:
+                written = take_watched_snapshot(
+                    watcher, snp_file, base_file, progress=progress, store=store
+                )
+            else:
+                written = take_snapshot(
+                    dir,
+                    snp_file,
+                    base_file,
+                    progress=progress,
+                    rules=rules,
+                    store=store,
+                )
+        except SnapshotCancelled:
+            written = None
+        snap_files = self.call_from_thread(
+            self._finish_snapshot, dir_id, dir, snp_file, progress, written
+        )
+        if snap_files is not None:
+            update_path_index(dir_id, snap_files)
+
+    def _finish_snapshot(
+        self,
+        dir_id: int,
+        dir: str,
+        snp_file: str,
+        progress: SnapshotProgress,
+        written: Optional[bool],
+    ) -> Optional[list[str]]:
+        """Register a finished snapshot and remove its progress item.
+
+        Args:
+            dir_id (int): Snapshot dir id.
+            dir (str): Snapshotted directory.
+            snp_file (str): Snapshot file.
+            progress (SnapshotProgress): Final progress.
+            written (Optional[bool]): Whether the file was written, None if
+                the snapshot was cancelled.
+
+        Returns:
+            Optional[list[str]]: Registered snapshot files of the directory,
+                indexed by the worker, None if nothing was registered.
+        """
+        item = self.running_snapshots.pop(dir, None)
+        if item is not None:
+            item.remove()
+        if written is None:
+            self.notify(f"Cancelled snapshot of {dir}")
+            return None
+        dir_data = self.db.get_snapshot_dir(dir_id)
+        if not written or dir_data is None:
+            Path(snp_file).unlink(missing_ok=True)
+            self.notify(f"Failed to create snapshot file: {snp_file}", severity="error")
+            return None
+        self.db.update_snapshot_dir(dir_id, Path(snp_file).name, progress.entries)
+        if dir == self.selected_dir:
+            self._refresh_snapshot_list()
+        self.notify(f"Created snapshot file: {snp_file}")
+        return list(dir_data.snap_files)
+
     def action_compare_snapshots(self) -> None:
-        """Action to show compare snapshots dialog."""
+        """Action to compare the selected snapshots."""
         snapshot_list = self.query_one(SelectionList)
-        options = [
-            str(snapshot_list.get_option_at_index(snapshot).prompt)
-            for snapshot in snapshot_list.selected
-        ]
-        self.notify(f"{','.join(options)}")
+        if len(snapshot_list.selected) != MAX_SELECTED:
+            self.notify("Select two snapshots to compare.", severity="error")
+            return
+        snap_files = self.db.get_snapshot_dir_by_path(self.selected_dir).snap_files
+        # Compare the older snapshot against the newer one.
+        old_file, new_file = sorted(snapshot_list.selected, key=snap_files.index)
+        self.notify(f"Comparing {old_file} and {new_file}")
+        self._run_compare(old_file, new_file)
+
+    @work(thread=True, exclusive=True, group="compare")
+    def _run_compare(self, old_file: str, new_file: str) -> None:
+        """Compare two snapshot files in a worker thread.
+
+        Args:
+            old_file (str): Older snapshot file.
+            new_file (str): Newer snapshot file.
+        """
+        compare_data = compare_snapshot_files(
+            get_snp_file(old_file), get_snp_file(new_file)
+        )
+        self.call_from_thread(
+            self._show_compare, f"{old_file} -> {new_file}", compare_data
+        )
+
+    def _show_compare(self, title: str, compare_data: SnapshotTreeCompareData) -> None:
+        """Show a comparison result in the results tab.
+
+        Args:
+            title (str): Title of the comparison.
+            compare_data (SnapshotTreeCompareData): Comparison result.
+        """
+        self.query_one(CompareResultPanel).show(title, compare_data)
+        self.query_one(TabbedContent).active = "snapshot-result"
 
     @on(SelectionList.SelectionToggled, "#snapshots")
     def update_selected_snapshots(self, event: SelectionList.SelectionToggled) -> None:
@@ -0,0 +1,390 @@
+"""Cache module for results that are expensive to recompute."""
+
+import functools
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Hashable, Iterable, Optional
+
+from dir_snapshot import (
+    APP_COMPARE_CACHE_DIR,
+    COMPARE_CACHE_DISK_BUDGET,
+    COMPARE_CACHE_MEMORY_BUDGET,
+    instrument,
+)
+from dir_snapshot.hashing import hash_file
+from dir_snapshot.snpfile import SnpReader, is_snp_file
+from dir_snapshot.util import get_settings_dir
+
+
+def estimate_paths_size(paths: Iterable[str]) -> int:
+    """Estimate the memory held by a list of paths.
+
+    Args:
+        paths (Iterable[str]): Paths.
+
+    Returns:
+        int: Estimated bytes of the strings and the list slots.
+    """
+    return sum(sys.getsizeof(path) + 8 for path in paths)
+
+
+def estimate_result_size(result: dict) -> int:
+    """Estimate the memory held by a compare result dict.
+
+    Args:
+        result (dict): Lists of paths by category, collapsed directories as
+            lists starting with their path.
+
+    Returns:
+        int: Estimated bytes of the paths and the list slots.
+    """
+    return sum(
+        estimate_paths_size(
+            item if isinstance(item, str) else item[0] for item in paths
+        )
+        for paths in result.values()
+    )
+
+
+class LRUCache:
+    """Thread safe LRU cache with a budget in estimated bytes.
+
+    Entries are evicted least recently used first once the total size of
+    the entries exceeds the budget. An entry larger than the budget is not
+    stored at all.
+    """
+
+    def __init__(self, budget: int):
+        """Constructor method.
+
+        Args:
+            budget (int): Maximum total size of the entries in bytes.
+        """
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(
+        self, key: Hashable, validate: Optional[Callable[[Any], bool]] = None
+    ) -> Optional[Any]:
+        """Get an entry and mark it as recently used.
+
+        Args:
+            key (Hashable): Entry key.
+            validate (Optional[Callable[[Any], bool]]): Called with the cached
+                value; if it returns False the entry is dropped as stale.
+
+        Returns:
+            Optional[Any]: Cached value, None if missing or stale.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and validate is not None and not validate(entry[0]):
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    self._pop(key)
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: int) -> None:
+        """Store an entry, evicting least recently used entries as needed.
+
+        Args:
+            key (Hashable): Entry key.
+            value (Any): Value to cache.
+            size (int): Estimated size of the value in bytes.
+        """
+        with self._lock:
+            self._pop(key)
+            if size > self.budget:
+                return
+            self._entries[key] = value, size
+            self.size += size
+            self._evict()
+
+    def resize(self, budget: int) -> None:
+        """Change the budget, evicting entries if it shrinks.
+
+        Args:
+            budget (int): Maximum total size of the entries in bytes.
+        """
+        with self._lock:
+            self.budget = budget
+            self._evict()
+
+    def _evict(self) -> None:
+        while self.size > self.budget:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.size -= evicted
+            self.evictions += 1
+
+    def _pop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def discard(self, keys: Iterable[Hashable]) -> None:
+        """Remove entries if present.
+
+        Args:
+            keys (Iterable[Hashable]): Entry keys.
+        """
+        with self._lock:
+            for key in list(keys):
+                self._pop(key)
+
+    def keys(self) -> list[Hashable]:
+        """Get the keys from least to most recently used.
+
+        Returns:
+            list[Hashable]: Entry keys.
+        """
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict[str, int]:
+        """Get entry and size counts and hit statistics.
+
+        Returns:
+            dict[str, int]: Entries, size, budget, hits, misses and evictions.
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size": self.size,
+                "budget": self.budget,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def _path_digest(file: str) -> str:
+    """Get a short digest of a file path for cache file names.
+
+    Args:
+        file (str): File path.
+
+    Returns:
+        str: 16 hex digits.
+    """
+    return hashlib.blake2b(
+        file.encode("utf-8", "surrogateescape"), digest_size=8
+    ).hexdigest()
+
+
+class CompareCache:
+    """Cache of comparison results keyed by a pair of snapshot files.
+
+    Results are kept in an in-memory LRU cache and in JSON files under the
+    settings directory, so they survive restarts. Each result is stored
+    with fingerprints of both snapshot files, including the bases of delta
+    snapshots, and is only returned while they still match. Results are
+    stored as JSON serializable dicts.
+    """
+
+    def __init__(
+        self,
+        dir: Optional[Path] = None,
+        memory_budget: int = COMPARE_CACHE_MEMORY_BUDGET,
+        disk_budget: int = COMPARE_CACHE_DISK_BUDGET,
+    ):
+        """Constructor method.
+
+        Args:
+            dir (Optional[Path]): Cache directory, defaults to one in the
+                settings directory.
+            memory_budget (int): Maximum estimated bytes of results in memory.
+            disk_budget (int): Maximum bytes of result files on disk.
+        """
+        self.dir = dir or get_settings_dir() / APP_COMPARE_CACHE_DIR
+        self.disk_budget = disk_budget
+        self.memory = LRUCache(memory_budget)
+        self._fingerprints: dict[tuple, Optional[str]] = {}
+
+    def fingerprint(self, file: str) -> Optional[str]:
+        """Fingerprint the contents of a snapshot file and its delta bases.
+
+        Fingerprints are memoized while the size, mtime and inode of the
+        file are unchanged, so each file is only hashed once.
+
+        Args:
+            file (str): Snapshot file path.
+
+        Returns:
+            Optional[str]: Hex fingerprint, None if a file in the chain
+                cannot be read.
+        """
+        try:
+            st = os.stat(file)
+        except OSError:
+            return None
+        key = file, st.st_size, st.st_mtime_ns, st.st_ino
+        if key not in self._fingerprints:
+            self._fingerprints[key] = self._compute_fingerprint(file)
+        return self._fingerprints[key]
+
+    def _compute_fingerprint(self, file: str) -> Optional[str]:
+        digest = hash_file(file)
+        if not digest:
+            return None
+        fingerprint = f"{digest:016x}"
+        if is_snp_file(file):
+            try:
+                with SnpReader(file) as reader:
+                    base = reader.meta.get("base")
+            except (OSError, ValueError):
+                return None
+            if base is not None:
+                base_fingerprint = self.fingerprint(
+                    Path(file).with_name(base).as_posix()
+                )
+                if base_fingerprint is None:
+                    return None
+                fingerprint += "-" + base_fingerprint
+        return fingerprint
+
+    def _entry_file(self, file1: str, file2: str) -> Path:
+        return self.dir / f"{_path_digest(file1)}-{_path_digest(file2)}.json"
+
+    def get(self, file1: str, file2: str) -> Optional[dict]:
+        """Get the cached comparison of two snapshot files.
+
+        Args:
+            file1 (str): Older snapshot file.
+            file2 (str): Newer snapshot file.
+
+        Returns:
+            Optional[dict]: Cached result, None if missing or stale.
+        """
+        fingerprints = [self.fingerprint(file1), self.fingerprint(file2)]
+        if None in fingerprints:
+            return None
+        key = file1, file2, *fingerprints
+        result = self.memory.get(key)
+        if result is not None:
+            instrument.add("cache.compare_memory_hits")
+            return result
+
+        entry_file = self._entry_file(file1, file2)
+        try:
+            with open(entry_file, encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(entry_file)
+        except (OSError, ValueError):
+            instrument.add("cache.compare_misses")
+            return None
+        if (
+            entry.get("files") != [file1, file2]
+            or entry.get("fingerprints") != fingerprints
+        ):
+            instrument.add("cache.compare_misses")
+            return None
+        instrument.add("cache.compare_disk_hits")
+        result = entry["result"]
+        self.memory.put(key, result, estimate_result_size(result))
+        return result
+
+    def put(self, file1: str, file2: str, result: dict) -> None:
+        """Store the comparison of two snapshot files.
+
+        Args:
+            file1 (str): Older snapshot file.
+            file2 (str): Newer snapshot file.
+            result (dict): JSON serializable result.
+        """
+        fingerprints = [self.fingerprint(file1), self.fingerprint(file2)]
+        if None in fingerprints:
+            return
+        key = file1, file2, *fingerprints
+        self.memory.put(key, result, estimate_result_size(result))
+        entry = {
+            "files": [file1, file2],
+            "fingerprints": fingerprints,
+            "result": result,
+        }
+        try:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            fd, tmp_file = tempfile.mkstemp(suffix=".tmp", dir=self.dir)
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(entry, f)
+                os.replace(tmp_file, self._entry_file(file1, file2))
+            except BaseException:
+                Path(tmp_file).unlink(missing_ok=True)
+                raise
+            self._trim()
+        except OSError:
+            pass
+
+    def _trim(self) -> None:
+        """Delete the least recently used result files over the disk budget."""
+        entries = []
+        for entry_file in self.dir.glob("*.json"):
+            try:
+                st = entry_file.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, entry_file))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_file in sorted(entries):
+            if total <= self.disk_budget:
+                break
+            entry_file.unlink(missing_ok=True)
+            total -= size
+
+    def invalidate(self, files: Iterable[str]) -> None:
+        """Drop all results involving the given snapshot files.
+
+        Args:
+            files (Iterable[str]): Snapshot file paths.
+        """
+        files = set(files)
+        self.memory.discard(
+            key for key in self.memory.keys() if key[0] in files or key[1] in files
+        )
+        for file in files:
+            digest = _path_digest(file)
+            for pattern in (f"{digest}-*.json", f"*-{digest}.json"):
+                for entry_file in self.dir.glob(pattern):
+                    entry_file.unlink(missing_ok=True)
+
+
+@functools.cache
+def _compare_cache(dir: Path) -> CompareCache:
+    return CompareCache(dir)
+
+
+def get_compare_cache() -> CompareCache:
+    """Get the process-wide comparison cache of the settings directory.
+
+    Returns:
+        CompareCache: Comparison cache.
+    """
+    return _compare_cache(get_settings_dir() / APP_COMPARE_CACHE_DIR)
@@ -0,0 +1,245 @@
+"""Chunk store module to keep snapshot data once per distinct content.
+
+Chunks are immutable blobs named by the BLAKE2b digest of their content
+and stored zlib-compressed in a two-level directory tree, like git loose
+objects. Writing a chunk that is already stored only refreshes its
+mtime, so identical content shared by many snapshots takes space only
+once.
+
+Garbage collection runs without a lock against snapshot writers in other
+processes. A chunk written or reused by a snapshot that is not registered
+yet is unreferenced, so chunks younger than CHUNK_GC_GRACE are kept.
+
+Snapshots are only written to the store when the DIR_SNAPSHOT_CHUNKS
+environment variable is set, since building and reading manifests is
+slower than delta chains.
+"""
+
+import functools
+import hashlib
+import os
+import tempfile
+import time
+import zlib
+from pathlib import Path
+from typing import Iterable, Optional
+
+from dir_snapshot import APP_CHUNK_DIR, CHUNK_GC_GRACE, instrument
+from dir_snapshot.util import get_snapshot_dir
+
+CHUNK_DIGEST_SIZE = 16
+CHUNK_COMPRESS_LEVEL = 6
+CHUNK_STORE_ENV = "DIR_SNAPSHOT_CHUNKS"
+
+
+def chunk_digest(data: bytes) -> str:
+    """Get the name of a chunk.
+
+    Args:
+        data (bytes): Chunk content.
+
+    Returns:
+        str: Hex digest of the content.
+    """
+    return hashlib.blake2b(data, digest_size=CHUNK_DIGEST_SIZE).hexdigest()
+
+
+class ChunkStore:
+    """Content-addressed store of chunks in a directory."""
+
+    def __init__(self, dir: Path):
+        """Constructor method.
+
+        Args:
+            dir (Path): Store directory, created on the first write.
+        """
+        self.dir = dir
+
+    def _chunk_file(self, digest: str) -> Path:
+        return self.dir / digest[:2] / digest[2:]
+
+    def has(self, digest: str) -> bool:
+        """Check if a chunk is stored.
+
+        Args:
+            digest (str): Chunk digest.
+
+        Returns:
+            bool: True if the chunk is stored.
+        """
+        return self._chunk_file(digest).is_file()
+
+    def _touch(self, digest: str) -> bool:
+        """Refresh the mtime of a stored chunk, so gc keeps it for a while.
+
+        Args:
+            digest (str): Chunk digest.
+
+        Returns:
+            bool: True if the chunk is stored.
+        """
+        try:
+            os.utime(self._chunk_file(digest))
+        except OSError:
+            return False
+        return True
+
+    def put(self, data: bytes) -> str:
+        """Store a chunk unless it is already stored.
+
+        The chunk is written to a temporary file first and then renamed,
+        so concurrent writers of the same chunk never leave a partial file.
+        A chunk that is already stored gets a fresh mtime instead, so it is
+        not collected before the snapshot reusing it is registered.
+
+        Args:
+            data (bytes): Chunk content.
+
+        Returns:
+            str: Chunk digest.
+
+        Raises:
+            OSError: If the chunk cannot be written.
+        """
+        digest = chunk_digest(data)
+        if self._touch(digest):
+            instrument.add("chunks.reused")
+            return digest
+        chunk_file = self._chunk_file(digest)
+        chunk_file.parent.mkdir(parents=True, exist_ok=True)
+        compressed = zlib.compress(data, CHUNK_COMPRESS_LEVEL)
+        fd, tmp_file = tempfile.mkstemp(suffix=".tmp", dir=chunk_file.parent)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(compressed)
+            os.replace(tmp_file, chunk_file)
+        except BaseException:
+            Path(tmp_file).unlink(missing_ok=True)
+            raise
+        instrument.add("chunks.written")
+        instrument.add("chunks.bytes_written", len(compressed))
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        """Read a chunk.
+
+        Args:
+            digest (str): Chunk digest.
+
+        Returns:
+            bytes: Chunk content.
+
+        Raises:
+            OSError: If the chunk is missing.
+            ValueError: If the chunk is corrupt.
+        """
+        try:
+            data = zlib.decompress(self._chunk_file(digest).read_bytes())
+        except zlib.error as e:
+            raise ValueError(f"Corrupt chunk {digest}: {e}") from None
+        if chunk_digest(data) != digest:
+            raise ValueError(f"Corrupt chunk {digest}")
+        instrument.add("chunks.read")
+        return data
+
+    def digests(self) -> list[str]:
+        """List the stored chunks.
+
+        Returns:
+            list[str]: Chunk digests.
+        """
+        return [
+            chunk_file.parent.name + chunk_file.name
+            for chunk_file in self.dir.glob("??/*")
+            if "." not in chunk_file.name
+        ]
+
+    def size(self) -> int:
+        """Get the total size of the stored chunks on disk.
+
+        Returns:
+            int: Size in bytes.
+        """
+        total = 0
+        for chunk_file in self.dir.glob("??/*"):
+            try:
+                total += chunk_file.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    def remove_unreferenced(
+        self, referenced: Iterable[str], grace: float = CHUNK_GC_GRACE
+    ) -> int:
+        """Delete the chunks not referenced by any snapshot.
+
+        Chunks written or reused less than grace seconds ago are kept, since
+        they may belong to a snapshot that is not registered yet. A chunk is
+        renamed aside before it is deleted, and restored if a writer reused
+        it in the meantime, so a concurrent reuse never loses it.
+
+        Args:
+            referenced (Iterable[str]): Digests of all referenced chunks.
+            grace (float): Minimum age in seconds of deleted chunks.
+
+        Returns:
+            int: Number of chunks deleted.
+        """
+        referenced = set(referenced)
+        cutoff = time.time() - grace
+        removed = 0
+        for digest in self.digests():
+            if digest in referenced:
+                continue
+            chunk_file = self._chunk_file(digest)
+            gc_file = chunk_file.with_name(chunk_file.name + ".gc")
+            try:
+                if chunk_file.stat().st_mtime >= cutoff:
+                    continue
+                os.rename(chunk_file, gc_file)
+                if gc_file.stat().st_mtime >= cutoff:
+                    os.replace(gc_file, chunk_file)
+                    continue
+                gc_file.unlink()
+            except OSError:
+                continue
+            removed += 1
+        instrument.add("chunks.removed", removed)
+        return removed
+
+
+@functools.cache
+def open_chunk_store(dir: Path) -> ChunkStore:
+    """Get the process-wide chunk store of a directory.
+
+    Args:
+        dir (Path): Store directory.
+
+    Returns:
+        ChunkStore: Chunk store.
+    """
+    return ChunkStore(dir)
+
+
+def get_chunk_store() -> Optional[ChunkStore]:
+    """Get the process-wide chunk store of the snapshot directory.
+
+    Returns:
+        Optional[ChunkStore]: Chunk store, None if there's no snapshot directory.
+    """
+    snapshot_dir = get_snapshot_dir()
+    if snapshot_dir is None:
+        return None
+    return open_chunk_store(snapshot_dir / APP_CHUNK_DIR)
+
+
+def get_snapshot_store() -> Optional[ChunkStore]:
+    """Get the chunk store new snapshots are written to, if opted in.
+
+    Returns:
+        Optional[ChunkStore]: Chunk store, None unless DIR_SNAPSHOT_CHUNKS
+            is set, so snapshots are written as delta chains.
+    """
+    if not os.environ.get(CHUNK_STORE_ENV):
+        return None
+    return get_chunk_store()
@@ -0,0 +1,325 @@
+"""Command line module for Directory Snapshot App.
+
+Only the database and snapshot modules are imported here, so headless
+commands start quickly and work without a terminal. The Textual app is
+imported when the TUI is started.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from typing import Optional
+
+from dir_snapshot import BATCH_WORKERS, __app_name__, __version__, instrument
+from dir_snapshot.chunkstore import get_chunk_store, get_snapshot_store
+from dir_snapshot.db import SnapshotDirData, SQLiteSnapshotDB
+from dir_snapshot.pathindex import open_path_index, update_path_index
+from dir_snapshot.rules import compile_rules
+from dir_snapshot.scheduler import snapshot_all
+from dir_snapshot.snapshot import (
+    SnapshotProgress,
+    chunk_references,
+    compare_snapshot,
+    compare_snapshot_files,
+    generate_snp_filename,
+    get_snp_file,
+    read_snp_data,
+    take_snapshot,
+)
+
+
+def _find_dir(db: SQLiteSnapshotDB, path: str) -> Optional[SnapshotDirData]:
+    """Find a registered directory by path as given or resolved.
+
+    Args:
+        db (SQLiteSnapshotDB): Snapshot database.
+        path (str): Directory path.
+
+    Returns:
+        Optional[SnapshotDirData]: Snapshot Dir Data model.
+    """
+    return db.get_snapshot_dir_by_path(
+        Path(path).as_posix()
+    ) or db.get_snapshot_dir_by_path(Path(path).resolve().as_posix())
+
+
+def cmd_tui(args: argparse.Namespace) -> int:
+    """Start the Textual app."""
+    from dir_snapshot.app import DirSnapshotApp
+
+    DirSnapshotApp().run()
+    return 0
+
+
+def cmd_add(db: SQLiteSnapshotDB, args: argparse.Namespace) -> int:
+    """Add a directory."""
+    new_dir = Path(args.path).resolve()
+    if not new_dir.is_dir():
+        print(f"Directory {new_dir.as_posix()} does not exist.", file=sys.stderr)
+        return 1
+    if not db.add_snapshot_dir(new_dir.as_posix()):
+        print(f"{new_dir.as_posix()} already exists in database.", file=sys.stderr)
+        return 1
+    print(f"Added {new_dir.as_posix()}")
+    return 0
+
+
+def cmd_list(db: SQLiteSnapshotDB, args: argparse.Namespace) -> int:
+    """List directories, or the snapshots of one directory."""
+    if args.path is None:
+        for d in db.snapshot_dirs:
+            print(f"{d.id}\t{len(d.snap_files)}\t{d.path}")
+        return 0
+
+    d = _find_dir(db, args.path)
+    if d is None:
+        print(f"{args.path} is not in database.", file=sys.stderr)
+        return 1
+    for f in db.get_snapshot_files(d.id):
+        num_entries = "-" if f.num_entries is None else f.num_entries
+        print(f"{f.snap_file}\t{num_entries}")
+    return 0
+
+
+def cmd_snapshot(db: SQLiteSnapshotDB, args: argparse.Namespace) -> int:
+    """Take a snapshot of a directory."""
+    d = _find_dir(db, args.path)
+    if d is None:
+        print(f"{args.path} is not in database.", file=sys.stderr)
+        return 1
+
+    snp_file = generate_snp_filename(d.id)
+    base_file = get_snp_file(d.snap_files[-1]) if d.snap_files else None
+    progress = SnapshotProgress()
+    rules = compile_rules(d.rules)
+    if not take_snapshot(
+        d.path,
+        snp_file,
+        base_file,
+        progress=progress,
+        rules=rules,
+        store=get_snapshot_store(),
+    ):
+        print(f"Failed to create snapshot file: {snp_file}", file=sys.stderr)
+        return 1
+    db.update_snapshot_dir(d.id, Path(snp_file).name, progress.entries)
+    update_path_index(d.id, d.snap_files)
+    print(f"Created snapshot file: {snp_file} ({progress.entries} entries)")
+    return 0
+
+
+def cmd_snapshot_all(db: SQLiteSnapshotDB, args: argparse.Namespace) -> int:
+    """Take snapshots of all directories."""
+    failed = 0
+    for r in snapshot_all(db, args.workers):
+        if r.num_entries is None:
+            failed += 1
+            print(f"Failed to snapshot {r.dir}", file=sys.stderr)
+        else:
+            print(f"Created snapshot file: {r.snp_file} ({r.num_entries} entries)")
+    return 1 if failed else 0
+
+
+def cmd_rules(db: SQLiteSnapshotDB, args: argparse.Namespace) -> int:
+    """Show or set the exclude rules of a directory."""
+    d = _find_dir(db, args.path)
+    if d is None:
+        print(f"{args.path} is not in database.", file=sys.stderr)
+        return 1
+    if not args.patterns and not args.clear:
+        for rule in d.rules:
+            print(rule)
+        return 0
+
+    try:
+        compile_rules(args.patterns)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    db.set_snapshot_dir_rules(d.id, args.patterns)
+    print(f"Set {len(args.patterns)} rules for {d.path}")
+    return 0
+
+
+def cmd_history(db: SQLiteSnapshotDB, args: argparse.Namespace) -> int:
+    """Show the snapshots containing a path, or every path with a prefix."""
+    d = _find_dir(db, args.path)
+    if d is None:
+        print(f"{args.path} is not in database.", file=sys.stderr)
+        return 1
+    update_path_index(d.id, d.snap_files)
+    with open_path_index(d.id) as index:
+        snap_files = index.snap_files
+        if args.prefix:
+            histories = index.search(args.query)
+        else:
+            histories = index.history(args.query)
+    if not histories:
+        print(f"{args.query} is not in any snapshot.", file=sys.stderr)
+        return 1
+    for h in histories:
+        last = "-" if h.last_seen is None else snap_files[h.last_seen]
+        count = len(h.snapshots(len(snap_files)))
+        kind = "dir" if h.is_dir else "file"
+        print(f"{h.path}\t{kind}\t{snap_files[h.first_seen]}\t{last}\t{count}")
+    return 0
+
+
+def cmd_gc(db: SQLiteSnapshotDB, args: argparse.Namespace) -> int:
+    """Delete the chunks no registered snapshot refers to."""
+    snap_files = [get_snp_file(f) for d in db.snapshot_dirs for f in d.snap_files]
+    referenced = chunk_references(snap_files)
+    if referenced is None:
+        print("Failed to read all snapshot files, nothing deleted.", file=sys.stderr)
+        return 1
+    store = get_chunk_store()
+    if store is None:
+        print("Snapshot directory is not available.", file=sys.stderr)
+        return 1
+    removed = store.remove_unreferenced(referenced)
+    print(f"Deleted {removed} chunks, {len(referenced)} in use ({store.size()} bytes)")
+    return 0
+
+
+def cmd_compare(db: SQLiteSnapshotDB, args: argparse.Namespace) -> int:
+    """Compare two snapshots of a directory."""
+    d = _find_dir(db, args.path)
+    if d is None:
+        print(f"{args.path} is not in database.", file=sys.stderr)
+        return 1
+    snap_files = args.snap_files or d.snap_files[-2:]
+    if len(snap_files) != 2:
+        print("Two snapshots are needed to compare.", file=sys.stderr)
+        return 1
+    for snap_file in snap_files:
+        if snap_file not in d.snap_files:
+            print(f"{snap_file} is not a snapshot of {d.path}.", file=sys.stderr)
+            return 1
+
+    old_file, new_file = (get_snp_file(f) for f in snap_files)
+    if args.flat:
+        compare_data = compare_snapshot(
+            read_snp_data(old_file), read_snp_data(new_file)
+        )
+    else:
+        compare_data = compare_snapshot_files(old_file, new_file)
+    for title, paths in (
+        ("Added Directories", compare_data.added_dirs),
+        ("Added Files", compare_data.added_files),
+        ("Removed Directories", compare_data.removed_dirs),
+        ("Removed Files", compare_data.removed_files),
+        ("Modified Files", compare_data.modified_files),
+    ):
+        print(f"{title}: {len(paths)}")
+        for path in paths:
+            if isinstance(path, str):
+                print(f"  {path}")
+                continue
+            details = f"{path.dirs} dirs, {path.files} files"
+            if path.size is not None:
+                details += f", {path.size} bytes"
+            print(f"  {path.path}/ ({details})")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the command line parser.
+
+    Returns:
+        argparse.ArgumentParser: Parser with a subcommand per command.
+    """
+    parser = argparse.ArgumentParser(
+        prog=f"python -m {__app_name__}",
+        description="Take and compare directory snapshots. "
+        "Starts the TUI if no command is given.",
+    )
+    parser.add_argument("--version", action="version", version=__version__)
+    parser.add_argument(
+        "--stats",
+        metavar="FILE",
+        help="write timing spans and counters as JSON to FILE, - for stderr",
+    )
+    subparsers = parser.add_subparsers(title="commands")
+
+    sub = subparsers.add_parser("tui", help="start the TUI")
+    sub.set_defaults(func=cmd_tui)
+
+    sub = subparsers.add_parser("add", help="add a directory")
+    sub.add_argument("path")
+    sub.set_defaults(func=cmd_add)
+
+    sub = subparsers.add_parser("list", help="list directories or snapshots")
+    sub.add_argument("path", nargs="?", help="list snapshots of this directory")
+    sub.set_defaults(func=cmd_list)
+
+    sub = subparsers.add_parser("snapshot", help="take a snapshot of a directory")
+    sub.add_argument("path")
+    sub.set_defaults(func=cmd_snapshot)
+
+    sub = subparsers.add_parser("snapshot-all", help="snapshot all directories")
+    sub.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    sub.set_defaults(func=cmd_snapshot_all)
+
+    sub = subparsers.add_parser(
+        "rules", help="show or set exclude rules of a directory"
+    )
+    sub.add_argument("path")
+    sub.add_argument(
+        "patterns",
+        nargs="*",
+        help="rules in .gitignore syntax, e.g. .git node_modules/",
+    )
+    sub.add_argument("--clear", action="store_true", help="remove all rules")
+    sub.set_defaults(func=cmd_rules)
+
+    sub = subparsers.add_parser(
+        "history", help="show the first and last snapshots containing a path"
+    )
+    sub.add_argument("path")
+    sub.add_argument("query", help="path relative to the directory")
+    sub.add_argument(
+        "--prefix", action="store_true", help="show all paths starting with query"
+    )
+    sub.set_defaults(func=cmd_history)
+
+    sub = subparsers.add_parser("gc", help="delete stored chunks of removed snapshots")
+    sub.set_defaults(func=cmd_gc)
+
+    sub = subparsers.add_parser("compare", help="compare two snapshots")
+    sub.add_argument("path")
+    sub.add_argument(
+        "snap_files", nargs="*", help="two snapshot files, defaults to the last two"
+    )
+    sub.add_argument(
+        "--flat",
+        action="store_true",
+        help="list every path below added and removed directories",
+    )
+    sub.set_defaults(func=cmd_compare)
+    return parser
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """Run a command.
+
+    Args:
+        argv (Optional[list[str]]): Arguments, defaults to sys.argv[1:].
+
+    Returns:
+        int: Exit status.
+    """
+    args = build_parser().parse_args(argv)
+    func = getattr(args, "func", None)
+    if func is None or func is cmd_tui:
+        return cmd_tui(args)
+    if args.stats:
+        instrument.enable()
+    db = SQLiteSnapshotDB()
+    try:
+        return func(db, args)
+    finally:
+        db.close()
+        if args.stats == "-":
+            print(instrument.dump_json(), file=sys.stderr)
+        elif args.stats:
+            instrument.dump_json(args.stats)
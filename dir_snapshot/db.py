@@ -1,10 +1,27 @@
 """Database module for Directory Snapshot App."""
 
 import json
-from dataclasses import dataclass, asdict
-from typing import Optional
-
-from dir_snapshot.util import delete_files, get_db_file
+import sqlite3
+import time
+from dataclasses import dataclass, asdict, field
+from typing import Iterable, Optional
+
+from dir_snapshot import instrument
+from dir_snapshot.cache import get_compare_cache
+from dir_snapshot.util import (
+    delete_files,
+    get_db_file,
+    get_path_index_file,
+    get_snapshot_dir,
+    get_sqlite_db_file,
+)
+
+# Ids use AUTOINCREMENT, so the ids of deleted directories are never reused.
+DIRS_TABLE = (
+    "CREATE TABLE {name} ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT NOT NULL UNIQUE, "
+    "rules TEXT NOT NULL DEFAULT '[]')"
+)
 
 
 @dataclass
@@ -12,6 +29,8 @@ class SnapshotDirData:
     id: int
     path: str
     snap_files: list[str]
+    # Exclude rules in .gitignore syntax applied when taking snapshots.
+    rules: list[str] = field(default_factory=list)
 
 
 @dataclass
@@ -19,13 +38,20 @@ class SnapshotListData:
     dirs: list[SnapshotDirData]
 
 
+@dataclass
+class SnapshotFileData:
+    snap_file: str
+    created_at: float
+    num_entries: Optional[int]
+
+
 class SnapshotDB:
     """Snapshot database class."""
 
     def __init__(self):
         """Constructor method."""
         self._db_file = get_db_file()
-        self._snapshot_data = self._load_data()
+        self._build_indexes(self._load_data(), self._load_next_id())
 
     @property
     def snapshot_data(self) -> SnapshotListData:
@@ -34,16 +60,17 @@ class SnapshotDB:
         Returns:
             SnapshotListData: Snapshot List Data model.
         """
-        return self._snapshot_data
+        return SnapshotListData(dirs=self.snapshot_dirs)
 
     @property
     def snapshot_dirs(self) -> list[SnapshotDirData]:
         """Get snapshot directories.
 
         Returns:
-            list[SnapshotDirData]: List of Snapshot Dir Data models.
+            list[SnapshotDirData]: List of Snapshot Dir Data models, in the
+                order they were added.
         """
-        return self._snapshot_data.dirs
+        return list(self._dirs_by_id.values())
 
     @property
     def db_file(self) -> str:
@@ -61,7 +88,7 @@ class SnapshotDB:
         Returns:
             int: Number of snapshot directories.
         """
-        return len(self.snapshot_dirs)
+        return len(self._dirs_by_id)
 
     @property
     def is_empty(self) -> bool:
@@ -89,6 +116,32 @@ class SnapshotDB:
             _snapshot_data = SnapshotListData(dirs=[])
         return _snapshot_data
 
+    def _load_next_id(self) -> int:
+        """Load the stored next directory id from database file.
+
+        Returns:
+            int: Next directory id, 0 if none is stored.
+        """
+        try:
+            with self._db_file.open("r") as f:
+                return json.load(f).get("next_id", 0)
+        except json.JSONDecodeError:
+            return 0
+
+    def _build_indexes(self, snapshot_data: SnapshotListData, next_id: int) -> None:
+        """Build id and path indexes of the loaded snapshot directories.
+
+        The id index keeps insertion order and is the only list of records,
+        so adding and deleting a directory are dict operations.
+
+        Args:
+            snapshot_data (SnapshotListData): Loaded Snapshot List Data model.
+            next_id (int): Stored next directory id.
+        """
+        self._dirs_by_id = {d.id: d for d in snapshot_data.dirs}
+        self._dirs_by_path = {d.path: d for d in snapshot_data.dirs}
+        self._next_id = max(next_id, max(self._dirs_by_id, default=-1) + 1)
+
     def _is_dir_in_db(self, dir: str) -> bool:
         """Check if directory is in database.
 
@@ -98,18 +151,20 @@ class SnapshotDB:
         Returns:
             bool: True if directory is in database.
         """
-        return dir in [d.path for d in self.snapshot_dirs]
+        return dir in self._dirs_by_path
 
     def _get_last_id(self) -> int:
-        """Get last directory id.
+        """Get next free directory id.
+
+        Ids are not reused after a directory is deleted, since the next id
+        is stored with the database.
 
         Returns:
-            int: Last directory id.
+            int: Next free directory id.
         """
-        if self.is_empty:
-            return 0
-        return max([d.id for d in self.snapshot_dirs]) + 1
+        return self._next_id
 
+    @instrument.timed("db.save")
     def save_data(self) -> bool:
         """Save snapshot data to database file.
 
@@ -118,7 +173,7 @@ class SnapshotDB:
         """
         try:
             with self._db_file.open("w") as f:
-                json.dump(asdict(self._snapshot_data), f)
+                json.dump({**asdict(self.snapshot_data), "next_id": self._next_id}, f)
         except OSError:
             return False
         return True
@@ -132,7 +187,7 @@ class SnapshotDB:
         Returns:
             Optional[SnapshotDirData]: Snapshot Dir Data model.
         """
-        return next((d for d in self.snapshot_dirs if d.id == id), None)
+        return self._dirs_by_id.get(id)
 
     def get_snapshot_dir_by_path(self, path: str) -> Optional[SnapshotDirData]:
         """Get snapshot directory by path.
@@ -143,7 +198,7 @@ class SnapshotDB:
         Returns:
             Optional[SnapshotDirData]: Snapshot Dir Data model.
         """
-        return next((d for d in self.snapshot_dirs if d.path == path), None)
+        return self._dirs_by_path.get(path)
 
     def get_id_by_path(self, path: str) -> Optional[int]:
         """Get directory id by path.
@@ -154,7 +209,8 @@ class SnapshotDB:
         Returns:
             Optional[int]: Directory id.
         """
-        return next((d.id for d in self.snapshot_dirs if d.path == path), None)
+        d = self._dirs_by_path.get(path)
+        return d.id if d is not None else None
 
     def add_snapshot_dir(self, dir: str) -> bool:
         """Add snapshot directory to database.
@@ -167,35 +223,318 @@ class SnapshotDB:
         """
         if not self._is_dir_in_db(dir):
             dir_data = SnapshotDirData(id=self._get_last_id(), path=dir, snap_files=[])
-            self._snapshot_data.dirs.append(dir_data)
+            self._dirs_by_id[dir_data.id] = dir_data
+            self._dirs_by_path[dir_data.path] = dir_data
+            self._next_id += 1
             return True
         return False
 
-    def update_snapshot_dir(self, id: int, snap_file: str) -> None:
+    def update_snapshot_dir(
+        self, id: int, snap_file: str, num_entries: Optional[int] = None
+    ) -> None:
         """Update snapshot dir with new snapshot file.
 
         Args:
             id (int): Snapshot dir id.
             snap_file (str): Snapshot file.
+            num_entries (Optional[int]): Number of entries in the snapshot.
+
+        """
+        d = self._dirs_by_id.get(id)
+        if d is not None:
+            d.snap_files.append(snap_file)
+
+    def update_snapshot_dirs(
+        self, snapshots: Iterable[tuple[int, str, Optional[int]]]
+    ) -> None:
+        """Update snapshot dirs with new snapshot files in one batch.
+
+        Args:
+            snapshots (Iterable[tuple[int, str, Optional[int]]]): Snapshot dir
+                ids, snapshot files and numbers of entries.
+        """
+        for id, snap_file, num_entries in snapshots:
+            self.update_snapshot_dir(id, snap_file, num_entries)
+
+    def set_snapshot_dir_rules(self, id: int, rules: list[str]) -> bool:
+        """Set the exclude rules of a snapshot directory.
+
+        Args:
+            id (int): Snapshot dir id.
+            rules (list[str]): Rules in .gitignore syntax.
 
+        Returns:
+            bool: True if the rules were set.
         """
-        for idx, d in enumerate(self.snapshot_dirs):
-            if d.id == id:
-                self._snapshot_data.dirs[idx].snap_files.append(snap_file)
-                break
+        d = self._dirs_by_id.get(id)
+        if d is None:
+            return False
+        d.rules = list(rules)
+        return True
 
     def delete_snapshot_dir(self, id: int) -> bool:
         """Delete snapshot directory from database.
 
+        Its snapshot files are deleted and cached comparisons of them are
+        dropped.
+
         Args:
             id (int): Snapshot dir id.
 
         Returns:
             bool: True if its deleted.
         """
-        for idx, d in enumerate(self.snapshot_dirs):
-            if d.id == id:
-                self._snapshot_data.dirs.pop(idx)
-                return delete_files(d.snap_files)
+        d = self._dirs_by_id.pop(id, None)
+        if d is None:
+            return False
+        del self._dirs_by_path[d.path]
+        # Registered names may be relative to the snapshot directory.
+        snap_files = [(get_snapshot_dir() / f).as_posix() for f in d.snap_files]
+        get_compare_cache().invalidate(snap_files)
+        index_file = get_path_index_file(id)
+        for suffix in ("", "-wal", "-shm"):
+            index_file.with_name(index_file.name + suffix).unlink(missing_ok=True)
+        return delete_files(snap_files)
+
+
+class SQLiteSnapshotDB(SnapshotDB):
+    """Snapshot database class backed by SQLite.
+
+    The database runs in WAL mode and every add, update or delete commits
+    its own transaction, so nothing is lost if the app exits without
+    saving. Directories are also kept in memory for the public API. An
+    existing JSON database is imported the first time the database is
+    created.
+    """
+
+    def __init__(self):
+        """Constructor method."""
+        self._db_file = get_sqlite_db_file()
+        # The app opens the database in a worker thread and then only uses
+        # it from the UI thread, so the connection must not be thread bound.
+        self._conn = sqlite3.connect(self._db_file, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute(DIRS_TABLE.format(name="IF NOT EXISTS dirs"))
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "dir_id INTEGER NOT NULL REFERENCES dirs (id) ON DELETE CASCADE, "
+                "snap_file TEXT NOT NULL, created_at REAL NOT NULL, "
+                "num_entries INTEGER)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS snapshots_dir_id ON snapshots (dir_id, id)"
+            )
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version == 1:
+                self._conn.execute(
+                    "ALTER TABLE dirs ADD COLUMN rules TEXT NOT NULL DEFAULT '[]'"
+                )
+            if version in (1, 2):
+                self._rebuild_dirs()
+            elif version == 0:
+                self._import_json()
+            self._conn.execute("PRAGMA user_version = 3")
+        # Enabled after the upgrade, so rebuilding dirs keeps the snapshots.
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._build_indexes(self._load_data(), self._load_next_id())
+
+    def _rebuild_dirs(self) -> None:
+        """Rebuild the dirs table of version 1 and 2 databases with AUTOINCREMENT.
+
+        The highest id ever used is kept in sqlite_sequence then, so ids of
+        deleted directories are not reused after reopening.
+        """
+        self._conn.execute(DIRS_TABLE.format(name="dirs_new"))
+        self._conn.execute("INSERT INTO dirs_new SELECT id, path, rules FROM dirs")
+        self._conn.execute("DROP TABLE dirs")
+        self._conn.execute("ALTER TABLE dirs_new RENAME TO dirs")
+
+    def _import_json(self) -> None:
+        """Import directories and snapshot files of the JSON database."""
+        json_db = SnapshotDB()
+        for d in json_db.snapshot_dirs:
+            self._conn.execute(
+                "INSERT INTO dirs VALUES (?, ?, ?)",
+                (d.id, d.path, json.dumps(d.rules)),
+            )
+            self._conn.executemany(
+                "INSERT INTO snapshots (dir_id, snap_file, created_at) "
+                "VALUES (?, ?, ?)",
+                ((d.id, snap_file, time.time()) for snap_file in d.snap_files),
+            )
+        # Keep the ids the JSON database used for deleted directories.
+        next_id = json_db._get_last_id()
+        if next_id:
+            self._conn.execute("DELETE FROM sqlite_sequence WHERE name = 'dirs'")
+            self._conn.execute(
+                "INSERT INTO sqlite_sequence (name, seq) VALUES ('dirs', ?)",
+                (next_id - 1,),
+            )
 
-        return False
+    def _load_data(self) -> SnapshotListData:
+        """Load snapshot data from database file.
+
+        Returns:
+            SnapshotListData: Snapshot List Data model.
+        """
+        _snapshot_data = SnapshotListData(dirs=[])
+        dirs = {}
+        for id, path, rules in self._conn.execute(
+            "SELECT id, path, rules FROM dirs ORDER BY id"
+        ):
+            dirs[id] = SnapshotDirData(
+                id=id, path=path, snap_files=[], rules=json.loads(rules)
+            )
+            _snapshot_data.dirs.append(dirs[id])
+        for dir_id, snap_file in self._conn.execute(
+            "SELECT dir_id, snap_file FROM snapshots ORDER BY id"
+        ):
+            dirs[dir_id].snap_files.append(snap_file)
+        return _snapshot_data
+
+    def _load_next_id(self) -> int:
+        """Load the next directory id from the AUTOINCREMENT sequence.
+
+        Returns:
+            int: Next directory id, 0 if no directory was ever added.
+        """
+        row = self._conn.execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'dirs'"
+        ).fetchone()
+        return row[0] + 1 if row is not None else 0
+
+    def close(self) -> None:
+        """Close database."""
+        self._conn.close()
+
+    @instrument.timed("db.save")
+    def save_data(self) -> bool:
+        """Checkpoint the write-ahead log into the database file.
+
+        Changes are already committed by each operation.
+
+        Returns:
+            bool: True if save was successful.
+        """
+        try:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error:
+            return False
+        return True
+
+    def get_snapshot_files(self, id: int) -> list[SnapshotFileData]:
+        """Get snapshot files of a directory with their metadata.
+
+        Args:
+            id (int): Snapshot dir id.
+
+        Returns:
+            list[SnapshotFileData]: Snapshot File Data models, oldest first.
+        """
+        rows = self._conn.execute(
+            "SELECT snap_file, created_at, num_entries FROM snapshots "
+            "WHERE dir_id = ? ORDER BY id",
+            (id,),
+        )
+        return [SnapshotFileData(*row) for row in rows]
+
+    @instrument.timed("db.write")
+    def add_snapshot_dir(self, dir: str) -> bool:
+        """Add snapshot directory to database.
+
+        Args:
+            dir (str): Directory to add.
+
+        Returns:
+            bool: True if directory was added.
+        """
+        if self._is_dir_in_db(dir):
+            return False
+        id = self._get_last_id()
+        try:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO dirs (id, path) VALUES (?, ?)", (id, dir)
+                )
+        except sqlite3.IntegrityError:
+            return False
+        return super().add_snapshot_dir(dir)
+
+    @instrument.timed("db.write")
+    def update_snapshot_dir(
+        self, id: int, snap_file: str, num_entries: Optional[int] = None
+    ) -> None:
+        """Update snapshot dir with new snapshot file.
+
+        Args:
+            id (int): Snapshot dir id.
+            snap_file (str): Snapshot file.
+            num_entries (Optional[int]): Number of entries in the snapshot.
+
+        """
+        if self.get_snapshot_dir(id) is None:
+            return
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO snapshots (dir_id, snap_file, created_at, num_entries) "
+                "VALUES (?, ?, ?, ?)",
+                (id, snap_file, time.time(), num_entries),
+            )
+        super().update_snapshot_dir(id, snap_file, num_entries)
+
+    @instrument.timed("db.write")
+    def update_snapshot_dirs(
+        self, snapshots: Iterable[tuple[int, str, Optional[int]]]
+    ) -> None:
+        """Update snapshot dirs with new snapshot files in one transaction.
+
+        Args:
+            snapshots (Iterable[tuple[int, str, Optional[int]]]): Snapshot dir
+                ids, snapshot files and numbers of entries.
+        """
+        snapshots = [s for s in snapshots if self.get_snapshot_dir(s[0]) is not None]
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO snapshots (dir_id, snap_file, created_at, num_entries) "
+                "VALUES (?, ?, ?, ?)",
+                ((id, snap_file, now, n) for id, snap_file, n in snapshots),
+            )
+        for id, snap_file, _ in snapshots:
+            self._dirs_by_id[id].snap_files.append(snap_file)
+
+    @instrument.timed("db.write")
+    def set_snapshot_dir_rules(self, id: int, rules: list[str]) -> bool:
+        """Set the exclude rules of a snapshot directory.
+
+        Args:
+            id (int): Snapshot dir id.
+            rules (list[str]): Rules in .gitignore syntax.
+
+        Returns:
+            bool: True if the rules were set.
+        """
+        if self.get_snapshot_dir(id) is None:
+            return False
+        with self._conn:
+            self._conn.execute(
+                "UPDATE dirs SET rules = ? WHERE id = ?", (json.dumps(rules), id)
+            )
+        return super().set_snapshot_dir_rules(id, rules)
+
+    @instrument.timed("db.write")
+    def delete_snapshot_dir(self, id: int) -> bool:
+        """Delete snapshot directory from database.
+
+        Args:
+            id (int): Snapshot dir id.
+
+        Returns:
+            bool: True if its deleted.
+        """
+        with self._conn:
+            self._conn.execute("DELETE FROM dirs WHERE id = ?", (id,))
+        return super().delete_snapshot_dir(id)
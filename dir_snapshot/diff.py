@@ -0,0 +1,370 @@
+"""Diff module to compare sorted path lists."""
+
+import itertools
+import operator
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Iterator, Optional, Union
+
+MERGE_BLOCK = 256
+
+
+def is_sorted(paths: list[str]) -> bool:
+    """Check if paths are in ascending order.
+
+    Args:
+        paths (list[str]): List of paths.
+
+    Returns:
+        bool: True if paths are sorted.
+    """
+    return all(map(operator.le, paths, itertools.islice(paths, 1, None)))
+
+
+def _add_run(runs: Optional[list], i: int, j: int, length: int) -> None:
+    """Record a run of common paths, extending the previous run if adjacent.
+
+    Args:
+        runs (Optional[list]): List of (old index, new index, length) runs.
+        i (int): Start index in the old list.
+        j (int): Start index in the new list.
+        length (int): Run length.
+    """
+    if runs is None:
+        return
+    if runs:
+        last_i, last_j, last_length = runs[-1]
+        if last_i + last_length == i and last_j + last_length == j:
+            runs[-1] = (last_i, last_j, last_length + length)
+            return
+    runs.append((i, j, length))
+
+
+def diff_sorted(
+    old: list[str], new: list[str], runs: Optional[list] = None
+) -> tuple[list[str], list[str]]:
+    """Diff two sorted lists of unique paths with a linear merge.
+
+    Identical runs are skipped a block at a time with list slice comparisons,
+    so nearly identical lists are compared mostly at C speed and only the
+    changed regions are merged element by element.
+
+    Args:
+        old (list[str]): Sorted paths of the old snapshot.
+        new (list[str]): Sorted paths of the new snapshot.
+        runs (Optional[list]): If given, receives (old index, new index, length)
+            runs of paths present in both lists.
+
+    Returns:
+        tuple[list[str], list[str]]: Sorted added and removed paths.
+    """
+    added = []
+    removed = []
+    i = j = 0
+    old_len = len(old)
+    new_len = len(new)
+
+    while i < old_len and j < new_len:
+        if old[i : i + MERGE_BLOCK] == new[j : j + MERGE_BLOCK]:
+            step = min(MERGE_BLOCK, old_len - i)
+            _add_run(runs, i, j, step)
+            i += step
+            j += step
+            continue
+
+        for _ in range(MERGE_BLOCK):
+            if i == old_len or j == new_len:
+                break
+            old_path = old[i]
+            new_path = new[j]
+            if old_path == new_path:
+                _add_run(runs, i, j, 1)
+                i += 1
+                j += 1
+            elif old_path < new_path:
+                removed.append(old_path)
+                i += 1
+            else:
+                added.append(new_path)
+                j += 1
+
+    removed.extend(old[i:])
+    added.extend(new[j:])
+    return added, removed
+
+
+def diff_paths(old: list[str], new: list[str]) -> tuple[list[str], list[str]]:
+    """Diff two lists of unique paths regardless of their order.
+
+    Args:
+        old (list[str]): Paths of the old snapshot.
+        new (list[str]): Paths of the new snapshot.
+
+    Returns:
+        tuple[list[str], list[str]]: Sorted added and removed paths.
+    """
+    if old == new:
+        return [], []
+    if not is_sorted(old):
+        old = sorted(old)
+    if not is_sorted(new):
+        new = sorted(new)
+    return diff_sorted(old, new)
+
+
+def identical_subtrees(
+    old_dirs: list[str],
+    old_hashes: array,
+    new_dirs: list[str],
+    new_hashes: array,
+) -> list[str]:
+    """Find the topmost directories whose tree hashes match in both snapshots.
+
+    Directories are visited in sorted order and the subtree of a matching
+    directory is skipped by binary search, so unchanged regions cost one
+    lookup per topmost unchanged directory.
+
+    Args:
+        old_dirs (list[str]): Sorted directories of the old snapshot.
+        old_hashes (array): Tree hashes aligned with old_dirs.
+        new_dirs (list[str]): Sorted directories of the new snapshot.
+        new_hashes (array): Tree hashes aligned with new_dirs.
+
+    Returns:
+        list[str]: Sorted directories with identical subtrees, none nested.
+    """
+    identical = []
+    skips = []
+    j = 0
+    while j < len(new_dirs):
+        if skips and j == skips[-1][0]:
+            j = skips.pop()[1]
+            continue
+        path = new_dirs[j]
+        i = bisect_left(old_dirs, path)
+        if i < len(old_dirs) and old_dirs[i] == path and old_hashes[i] == new_hashes[j]:
+            identical.append(path)
+            # Paths under path sort in [path + "/", path + "0"), but paths
+            # like "a!b" may sort between "a" and its subtree.
+            start = bisect_left(new_dirs, path + "/", j + 1)
+            end = bisect_left(new_dirs, path + "0", start)
+            if start < end:
+                skips.append((start, end))
+        j += 1
+    return identical
+
+
+def diff_pruned(
+    old: list[str], new: list[str], prefixes: list[str], runs: Optional[list] = None
+) -> tuple[list[str], list[str]]:
+    """Diff two sorted lists of unique paths, skipping identical subtrees.
+
+    Paths under each prefix directory are skipped in both lists, e.g.
+    because they are known to be identical or are reported as a whole. They
+    form one contiguous range per list, so only the ranges between them are
+    merged.
+
+    Args:
+        old (list[str]): Sorted paths of the old snapshot.
+        new (list[str]): Sorted paths of the new snapshot.
+        prefixes (list[str]): Directories whose subtrees to skip, none nested.
+        runs (Optional[list]): If given, receives (old index, new index, length)
+            runs of common paths outside the skipped subtrees.
+
+    Returns:
+        tuple[list[str], list[str]]: Sorted added and removed paths.
+    """
+    if not prefixes:
+        return diff_sorted(old, new, runs)
+
+    added = []
+    removed = []
+    i = j = 0
+    for key in [*sorted(p + "/" for p in prefixes), None]:
+        if key is None:
+            i_end = len(old)
+            j_end = len(new)
+        else:
+            # Adjacent subtrees are common, so check for an empty gap first.
+            i_end = i if i == len(old) or old[i] >= key else bisect_left(old, key, i)
+            j_end = j if j == len(new) or new[j] >= key else bisect_left(new, key, j)
+        if i < i_end or j < j_end:
+            segment_runs = [] if runs is not None else None
+            segment_added, segment_removed = diff_sorted(
+                old[i:i_end], new[j:j_end], segment_runs
+            )
+            added += segment_added
+            removed += segment_removed
+            for run_i, run_j, length in segment_runs or ():
+                _add_run(runs, run_i + i, run_j + j, length)
+        if key is None:
+            break
+        end = key[:-1] + "0"
+        i = bisect_left(old, end, i_end)
+        j = bisect_left(new, end, j_end)
+    return added, removed
+
+
+def diff_columns(
+    old_columns: list[array], new_columns: list[array], runs: list
+) -> list[int]:
+    """Find rows of common paths whose column values differ.
+
+    Runs are compared a block at a time with array slice comparisons, and
+    only blocks that differ are checked row by row.
+
+    Args:
+        old_columns (list[array]): Columns of the old snapshot.
+        new_columns (list[array]): Columns of the new snapshot, in the same order.
+        runs (list): (old index, new index, length) runs from diff_sorted.
+
+    Returns:
+        list[int]: Sorted indices into the new snapshot of rows that differ.
+    """
+    columns = list(zip(old_columns, new_columns))
+    changed = []
+    for i, j, length in runs:
+        for offset in range(0, length, MERGE_BLOCK):
+            n = min(MERGE_BLOCK, length - offset)
+            a = i + offset
+            b = j + offset
+            if all(old[a : a + n] == new[b : b + n] for old, new in columns):
+                continue
+            for k in range(n):
+                if any(old[a + k] != new[b + k] for old, new in columns):
+                    changed.append(b + k)
+    return changed
+
+
+def apply_delta(
+    paths: list[str],
+    columns: list[array],
+    removed: list[str],
+    upsert_paths: list[str],
+    upsert_columns: list[array],
+) -> tuple[list[str], list[array]]:
+    """Apply removed and upserted rows to sorted paths and their columns.
+
+    Change positions are found by binary search and the unchanged rows
+    between them are copied as list and array slices, so the cost is
+    dominated by memory copies rather than per-row work.
+
+    Args:
+        paths (list[str]): Sorted base paths.
+        columns (list[array]): Base columns aligned with paths.
+        removed (list[str]): Paths to remove.
+        upsert_paths (list[str]): Sorted paths to add or replace.
+        upsert_columns (list[array]): Columns aligned with upsert_paths.
+
+    Returns:
+        tuple[list[str], list[array]]: Sorted paths and their columns.
+    """
+    events = []
+    for path in removed:
+        idx = bisect_left(paths, path)
+        if idx < len(paths) and paths[idx] == path:
+            events.append((idx, 1, -1))
+    for k, path in enumerate(upsert_paths):
+        idx = bisect_left(paths, path)
+        replace = idx < len(paths) and paths[idx] == path
+        events.append((idx, int(replace), k))
+    events.sort()
+
+    out_paths = []
+    out_columns = [array(col.typecode) for col in columns]
+    pos = 0
+    for idx, consumes, k in events:
+        if pos < idx:
+            out_paths += paths[pos:idx]
+            for out, col in zip(out_columns, columns):
+                out.extend(col[pos:idx])
+            pos = idx
+        if k >= 0:
+            out_paths.append(upsert_paths[k])
+            for out, col in zip(out_columns, upsert_columns):
+                out.append(col[k])
+        if consumes:
+            pos = idx + 1
+    out_paths += paths[pos:]
+    for out, col in zip(out_columns, columns):
+        out.extend(col[pos:])
+    return out_paths, out_columns
+
+
+def _row_path(row: Union[str, tuple]) -> str:
+    return row if isinstance(row, str) else row[0]
+
+
+def merge_delta(
+    rows: Iterable[Union[str, tuple]],
+    removed: Iterable[str],
+    upserts: Iterable[Union[str, tuple]],
+) -> Iterator[Union[str, tuple]]:
+    """Apply removed and upserted rows to a stream of sorted rows.
+
+    Streaming counterpart of apply_delta for rows read a block at a time,
+    so memory does not grow with the number of rows.
+
+    Args:
+        rows (Iterable[Union[str, tuple]]): Sorted base rows, paths or
+            (path, *values) tuples.
+        removed (Iterable[str]): Sorted paths to remove.
+        upserts (Iterable[Union[str, tuple]]): Sorted rows to add or replace.
+
+    Yields:
+        Union[str, tuple]: Sorted rows.
+    """
+    removed = iter(removed)
+    upserts = iter(upserts)
+    next_removed = next(removed, None)
+    upsert = next(upserts, None)
+    for row in rows:
+        path = _row_path(row)
+        while upsert is not None and _row_path(upsert) < path:
+            yield upsert
+            upsert = next(upserts, None)
+        if upsert is not None and _row_path(upsert) == path:
+            yield upsert
+            upsert = next(upserts, None)
+            continue
+        while next_removed is not None and next_removed < path:
+            next_removed = next(removed, None)
+        if next_removed != path:
+            yield row
+    if upsert is not None:
+        yield upsert
+        yield from upserts
+
+
+def diff_rows(
+    old: Iterable[Union[str, tuple]], new: Iterable[Union[str, tuple]]
+) -> Iterator[tuple[bool, Union[str, tuple]]]:
+    """Diff two streams of sorted rows with a linear merge.
+
+    Rows are paths or (path, *values) tuples, and a row present in both
+    streams is changed if any of its values differ.
+
+    Args:
+        old (Iterable[Union[str, tuple]]): Sorted rows of the old snapshot.
+        new (Iterable[Union[str, tuple]]): Sorted rows of the new snapshot.
+
+    Yields:
+        tuple[bool, Union[str, tuple]]: (False, path) for removed rows and
+            (True, row) for added or changed rows, in path order.
+    """
+    old = iter(old)
+    old_row = next(old, None)
+    for new_row in new:
+        path = _row_path(new_row)
+        while old_row is not None and _row_path(old_row) < path:
+            yield False, _row_path(old_row)
+            old_row = next(old, None)
+        if old_row is not None and _row_path(old_row) == path:
+            if old_row != new_row:
+                yield True, new_row
+            old_row = next(old, None)
+        else:
+            yield True, new_row
+    while old_row is not None:
+        yield False, _row_path(old_row)
+        old_row = next(old, None)
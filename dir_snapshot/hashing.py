@@ -0,0 +1,212 @@
+"""Hashing module to hash file contents with a persistent cache."""
+
+import hashlib
+import itertools
+import mmap
+import multiprocessing
+import os
+import sqlite3
+import stat
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from dir_snapshot import (
+    APP_HASH_CACHE_FILE,
+    HASH_BATCH_SIZE,
+    HASH_WORKERS,
+    instrument,
+)
+from dir_snapshot.util import get_settings_dir
+from dir_snapshot.walker import WalkEntry
+
+HASH_DIGEST_SIZE = 8
+READ_BUFFER_SIZE = 1 << 20
+MMAP_THRESHOLD = 64 << 20
+
+
+def _signed(value: int) -> int:
+    """Map an unsigned 64-bit integer to the signed range SQLite stores.
+
+    Args:
+        value (int): Unsigned 64-bit integer.
+
+    Returns:
+        int: Signed 64-bit integer.
+    """
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def hash_file(path: str) -> int:
+    """Hash file contents.
+
+    Large files are hashed through a memory map, smaller ones with large
+    buffered reads.
+
+    Args:
+        path (str): File path.
+
+    Returns:
+        int: Non-zero 64-bit BLAKE2b digest, or 0 if the file could not be read.
+    """
+    digest = hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    digest.update(m)
+            else:
+                buf = bytearray(READ_BUFFER_SIZE)
+                view = memoryview(buf)
+                while size := f.readinto(buf):
+                    digest.update(view[:size])
+    except (OSError, ValueError):
+        return 0
+    return int.from_bytes(digest.digest(), "little") or 1
+
+
+class HashCache:
+    """Persistent cache of content hashes.
+
+    Hashes are keyed by device and inode and are only returned while the
+    file size and mtime still match, so each file has at most one entry. The
+    ctime is checked as well, since it changes whenever the mtime is reset to
+    hide a modification.
+    """
+
+    def __init__(self, file: Optional[Path] = None):
+        """Constructor method.
+
+        Args:
+            file (Optional[Path]): Cache file, defaults to one in the settings
+                directory.
+        """
+        self._file = file or get_settings_dir() / APP_HASH_CACHE_FILE
+        self._conn = sqlite3.connect(self._file, timeout=30)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, "
+            "ctime_ns INTEGER, hash INTEGER, PRIMARY KEY (dev, ino)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    def __enter__(self) -> "HashCache":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close cache database."""
+        self._conn.close()
+
+    def get(self, st: os.stat_result) -> Optional[int]:
+        """Get cached hash of a file.
+
+        Args:
+            st (os.stat_result): Current stat result of the file.
+
+        Returns:
+            Optional[int]: Cached hash, None if missing or stale.
+        """
+        row = self._conn.execute(
+            "SELECT size, mtime_ns, ctime_ns, hash FROM hashes "
+            "WHERE dev = ? AND ino = ?",
+            (_signed(st.st_dev), _signed(st.st_ino)),
+        ).fetchone()
+        if row is None or row[:3] != (st.st_size, st.st_mtime_ns, st.st_ctime_ns):
+            return None
+        return row[3] & ((1 << 64) - 1)
+
+    def put_many(self, items: Iterable[tuple[os.stat_result, int]]) -> None:
+        """Store hashes of files in one transaction.
+
+        Args:
+            items (Iterable[tuple[os.stat_result, int]]): Stat results and hashes.
+        """
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        _signed(st.st_dev),
+                        _signed(st.st_ino),
+                        st.st_size,
+                        st.st_mtime_ns,
+                        st.st_ctime_ns,
+                        _signed(digest),
+                    )
+                    for st, digest in items
+                ),
+            )
+
+
+def hash_entries(
+    root: str,
+    entries: Iterable[WalkEntry],
+    cache: Optional[HashCache] = None,
+    workers: int = HASH_WORKERS,
+    batch_size: int = HASH_BATCH_SIZE,
+) -> Iterator[WalkEntry]:
+    """Set content hashes of regular files in a stream of entries.
+
+    Entries are processed in batches. Cached hashes are reused and the
+    remaining files are hashed on a process pool, which is only started once
+    a file actually needs to be read.
+
+    Args:
+        root (str): Root directory of the entries.
+        entries (Iterable[WalkEntry]): Entries with stats, e.g. from iter_snapshot.
+        cache (Optional[HashCache]): Hash cache to read and update.
+        workers (int): Number of hashing processes. 1 hashes in this process.
+        batch_size (int): Number of entries per batch.
+
+    Yields:
+        WalkEntry: Entries in the same order, with content_hash set for files.
+    """
+    executor = None
+    entries = iter(entries)
+    try:
+        while batch := list(itertools.islice(entries, batch_size)):
+            misses = []
+            for idx, entry in enumerate(batch):
+                if entry.is_dir or entry.stat is None:
+                    continue
+                if not stat.S_ISREG(entry.stat.st_mode):
+                    batch[idx] = entry._replace(content_hash=0)
+                    continue
+                cached = cache.get(entry.stat) if cache is not None else None
+                if cached is None:
+                    misses.append(idx)
+                else:
+                    instrument.add("hash.cache_hits")
+                    batch[idx] = entry._replace(content_hash=cached)
+
+            paths = [os.path.join(root, batch[idx].path) for idx in misses]
+            with instrument.span("hash.batch"):
+                if workers > 1 and len(paths) > 1:
+                    if executor is None:
+                        executor = ProcessPoolExecutor(
+                            workers, mp_context=multiprocessing.get_context("spawn")
+                        )
+                    chunksize = max(1, len(paths) // (workers * 4))
+                    digests = list(executor.map(hash_file, paths, chunksize=chunksize))
+                else:
+                    digests = [hash_file(path) for path in paths]
+
+            instrument.add("hash.files_hashed", len(misses))
+            instrument.add(
+                "hash.bytes_hashed", sum(batch[idx].stat.st_size for idx in misses)
+            )
+            for idx, digest in zip(misses, digests):
+                batch[idx] = batch[idx]._replace(content_hash=digest)
+            if cache is not None:
+                cache.put_many(
+                    (batch[idx].stat, digest)
+                    for idx, digest in zip(misses, digests)
+                    if digest
+                )
+            yield from batch
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
@@ -0,0 +1,165 @@
+"""Instrumentation module to record timing spans and counters.
+
+Instrumentation is disabled by default, in which case span() returns a
+shared no-op context manager and add() returns immediately, so call sites
+cost a function call. It is enabled with enable() or by setting the
+DIR_SNAPSHOT_STATS environment variable. Recording is thread safe.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Optional
+
+_lock = threading.Lock()
+_enabled = bool(os.environ.get("DIR_SNAPSHOT_STATS"))
+
+
+@dataclass
+class SpanStats:
+    count: int = 0
+    total_ns: int = 0
+    max_ns: int = 0
+
+
+_spans: dict[str, SpanStats] = {}
+_counters: dict[str, int] = {}
+
+
+class _NullSpan:
+    """Span that records nothing, used while instrumentation is disabled."""
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """Span that records its duration when it exits."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *args) -> None:
+        elapsed = time.perf_counter_ns() - self.start
+        with _lock:
+            stats = _spans.setdefault(self.name, SpanStats())
+            stats.count += 1
+            stats.total_ns += elapsed
+            stats.max_ns = max(stats.max_ns, elapsed)
+
+
+def enable(enabled: bool = True) -> None:
+    """Enable or disable instrumentation.
+
+    Args:
+        enabled (bool): Whether to record spans and counters.
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled() -> bool:
+    """Check if instrumentation is enabled.
+
+    Returns:
+        bool: True if spans and counters are recorded.
+    """
+    return _enabled
+
+
+def reset() -> None:
+    """Clear all recorded spans and counters."""
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+
+def span(name: str):
+    """Time a block of code.
+
+    Args:
+        name (str): Span name, e.g. "snapshot.create".
+
+    Returns:
+        Context manager recording the duration of the block.
+    """
+    return _Span(name) if _enabled else _NULL_SPAN
+
+
+def timed(name: str) -> Callable:
+    """Decorate a function to time each call as a span.
+
+    Args:
+        name (str): Span name.
+
+    Returns:
+        Callable: Decorator.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def add(name: str, value: int = 1) -> None:
+    """Add to a counter.
+
+    Args:
+        name (str): Counter name, e.g. "walk.stat_calls".
+        value (int): Amount to add.
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def get_stats() -> dict:
+    """Get a copy of the recorded spans and counters.
+
+    Returns:
+        dict: {"spans": {name: {"count", "total_ns", "max_ns"}},
+            "counters": {name: value}}, sorted by name.
+    """
+    with _lock:
+        return {
+            "spans": {name: asdict(_spans[name]) for name in sorted(_spans)},
+            "counters": {name: _counters[name] for name in sorted(_counters)},
+        }
+
+
+def dump_json(file: Optional[str] = None) -> str:
+    """Dump the recorded spans and counters as JSON.
+
+    Args:
+        file (Optional[str]): File to write the JSON to.
+
+    Returns:
+        str: JSON document.
+    """
+    data = json.dumps(get_stats(), indent=2)
+    if file is not None:
+        with open(file, "w") as f:
+            f.write(data + "\n")
+    return data
@@ -0,0 +1,101 @@
+"""Merkle module to hash directory trees bottom-up."""
+
+import hashlib
+from array import array
+from typing import Iterable, Optional
+
+TREE_HASH_SIZE = 8
+
+
+def _new_hasher():
+    return hashlib.blake2b(digest_size=TREE_HASH_SIZE)
+
+
+EMPTY_TREE_DIGEST = _new_hasher().digest()
+
+
+def _file_record(name: str, data: bytes) -> bytes:
+    return b"f%s\0%s" % (name.encode("utf-8", "surrogateescape"), data)
+
+
+def _dir_record(name: str, digest: bytes) -> bytes:
+    return b"d%s\0%s" % (name.encode("utf-8", "surrogateescape"), digest)
+
+
+def dir_digest(
+    files: Iterable[tuple[str, bytes]], dirs: Iterable[tuple[str, bytes]]
+) -> bytes:
+    """Hash a single directory from its children.
+
+    Gives the same digest as TreeHasher, so hashes of changed directories
+    can be updated without rehashing the whole tree.
+
+    Args:
+        files (Iterable[tuple[str, bytes]]): Names and packed metadata of the
+            child files, sorted by path.
+        dirs (Iterable[tuple[str, bytes]]): Names and digests of the child
+            directories, sorted by path.
+
+    Returns:
+        bytes: Directory digest.
+    """
+    hasher = _new_hasher()
+    for name, data in files:
+        hasher.update(_file_record(name, data))
+    for name, digest in dirs:
+        hasher.update(_dir_record(name, digest))
+    return hasher.digest()
+
+
+class TreeHasher:
+    """Compute Merkle hashes of directories from their entries.
+
+    The hash of a directory covers the names of its children, the given
+    metadata of its files and the hashes of its subdirectories, so two
+    directories with equal hashes hold identical subtrees. Files can be
+    added in any order that is the same for equal trees, e.g. sorted.
+    """
+
+    def __init__(self):
+        """Constructor method."""
+        self._hashers: dict[str, "hashlib._Hash"] = {}
+
+    def _hasher(self, parent: str):
+        hasher = self._hashers.get(parent)
+        if hasher is None:
+            hasher = self._hashers[parent] = _new_hasher()
+        return hasher
+
+    def add_file(self, path: str, data: bytes = b"") -> None:
+        """Add a file to the hash of its directory.
+
+        Args:
+            path (str): Relative POSIX path of the file.
+            data (bytes): Packed metadata, the same length for every file.
+        """
+        parent, _, name = path.rpartition("/")
+        self._hasher(parent).update(_file_record(name, data))
+
+    def finish(self, dirs: list[str]) -> array:
+        """Compute directory hashes once all files have been added.
+
+        Directories are hashed deepest first, so each one is folded into
+        its parent before the parent is hashed.
+
+        Args:
+            dirs (list[str]): Relative POSIX paths of all directories.
+
+        Returns:
+            array: 64-bit hash per directory, aligned with dirs.
+        """
+        hashes = array("Q", bytes(TREE_HASH_SIZE * len(dirs)))
+        order = sorted(range(len(dirs)), key=lambda i: -dirs[i].count("/"))
+        for i in order:
+            path = dirs[i]
+            hasher: Optional["hashlib._Hash"] = self._hashers.pop(path, None)
+            digest = hasher.digest() if hasher is not None else EMPTY_TREE_DIGEST
+            hashes[i] = int.from_bytes(digest, "little")
+            parent, _, name = path.rpartition("/")
+            self._hasher(parent).update(_dir_record(name, digest))
+        self._hashers.clear()
+        return hashes
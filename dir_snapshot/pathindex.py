@@ -0,0 +1,379 @@
+"""Path index module to answer path history queries across snapshots.
+
+Each snapshot directory has an SQLite index mapping every path that
+appeared in any of its snapshots to the set of snapshots containing it,
+separately for a path that was a file and a directory at different times.
+Snapshots are numbered by their position in SnapshotDirData.snap_files,
+and each set is stored as a run-length encoded bitmap: a list of
+[start, end) runs of consecutive snapshots. A path that is still present
+has an open last run, so registering a snapshot only touches the paths
+added or removed since the previous one.
+"""
+
+import sqlite3
+import sys
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional
+
+from dir_snapshot import instrument
+from dir_snapshot.snapshot import (
+    SnapshotData,
+    compare_snapshot,
+    get_snp_file,
+    read_snp_data,
+    read_snp_meta,
+)
+from dir_snapshot.util import get_path_index_file
+
+OPEN_END = 0xFFFFFFFF
+# Version of the index schema, older indexes are rebuilt.
+INDEX_VERSION = 2
+
+
+def _encode_path(path: str) -> bytes:
+    """Encode a path as stored in the index.
+
+    Paths are stored as BLOBs of their file system bytes, since paths that
+    are not valid UTF-8 cannot be stored as SQLite TEXT.
+
+    Args:
+        path (str): Relative POSIX path, undecodable bytes as surrogates.
+
+    Returns:
+        bytes: Encoded path.
+    """
+    return path.encode("utf-8", "surrogateescape")
+
+
+def _prefix_end(prefix: bytes) -> Optional[bytes]:
+    """Get the smallest byte string greater than all strings with a prefix.
+
+    Args:
+        prefix (bytes): Encoded path prefix.
+
+    Returns:
+        Optional[bytes]: Exclusive upper bound, None if there is none.
+    """
+    prefix = prefix.rstrip(b"\xff")
+    if not prefix:
+        return None
+    return prefix[:-1] + bytes([prefix[-1] + 1])
+
+
+def _encode_runs(runs: array) -> bytes:
+    """Encode runs as little-endian unsigned 32-bit integers.
+
+    Args:
+        runs (array): Flat array("I") of start and end pairs.
+
+    Returns:
+        bytes: Encoded runs.
+    """
+    if sys.byteorder == "big":
+        runs = array("I", runs)
+        runs.byteswap()
+    return runs.tobytes()
+
+
+def _decode_runs(data: bytes) -> array:
+    """Decode runs written by _encode_runs.
+
+    Args:
+        data (bytes): Encoded runs.
+
+    Returns:
+        array: Flat array("I") of start and end pairs.
+    """
+    runs = array("I", data)
+    if sys.byteorder == "big":
+        runs.byteswap()
+    return runs
+
+
+class PathHistory(NamedTuple):
+    """Snapshots containing a path, as [start, end) runs of snapshot numbers.
+
+    The end of the last run is None while the path is in the latest
+    indexed snapshot.
+    """
+
+    path: str
+    is_dir: bool
+    runs: list[tuple[int, Optional[int]]]
+
+    @classmethod
+    def from_row(cls, path: bytes, is_dir: int, data: bytes) -> "PathHistory":
+        runs = _decode_runs(data)
+        return cls(
+            path.decode("utf-8", "surrogateescape"),
+            bool(is_dir),
+            [
+                (start, None if end == OPEN_END else end)
+                for start, end in zip(runs[::2], runs[1::2])
+            ],
+        )
+
+    @property
+    def first_seen(self) -> int:
+        """Get the first snapshot containing the path.
+
+        Returns:
+            int: Snapshot number.
+        """
+        return self.runs[0][0]
+
+    @property
+    def last_seen(self) -> Optional[int]:
+        """Get the last snapshot containing the path.
+
+        Returns:
+            Optional[int]: Snapshot number, None if still present.
+        """
+        end = self.runs[-1][1]
+        return None if end is None else end - 1
+
+    def contains(self, snapshot: int) -> bool:
+        """Check if a snapshot contains the path.
+
+        Args:
+            snapshot (int): Snapshot number.
+
+        Returns:
+            bool: True if the path is in the snapshot.
+        """
+        idx = bisect_right(self.runs, snapshot, key=lambda run: run[0]) - 1
+        if idx < 0:
+            return False
+        end = self.runs[idx][1]
+        return end is None or snapshot < end
+
+    def snapshots(self, count: int) -> list[int]:
+        """Expand the runs into snapshot numbers.
+
+        Args:
+            count (int): Number of indexed snapshots, closing an open run.
+
+        Returns:
+            list[int]: Sorted snapshot numbers.
+        """
+        return [
+            n
+            for start, end in self.runs
+            for n in range(start, count if end is None else end)
+        ]
+
+
+class PathIndex:
+    """On-disk index of the paths of all snapshots of a directory."""
+
+    def __init__(self, file: Path):
+        """Constructor method.
+
+        Args:
+            file (Path): Index database file.
+        """
+        self._file = file
+        self._conn = sqlite3.connect(file, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != INDEX_VERSION:
+                # The index only holds derived data, sync() rebuilds it.
+                self._conn.execute("DROP TABLE IF EXISTS snapshots")
+                self._conn.execute("DROP TABLE IF EXISTS paths")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                "idx INTEGER PRIMARY KEY, snap_file TEXT NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS paths ("
+                "path BLOB NOT NULL, is_dir INTEGER NOT NULL, runs BLOB NOT NULL, "
+                "PRIMARY KEY (path, is_dir)) WITHOUT ROWID"
+            )
+            self._conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+
+    def __enter__(self) -> "PathIndex":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close index database."""
+        self._conn.close()
+
+    @property
+    def snap_files(self) -> list[str]:
+        """Get the indexed snapshot files.
+
+        Returns:
+            list[str]: Snapshot file names in snapshot number order.
+        """
+        rows = self._conn.execute("SELECT snap_file FROM snapshots ORDER BY idx")
+        return [snap_file for (snap_file,) in rows]
+
+    def clear(self) -> None:
+        """Remove all indexed snapshots."""
+        with self._conn:
+            self._conn.execute("DELETE FROM snapshots")
+            self._conn.execute("DELETE FROM paths")
+
+    @instrument.timed("index.sync")
+    def sync(self, snap_files: list[str]) -> int:
+        """Index the snapshots not indexed yet.
+
+        Each snapshot is compared with the previous one, and only the added
+        and removed paths are written. If the indexed snapshots are not a
+        prefix of snap_files, the index is rebuilt. Indexing stops at the
+        first snapshot file that cannot be read, to be retried later.
+
+        Args:
+            snap_files (list[str]): Snapshot file names registered in the
+                database, oldest first.
+
+        Returns:
+            int: Number of snapshots indexed.
+        """
+        indexed = self.snap_files
+        if snap_files[: len(indexed)] != indexed:
+            self.clear()
+            indexed = []
+        previous = None
+        added = 0
+        for idx in range(len(indexed), len(snap_files)):
+            file = get_snp_file(snap_files[idx])
+            if read_snp_meta(file) is None:
+                break
+            if previous is None:
+                previous = (
+                    read_snp_data(get_snp_file(snap_files[idx - 1]))
+                    if idx
+                    else SnapshotData(dirs=[], files=[])
+                )
+            snapshot_data = read_snp_data(file)
+            self.add_snapshot(idx, snap_files[idx], previous, snapshot_data)
+            previous = snapshot_data
+            added += 1
+        return added
+
+    def add_snapshot(
+        self, idx: int, snap_file: str, previous: SnapshotData, new: SnapshotData
+    ) -> None:
+        """Index a snapshot as the changes from the previous one.
+
+        Args:
+            idx (int): Snapshot number.
+            snap_file (str): Snapshot file name.
+            previous (SnapshotData): Snapshot idx - 1, empty for the first.
+            new (SnapshotData): Snapshot to index.
+        """
+        result = compare_snapshot(previous, new)
+        # A path replaced by an entry of the other type is removed from the
+        # history of one type and added to the other.
+        changes = {}
+        for is_dir, removed, added in (
+            (True, result.removed_dirs, result.added_dirs),
+            (False, result.removed_files, result.added_files),
+        ):
+            for path in removed:
+                changes[path, is_dir] = False
+            for path in added:
+                changes[path, is_dir] = True
+
+        rows = []
+        for (path, is_dir), present in changes.items():
+            key = (_encode_path(path), int(is_dir))
+            row = None
+            if idx:
+                row = self._conn.execute(
+                    "SELECT runs FROM paths WHERE path = ? AND is_dir = ?", key
+                ).fetchone()
+            runs = _decode_runs(row[0]) if row is not None else array("I")
+            if present:
+                runs.extend((idx, OPEN_END))
+            elif runs and runs[-1] == OPEN_END:
+                runs[-1] = idx
+            else:
+                continue
+            rows.append((*key, _encode_runs(runs)))
+
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO paths VALUES (?, ?, ?)", rows
+            )
+            self._conn.execute("INSERT INTO snapshots VALUES (?, ?)", (idx, snap_file))
+        instrument.add("index.paths_written", len(rows))
+
+    def history(self, path: str) -> list[PathHistory]:
+        """Get the snapshots containing a path.
+
+        Args:
+            path (str): Relative POSIX path.
+
+        Returns:
+            list[PathHistory]: Histories of the path as a file and as a
+                directory, for the types it had, empty if no snapshot
+                contains it.
+        """
+        rows = self._conn.execute(
+            "SELECT path, is_dir, runs FROM paths WHERE path = ? ORDER BY is_dir",
+            (_encode_path(path),),
+        )
+        return [PathHistory.from_row(*row) for row in rows]
+
+    def search(self, prefix: str, limit: Optional[int] = None) -> list[PathHistory]:
+        """Get the histories of all paths starting with a prefix.
+
+        Args:
+            prefix (str): Path prefix, e.g. "src/" for everything below src.
+            limit (Optional[int]): Maximum number of paths.
+
+        Returns:
+            list[PathHistory]: Histories sorted by path bytes.
+        """
+        start = _encode_path(prefix)
+        end = _prefix_end(start)
+        rows = self._conn.execute(
+            "SELECT path, is_dir, runs FROM paths WHERE path >= ? AND "
+            "(? IS NULL OR path < ?) ORDER BY path, is_dir LIMIT ?",
+            (start, end, end, -1 if limit is None else limit),
+        )
+        return [PathHistory.from_row(*row) for row in rows]
+
+
+def open_path_index(dir_id: int) -> PathIndex:
+    """Open the index of a snapshot directory, creating it if needed.
+
+    Args:
+        dir_id (int): Snapshot dir id.
+
+    Returns:
+        PathIndex: Path index.
+    """
+    file = get_path_index_file(dir_id)
+    file.parent.mkdir(parents=True, exist_ok=True)
+    return PathIndex(file)
+
+
+def update_path_index(dir_id: int, snap_files: Iterable[str]) -> bool:
+    """Bring the index of a snapshot directory up to date.
+
+    Args:
+        dir_id (int): Snapshot dir id.
+        snap_files (Iterable[str]): Registered snapshot file names, oldest first.
+
+    Returns:
+        bool: True if all snapshots are indexed.
+    """
+    snap_files = list(snap_files)
+    # Nothing to index until the latest snapshot file exists.
+    if not snap_files or read_snp_meta(get_snp_file(snap_files[-1])) is None:
+        return False
+    try:
+        with open_path_index(dir_id) as index:
+            index.sync(snap_files)
+            return len(index.snap_files) == len(snap_files)
+    except (OSError, sqlite3.Error):
+        return False
@@ -0,0 +1,306 @@
+"""Rules module to match paths against gitignore-style exclude rules.
+
+Rules follow the .gitignore syntax. A rule excludes matching paths, and a
+rule starting with "!" includes them again. The last matching rule wins.
+A rule ending with "/" only matches directories. A rule containing a "/"
+other than at its end is anchored to the root directory, otherwise it
+matches an entry name at any depth. "*" and "?" do not match "/", while
+"**" matches across directories.
+
+Since the walk never descends into excluded directories, nothing below an
+excluded directory can be included again, as with git.
+"""
+
+import hashlib
+import re
+from typing import Iterable, NamedTuple, Optional
+
+from dir_snapshot import instrument
+
+GLOB_CHARS = frozenset("*?[\\")
+
+
+class Rule(NamedTuple):
+    pattern: str
+    negate: bool
+    dir_only: bool
+    anchored: bool
+    glob: str
+
+
+def parse_rule(line: str) -> Optional[Rule]:
+    """Parse a single rule.
+
+    Args:
+        line (str): Rule as written in a .gitignore file.
+
+    Returns:
+        Optional[Rule]: Parsed rule, None for blank lines and comments.
+    """
+    glob = line.rstrip("\n\r")
+    # Trailing spaces are ignored unless escaped.
+    while glob.endswith(" ") and not glob.endswith("\\ "):
+        glob = glob[:-1]
+    if not glob or glob.startswith("#"):
+        return None
+    negate = glob.startswith("!")
+    if negate:
+        glob = glob[1:]
+    elif glob.startswith(("\\!", "\\#")):
+        glob = glob[1:]
+    dir_only = glob.endswith("/")
+    glob = glob.rstrip("/")
+    if not glob:
+        return None
+    anchored = "/" in glob
+    return Rule(line, negate, dir_only, anchored, glob.lstrip("/"))
+
+
+def _translate_class(glob: str, i: int) -> tuple[str, int]:
+    """Translate a bracket expression starting at glob[i] == "[".
+
+    Args:
+        glob (str): Glob pattern.
+        i (int): Index of the opening bracket.
+
+    Returns:
+        tuple[str, int]: Regular expression and index after the expression.
+    """
+    j = i + 1
+    if j < len(glob) and glob[j] in "!^":
+        j += 1
+    if j < len(glob) and glob[j] == "]":
+        j += 1
+    j = glob.find("]", j)
+    if j < 0:
+        return re.escape("["), i + 1
+    body = glob[i + 1 : j]
+    negate = body[:1] in ("!", "^")
+    if negate:
+        body = body[1:]
+    body = body.replace("\\", "\\\\").replace("^", "\\^")
+    return ("[^/" if negate else "[") + body + "]", j + 1
+
+
+def translate(glob: str) -> str:
+    """Translate a glob of a rule to a regular expression.
+
+    Args:
+        glob (str): Glob without leading and trailing slashes.
+
+    Returns:
+        str: Regular expression without groups, matching relative paths.
+    """
+    parts = []
+    segments = glob.split("/")
+    for k, segment in enumerate(segments):
+        last = k == len(segments) - 1
+        if segment == "**":
+            # "**/" matches zero or more directories, a trailing "/**"
+            # everything below.
+            parts.append(".+" if last else "(?:.*/)?")
+            continue
+        i = 0
+        while i < len(segment):
+            c = segment[i]
+            if c == "*":
+                while i < len(segment) and segment[i] == "*":
+                    i += 1
+                parts.append("[^/]*")
+                continue
+            if c == "?":
+                parts.append("[^/]")
+            elif c == "[":
+                regex, i = _translate_class(segment, i)
+                parts.append(regex)
+                continue
+            elif c == "\\" and i + 1 < len(segment):
+                i += 1
+                parts.append(re.escape(segment[i]))
+            else:
+                parts.append(re.escape(c))
+            i += 1
+        if not last:
+            parts.append("/")
+    return "".join(parts)
+
+
+class _RegexSet(NamedTuple):
+    """Alternation of rule regexes whose first matching group is the last rule."""
+
+    regex: re.Pattern
+    groups: list[int]
+
+    def match(self, subject: str) -> int:
+        m = self.regex.fullmatch(subject)
+        return self.groups[m.lastindex] if m is not None else -1
+
+
+def _compile_set(alternatives: list[tuple[int, str]]) -> _RegexSet:
+    """Compile rule regexes into one alternation.
+
+    Args:
+        alternatives (list[tuple[int, str]]): Rule indices and regexes, from
+            the last rule to the first.
+
+    Returns:
+        _RegexSet: Compiled alternation.
+
+    Raises:
+        ValueError: If a rule cannot be compiled.
+    """
+    try:
+        regex = re.compile("|".join(f"({r})" for _, r in alternatives), re.DOTALL)
+    except re.error as e:
+        raise ValueError(f"Invalid rule: {e}") from None
+    return _RegexSet(regex, [-1] + [idx for idx, _ in alternatives])
+
+
+class PathRules:
+    """Compiled exclude rules.
+
+    Rules are compiled once into matchers that are all tried for a path,
+    the highest rule index winning:
+
+    - a dict of literal entry names, for rules such as ".git/",
+    - a dict of name suffixes, for rules such as "*.pyc",
+    - one regex over the entry name for the other unanchored rules,
+    - a dict of regexes by first path segment for anchored rules such as
+      "/build/out", plus one regex for anchored rules starting with a glob.
+
+    Each regex has one alternative per rule, ordered from the last rule to
+    the first, so the first alternative to match is the rule that wins.
+    Each path thus costs a few dict lookups and at most three regex
+    matches, which only try the rules that can apply to it.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        """Constructor method.
+
+        Args:
+            patterns (Iterable[str]): Rules in .gitignore syntax.
+
+        Raises:
+            ValueError: If a rule cannot be compiled.
+        """
+        self.patterns = list(patterns)
+        self.rules = [r for r in map(parse_rule, self.patterns) if r is not None]
+        self._names: dict[str, list[int]] = {}
+        self._suffixes: dict[str, list[int]] = {}
+        name_globs = []
+        anchored_globs: dict[Optional[str], list[tuple[int, str]]] = {}
+        for idx in reversed(range(len(self.rules))):
+            rule = self.rules[idx]
+            glob = rule.glob
+            if not rule.anchored and not GLOB_CHARS.intersection(glob):
+                self._names.setdefault(glob, []).append(idx)
+                continue
+            if (
+                not rule.anchored
+                and glob.startswith("*")
+                and len(glob) > 1
+                and not GLOB_CHARS.intersection(glob[1:])
+            ):
+                self._suffixes.setdefault(glob[1:], []).append(idx)
+                continue
+            regex = translate(glob) + ("/" if rule.dir_only else "/?")
+            if not rule.anchored:
+                name_globs.append((idx, regex))
+                continue
+            first = glob.partition("/")[0]
+            if GLOB_CHARS.intersection(first):
+                first = None
+            anchored_globs.setdefault(first, []).append((idx, regex))
+
+        self._suffix_lengths = sorted({len(s) for s in self._suffixes}, reverse=True)
+        self._name_regex = _compile_set(name_globs) if name_globs else None
+        self._glob_regex = None
+        if None in anchored_globs:
+            self._glob_regex = _compile_set(anchored_globs.pop(None))
+        self._prefix_regexes = {
+            first: _compile_set(alternatives)
+            for first, alternatives in anchored_globs.items()
+        }
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, PathRules) and self.patterns == other.patterns
+
+    @property
+    def fingerprint(self) -> str:
+        """Get a digest of the rules, stored with snapshots taken with them.
+
+        Returns:
+            str: Hex digest of the rule lines.
+        """
+        digest = hashlib.blake2b("\n".join(self.patterns).encode(), digest_size=8)
+        return digest.hexdigest()
+
+    def _first(self, candidates: list[int], is_dir: bool) -> int:
+        for idx in candidates:
+            if is_dir or not self.rules[idx].dir_only:
+                return idx
+        return -1
+
+    def match(self, path: str, is_dir: bool) -> Optional[Rule]:
+        """Find the rule that decides whether a path is excluded.
+
+        Args:
+            path (str): Relative POSIX path.
+            is_dir (bool): Whether the path is a directory.
+
+        Returns:
+            Optional[Rule]: Last matching rule, None if no rule matches.
+        """
+        name = path.rpartition("/")[2]
+        best = -1
+        if self._names:
+            best = self._first(self._names.get(name, ()), is_dir)
+        for length in self._suffix_lengths:
+            if length > len(name):
+                continue
+            candidates = self._suffixes.get(name[-length:])
+            if candidates:
+                best = max(best, self._first(candidates, is_dir))
+        if self._name_regex is not None:
+            best = max(best, self._name_regex.match(name + "/" if is_dir else name))
+        if self._prefix_regexes or self._glob_regex is not None:
+            subject = path + "/" if is_dir else path
+            prefix_regex = self._prefix_regexes.get(path.partition("/")[0])
+            if prefix_regex is not None:
+                best = max(best, prefix_regex.match(subject))
+            if self._glob_regex is not None:
+                best = max(best, self._glob_regex.match(subject))
+        return self.rules[best] if best >= 0 else None
+
+    def is_excluded(self, path: str, is_dir: bool) -> bool:
+        """Check if a path is excluded.
+
+        Args:
+            path (str): Relative POSIX path.
+            is_dir (bool): Whether the path is a directory.
+
+        Returns:
+            bool: True if the last matching rule excludes the path.
+        """
+        rule = self.match(path, is_dir)
+        return rule is not None and not rule.negate
+
+
+def compile_rules(patterns: Optional[Iterable[str]]) -> Optional[PathRules]:
+    """Compile rules for a walk.
+
+    Args:
+        patterns (Optional[Iterable[str]]): Rules in .gitignore syntax.
+
+    Returns:
+        Optional[PathRules]: Compiled rules, None if there are no rules.
+
+    Raises:
+        ValueError: If a rule cannot be compiled.
+    """
+    with instrument.span("rules.compile"):
+        rules = PathRules(patterns or ())
+    return rules if rules else None
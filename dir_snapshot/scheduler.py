@@ -0,0 +1,364 @@
+"""Scheduler module to snapshot all registered directories in one batch."""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional
+
+from dir_snapshot import BATCH_PROGRESS_INTERVAL, BATCH_WORKERS
+from dir_snapshot.chunkstore import get_snapshot_store
+from dir_snapshot.db import SnapshotDB
+from dir_snapshot.pathindex import update_path_index
+from dir_snapshot.rules import compile_rules
+from dir_snapshot.snapshot import (
+    SnapshotCancelled,
+    SnapshotProgress,
+    generate_snp_filename,
+    get_snp_file,
+    take_snapshot,
+)
+
+
+class BatchJob(NamedTuple):
+    dir_id: int
+    dir: str
+    snp_file: str
+    base_file: Optional[str]
+    rules: tuple[str, ...] = ()
+
+
+class BatchResult(NamedTuple):
+    dir_id: int
+    dir: str
+    snp_file: str
+    num_entries: Optional[int]
+
+
+def plan_batch(db: SnapshotDB, skip: Iterable[str] = ()) -> list[BatchJob]:
+    """Plan snapshots of all registered directories.
+
+    Each snapshot is stored as a delta of the latest snapshot of its
+    directory, if there is one.
+
+    Args:
+        db (SnapshotDB): Snapshot database.
+        skip (Iterable[str]): Directories to leave out, e.g. already running.
+
+    Returns:
+        list[BatchJob]: Snapshot jobs in registration order.
+    """
+    skip = set(skip)
+    jobs = []
+    for d in db.snapshot_dirs:
+        if d.path in skip:
+            continue
+        base_file = get_snp_file(d.snap_files[-1]) if d.snap_files else None
+        jobs.append(
+            BatchJob(
+                d.id, d.path, generate_snp_filename(d.id), base_file, tuple(d.rules)
+            )
+        )
+    return jobs
+
+
+def group_by_device(jobs: Iterable[BatchJob]) -> list[list[BatchJob]]:
+    """Group jobs by the device of their directory.
+
+    Directories that cannot be stat'ed get a group of their own, so their
+    failure does not hold up anything else.
+
+    Args:
+        jobs (Iterable[BatchJob]): Snapshot jobs.
+
+    Returns:
+        list[list[BatchJob]]: Groups in order of first appearance.
+    """
+    groups = {}
+    for job in jobs:
+        try:
+            key = os.stat(job.dir).st_dev
+        except OSError:
+            key = job.dir
+        groups.setdefault(key, []).append(job)
+    return list(groups.values())
+
+
+class _SharedProgress:
+    """Progress of the jobs of a batch in memory shared with worker processes.
+
+    Each job has a slot of entries, dirs_queued, bytes_written and a
+    cancelled flag. Workers push the progress of their running job and pick
+    up cancellation, and the parent pulls the progress into the objects it
+    shows and pushes cancellation.
+    """
+
+    FIELDS = 4
+
+    def __init__(self, count: int, ctx: multiprocessing.context.BaseContext):
+        """Constructor method.
+
+        Args:
+            count (int): Number of jobs.
+            ctx (multiprocessing.context.BaseContext): Context of the pool.
+        """
+        self._values = ctx.RawArray("q", count * self.FIELDS)
+
+    def push(self, slot: int, progress: SnapshotProgress) -> None:
+        """Publish the progress of a job from a worker process.
+
+        Args:
+            slot (int): Job index.
+            progress (SnapshotProgress): Progress of the running job, cancelled
+                if the parent cancelled it.
+        """
+        base = slot * self.FIELDS
+        values = self._values
+        values[base] = progress.entries
+        values[base + 1] = progress.dirs_queued
+        values[base + 2] = progress.bytes_written
+        if values[base + 3]:
+            progress.cancelled = True
+
+    def pull(self, slot: int, progress: SnapshotProgress) -> None:
+        """Update the progress of a job in the parent process.
+
+        Args:
+            slot (int): Job index.
+            progress (SnapshotProgress): Progress shown by the parent. Its
+                cancelled flag is passed on to the worker.
+        """
+        base = slot * self.FIELDS
+        values = self._values
+        progress.entries = values[base]
+        progress.dirs_queued = values[base + 1]
+        progress.bytes_written = values[base + 2]
+        if progress.cancelled:
+            values[base + 3] = 1
+
+
+# Progress shared with the parent, set in batch worker processes.
+_shared_progress: Optional[_SharedProgress] = None
+
+
+def _init_worker(shared_progress: _SharedProgress) -> None:
+    global _shared_progress
+    _shared_progress = shared_progress
+
+
+def _push_progress(
+    slot: int, progress: SnapshotProgress, stop: threading.Event
+) -> None:
+    while not stop.wait(BATCH_PROGRESS_INTERVAL):
+        _shared_progress.push(slot, progress)
+
+
+def _run_job(
+    job: BatchJob, slot: int, progress: Optional[SnapshotProgress] = None
+) -> BatchResult:
+    """Take the snapshot of one job.
+
+    Args:
+        job (BatchJob): Snapshot job.
+        slot (int): Job index in the batch.
+        progress (Optional[SnapshotProgress]): Progress to update, shared with
+            the parent process if None in a batch worker.
+
+    Returns:
+        BatchResult: Result, with num_entries None if the job failed or was
+            cancelled.
+    """
+    stop = syncer = None
+    if progress is None:
+        progress = SnapshotProgress()
+        if _shared_progress is not None:
+            _shared_progress.push(slot, progress)
+            stop = threading.Event()
+            syncer = threading.Thread(
+                target=_push_progress, args=(slot, progress, stop), daemon=True
+            )
+            syncer.start()
+    num_entries = None
+    try:
+        if (
+            not progress.cancelled
+            and os.path.isdir(job.dir)
+            and take_snapshot(
+                job.dir,
+                job.snp_file,
+                job.base_file,
+                progress=progress,
+                rules=compile_rules(job.rules),
+                store=get_snapshot_store(),
+            )
+        ):
+            num_entries = progress.entries
+    except SnapshotCancelled:
+        pass
+    except Exception:
+        # A failing job must not take the rest of its group down with it.
+        Path(job.snp_file).unlink(missing_ok=True)
+    finally:
+        if syncer is not None:
+            stop.set()
+            syncer.join()
+            _shared_progress.push(slot, progress)
+    return BatchResult(job.dir_id, job.dir, job.snp_file, num_entries)
+
+
+def _run_group(
+    group: list[tuple[int, BatchJob]],
+    progress: Optional[list[SnapshotProgress]] = None,
+) -> list[BatchResult]:
+    """Take the snapshots of one group one after another.
+
+    Args:
+        group (list[tuple[int, BatchJob]]): Job indices and snapshot jobs on
+            the same device.
+        progress (Optional[list[SnapshotProgress]]): Progress of each job of
+            the batch, when running in the parent process.
+
+    Returns:
+        list[BatchResult]: Results, with num_entries None for failed jobs.
+    """
+    return [
+        _run_job(job, slot, progress[slot] if progress is not None else None)
+        for slot, job in group
+    ]
+
+
+def _fail_group(group: list[tuple[int, BatchJob]]) -> list[BatchResult]:
+    """Get failed results for a group whose worker did not return results.
+
+    Snapshot files the worker wrote before failing are removed, since they
+    are never registered.
+
+    Args:
+        group (list[tuple[int, BatchJob]]): Job indices and snapshot jobs.
+
+    Returns:
+        list[BatchResult]: Results with num_entries None.
+    """
+    for _, job in group:
+        Path(job.snp_file).unlink(missing_ok=True)
+    return [BatchResult(job.dir_id, job.dir, job.snp_file, None) for _, job in group]
+
+
+def run_batch(
+    jobs: list[BatchJob],
+    workers: int = BATCH_WORKERS,
+    progress: Optional[list[SnapshotProgress]] = None,
+) -> list[BatchResult]:
+    """Take planned snapshots concurrently on a process pool.
+
+    Directories on the same device are snapshotted one after another by the
+    same process, so at most one walk hits each disk at a time, while up to
+    workers devices are walked in parallel.
+
+    Args:
+        jobs (list[BatchJob]): Snapshot jobs.
+        workers (int): Maximum number of concurrent snapshots. 1 takes them in
+            this process.
+        progress (Optional[list[SnapshotProgress]]): Progress of each job,
+            updated while it runs. Setting cancelled stops the job, or skips
+            it if it has not started yet.
+
+    Returns:
+        list[BatchResult]: Results in job order, with num_entries None for
+            failed jobs. Failures, including a worker process that dies, only
+            affect the jobs of their group.
+    """
+    slots = {job.dir_id: slot for slot, job in enumerate(jobs)}
+    groups = [
+        [(slots[job.dir_id], job) for job in group] for group in group_by_device(jobs)
+    ]
+    if workers <= 1 or len(groups) <= 1:
+        group_results = [_run_group(group, progress) for group in groups]
+    else:
+        ctx = multiprocessing.get_context("spawn")
+        shared_progress = _SharedProgress(len(jobs), ctx)
+        # Pass on jobs cancelled before the batch starts.
+        for slot, job_progress in enumerate(progress or ()):
+            shared_progress.pull(slot, job_progress)
+        with ProcessPoolExecutor(
+            min(workers, len(groups)),
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(shared_progress,),
+        ) as executor:
+            futures = []
+            for group in groups:
+                try:
+                    futures.append(executor.submit(_run_group, group))
+                except BrokenProcessPool:
+                    futures.append(None)
+            pending = [future for future in futures if future is not None]
+            while pending:
+                _, pending = wait(pending, timeout=BATCH_PROGRESS_INTERVAL)
+                for slot, job_progress in enumerate(progress or ()):
+                    shared_progress.pull(slot, job_progress)
+            group_results = []
+            for group, future in zip(groups, futures):
+                try:
+                    results = future.result() if future is not None else None
+                except Exception:
+                    # E.g. BrokenProcessPool if the worker process died.
+                    results = None
+                group_results.append(
+                    results if results is not None else _fail_group(group)
+                )
+
+    results = {r.dir_id: r for group in group_results for r in group}
+    return [results[job.dir_id] for job in jobs]
+
+
+def register_batch(
+    db: SnapshotDB, results: Iterable[BatchResult]
+) -> dict[int, list[str]]:
+    """Register written snapshot files in one database commit.
+
+    Args:
+        db (SnapshotDB): Snapshot database.
+        results (Iterable[BatchResult]): Results of run_batch.
+
+    Returns:
+        dict[int, list[str]]: Registered snapshot files of each updated
+            snapshot dir id, to pass to index_batch.
+    """
+    written = [r for r in results if r.num_entries is not None]
+    db.update_snapshot_dirs(
+        (r.dir_id, Path(r.snp_file).name, r.num_entries) for r in written
+    )
+    registered = {}
+    for r in written:
+        d = db.get_snapshot_dir(r.dir_id)
+        if d is not None:
+            registered[r.dir_id] = list(d.snap_files)
+    return registered
+
+
+def index_batch(registered: dict[int, list[str]]) -> None:
+    """Update the path indexes of the snapshot dirs of a batch.
+
+    Args:
+        registered (dict[int, list[str]]): Result of register_batch.
+    """
+    for dir_id, snap_files in registered.items():
+        update_path_index(dir_id, snap_files)
+
+
+def snapshot_all(db: SnapshotDB, workers: int = BATCH_WORKERS) -> list[BatchResult]:
+    """Snapshot all registered directories and register the snapshot files.
+
+    Args:
+        db (SnapshotDB): Snapshot database.
+        workers (int): Maximum number of concurrent snapshots.
+
+    Returns:
+        list[BatchResult]: Results in registration order.
+    """
+    results = run_batch(plan_batch(db), workers)
+    index_batch(register_batch(db, results))
+    return results
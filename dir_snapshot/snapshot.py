@@ -1,18 +1,179 @@
 """Snapshot module to handle actual directory snapshots."""
 
 import datetime
-import difflib
+import functools
+import heapq
+import json
+import os
 import pickle
-from dataclasses import dataclass
+import stat
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass, field, fields
 from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple, Optional, Union
 
+from dir_snapshot import (
+    APP_SNAPSHOT_EXT,
+    INCREMENTAL_WALK_MAX_ENTRIES,
+    RACY_MTIME_WINDOW_NS,
+    SNP_CHUNK_SIZE,
+    SNP_KEYFRAME_INTERVAL,
+    SNAPSHOT_CACHE_BUDGET,
+    WALK_WORKERS,
+    instrument,
+)
+from dir_snapshot.cache import (
+    CompareCache,
+    LRUCache,
+    estimate_paths_size,
+    get_compare_cache,
+)
+from dir_snapshot.chunkstore import ChunkStore, open_chunk_store
+from dir_snapshot.diff import (
+    apply_delta,
+    diff_columns,
+    diff_pruned,
+    diff_rows,
+    diff_sorted,
+    identical_subtrees,
+    is_sorted,
+    merge_delta,
+)
+from dir_snapshot.hashing import HashCache, hash_entries
+from dir_snapshot.merkle import TREE_HASH_SIZE, TreeHasher, dir_digest
+from dir_snapshot.rules import PathRules
+from dir_snapshot.snpfile import (
+    SnpFormatError,
+    SnpReader,
+    is_snp_file,
+    write_snp_file,
+)
 from dir_snapshot.util import get_snapshot_dir
+from dir_snapshot.walker import DirListing, WalkEntry, walk
+
+SNP_SECTIONS = ("dirs", "files")
+STATS_ATTRS = {"dirs": "dir_stats", "files": "file_stats"}
+
+HASH_COLUMN = "hash"
+TREE_HASH_COLUMN = "tree_hash"
+
+# Stat columns compared to detect modified files.
+MODIFIED_COLUMNS = ("size", "mtime_ns", "mode")
+
+# Decoded snapshots by file, shared by all readers in the process.
+SNAPSHOT_CACHE = LRUCache(SNAPSHOT_CACHE_BUDGET)
+
+
+@dataclass
+class SnapshotStats:
+    """Per-entry stat metadata stored as parallel array columns."""
+
+    size: array = field(default_factory=lambda: array("q"))
+    mtime_ns: array = field(default_factory=lambda: array("q"))
+    mode: array = field(default_factory=lambda: array("I"))
+    inode: array = field(default_factory=lambda: array("Q"))
+    dev: array = field(default_factory=lambda: array("Q"))
+
+    @staticmethod
+    def values(stat: os.stat_result) -> tuple[int, ...]:
+        """Get column values of a stat result.
+
+        Args:
+            stat (os.stat_result): Result of os.lstat.
+
+        Returns:
+            tuple[int, ...]: One value per column.
+        """
+        return (stat.st_size, stat.st_mtime_ns, stat.st_mode, stat.st_ino, stat.st_dev)
+
+    @classmethod
+    def from_columns(cls, columns: dict[str, array], count: int) -> "SnapshotStats":
+        """Build stats from decoded columns.
+
+        Unknown columns are ignored and missing ones are filled with zeros.
+
+        Args:
+            columns (dict[str, array]): Column arrays by name.
+            count (int): Number of rows.
+
+        Returns:
+            SnapshotStats: Snapshot stats.
+        """
+        return cls(
+            **{
+                name: columns.get(name, array(col.typecode, [0]) * count)
+                for name, col in cls().columns().items()
+            }
+        )
+
+    def columns(self) -> dict[str, array]:
+        """Get columns by name.
+
+        Returns:
+            dict[str, array]: Column arrays.
+        """
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+    def append(self, stat: os.stat_result) -> None:
+        """Append stat result as a new row.
+
+        Args:
+            stat (os.stat_result): Result of os.lstat.
+        """
+        for col, value in zip(self.columns().values(), self.values(stat)):
+            col.append(value)
 
 
 @dataclass
 class SnapshotData:
     dirs: list[str]
     files: list[str]
+    dir_stats: Optional[SnapshotStats] = None
+    file_stats: Optional[SnapshotStats] = None
+    file_hashes: Optional[array] = None
+    dir_tree_hashes: Optional[array] = None
+
+    def columns(self, section: str) -> dict[str, array]:
+        """Get all columns of a section by name.
+
+        Args:
+            section (str): "dirs" or "files".
+
+        Returns:
+            dict[str, array]: Column arrays aligned with the section paths.
+        """
+        columns = {}
+        stats = getattr(self, STATS_ATTRS[section])
+        if stats is not None:
+            columns.update(stats.columns())
+        if section == "files" and self.file_hashes is not None:
+            columns[HASH_COLUMN] = self.file_hashes
+        if section == "dirs" and self.dir_tree_hashes is not None:
+            columns[TREE_HASH_COLUMN] = self.dir_tree_hashes
+        return columns
+
+    def set_columns(self, section: str, columns: dict[str, array]) -> None:
+        """Set all columns of a section from arrays by name.
+
+        Args:
+            section (str): "dirs" or "files".
+            columns (dict[str, array]): Column arrays aligned with the section paths.
+        """
+        columns = dict(columns)
+        if section == "files":
+            self.file_hashes = columns.pop(HASH_COLUMN, None)
+        else:
+            self.dir_tree_hashes = columns.pop(TREE_HASH_COLUMN, None)
+        stats = None
+        if columns:
+            count = len(getattr(self, section))
+            stats = SnapshotStats.from_columns(columns, count)
+        setattr(self, STATS_ATTRS[section], stats)
 
 
 @dataclass
@@ -21,64 +182,719 @@ class SnapshotCompareData:
     added_files: list[str]
     removed_dirs: list[str]
     removed_files: list[str]
+    modified_files: list[str] = field(default_factory=list)
+
+
+class SubtreeSummary(NamedTuple):
+    """Added or removed directory, reported once for its whole subtree."""
+
+    path: str
+    dirs: int
+    files: int
+    size: Optional[int] = None
+
+
+@dataclass
+class SnapshotTreeCompareData:
+    """Comparison result with added and removed subtrees collapsed.
+
+    Only the topmost added and removed directories are listed, and the
+    files below them are not. The snapshots, or the files to read them
+    from, are kept so collapsed directories can be expanded on demand.
+    """
+
+    added_dirs: list[SubtreeSummary]
+    added_files: list[str]
+    removed_dirs: list[SubtreeSummary]
+    removed_files: list[str]
+    modified_files: list[str] = field(default_factory=list)
+    old: Optional[SnapshotData] = field(default=None, repr=False, compare=False)
+    new: Optional[SnapshotData] = field(default=None, repr=False, compare=False)
+    old_file: Optional[str] = field(default=None, compare=False)
+    new_file: Optional[str] = field(default=None, compare=False)
+
+    def expand(
+        self, path: str, removed: bool = False
+    ) -> tuple[list[SubtreeSummary], list[str]]:
+        """List the direct children of a collapsed directory.
+
+        Args:
+            path (str): Added or removed directory.
+            removed (bool): Whether the directory was removed.
+
+        Returns:
+            tuple[list[SubtreeSummary], list[str]]: Summaries of the child
+                directories and the child files, sorted by path.
+        """
+        if removed and self.old is None and self.old_file is not None:
+            self.old = read_snp_data(self.old_file)
+        if not removed and self.new is None and self.new_file is not None:
+            self.new = read_snp_data(self.new_file)
+        snapshot_data = self.old if removed else self.new
+        dirs = [
+            summarize_subtree(snapshot_data, child)
+            for child in _children(snapshot_data.dirs, path)
+        ]
+        return dirs, _children(snapshot_data.files, path)
+
+    def to_dict(self) -> dict:
+        """Get the result as a JSON serializable dict, without the snapshots.
+
+        Returns:
+            dict: Lists of paths by category, collapsed directories as lists.
+        """
+        return {
+            name: [list(item) for item in paths] if name.endswith("_dirs") else paths
+            for name, paths in (
+                ("added_dirs", self.added_dirs),
+                ("added_files", self.added_files),
+                ("removed_dirs", self.removed_dirs),
+                ("removed_files", self.removed_files),
+                ("modified_files", self.modified_files),
+            )
+        }
+
+    @classmethod
+    def from_dict(
+        cls, data: dict, old_file: Optional[str] = None, new_file: Optional[str] = None
+    ) -> "SnapshotTreeCompareData":
+        """Build a result from a dict made by to_dict.
+
+        Path lists are used as they are rather than copied.
+
+        Args:
+            data (dict): Result dict.
+            old_file (Optional[str]): Older snapshot file to expand removed
+                directories from.
+            new_file (Optional[str]): Newer snapshot file to expand added
+                directories from.
+
+        Returns:
+            SnapshotTreeCompareData: Comparison result.
+        """
+        return cls(
+            added_dirs=[SubtreeSummary(*item) for item in data["added_dirs"]],
+            added_files=data["added_files"],
+            removed_dirs=[SubtreeSummary(*item) for item in data["removed_dirs"]],
+            removed_files=data["removed_files"],
+            modified_files=data["modified_files"],
+            old_file=old_file,
+            new_file=new_file,
+        )
+
+
+class SnapshotCancelled(Exception):
+    """Raised when a snapshot in progress is cancelled."""
+
+
+@dataclass
+class SnapshotProgress:
+    """Progress of a snapshot, updated by the thread taking it.
+
+    Other threads may read the counters at any time and set cancelled to
+    stop the snapshot at the next entry.
+    """
+
+    entries: int = 0
+    dirs_queued: int = 0
+    bytes_written: int = 0
+    started: float = field(default_factory=time.monotonic)
+    cancelled: bool = False
+
+    @property
+    def entries_per_sec(self) -> float:
+        """Get the average number of entries per second.
+
+        Returns:
+            float: Entries per second since the snapshot started.
+        """
+        elapsed = time.monotonic() - self.started
+        return self.entries / elapsed if elapsed > 0 else 0.0
+
+
+def _column_specs(columns: dict[str, array]) -> list[tuple[str, str, int]]:
+    """Get (name, typecode, width) specs of columns for snapshot files.
+
+    Args:
+        columns (dict[str, array]): Column arrays by name.
+
+    Returns:
+        list[tuple[str, str, int]]: Column specs.
+    """
+    return [(name, col.typecode, 1) for name, col in columns.items()]
+
+
+def _empty_snapshot(
+    with_stats: bool, with_hashes: bool, with_dir_stats: bool = False
+) -> SnapshotData:
+    """Create empty snapshot data with the requested columns.
+
+    Args:
+        with_stats (bool): Whether to add stat columns.
+        with_hashes (bool): Whether to add the content hash column. Implies with_stats.
+        with_dir_stats (bool): Whether to add stat columns for directories only.
+
+    Returns:
+        SnapshotData: Empty SnapshotData model.
+    """
+    snapshot_data = SnapshotData(dirs=[], files=[])
+    if with_stats or with_hashes or with_dir_stats:
+        snapshot_data.dir_stats = SnapshotStats()
+    if with_stats or with_hashes:
+        snapshot_data.file_stats = SnapshotStats()
+    if with_hashes:
+        snapshot_data.file_hashes = array("Q")
+    return snapshot_data
+
+
+def _sort_snapshot(snapshot_data: SnapshotData) -> SnapshotData:
+    """Get snapshot data with sorted paths and reordered columns.
+
+    Args:
+        snapshot_data (SnapshotData): SnapshotData model.
+
+    Returns:
+        SnapshotData: Sorted SnapshotData model, the same one if already sorted.
+    """
+    if is_sorted(snapshot_data.dirs) and is_sorted(snapshot_data.files):
+        return snapshot_data
+
+    sorted_data = SnapshotData(dirs=[], files=[])
+    for section in SNP_SECTIONS:
+        paths = getattr(snapshot_data, section)
+        order = sorted(range(len(paths)), key=paths.__getitem__)
+        setattr(sorted_data, section, [paths[i] for i in order])
+        columns = {
+            name: array(col.typecode, [col[i] for i in order])
+            for name, col in snapshot_data.columns(section).items()
+        }
+        sorted_data.set_columns(section, columns)
+    return sorted_data
+
+
+def _tree_hash_fields(names: list[str]) -> list[int]:
+    """Get the positions of the file columns covered by tree hashes.
+
+    These are the columns compared to detect modified files, so equal tree
+    hashes imply no added, removed or modified entries in the subtree.
+
+    Args:
+        names (list[str]): File column names.
+
+    Returns:
+        list[int]: Positions in names.
+    """
+    return [
+        idx
+        for idx, name in enumerate(names)
+        if name in (*MODIFIED_COLUMNS, HASH_COLUMN)
+    ]
+
+
+def _tree_hash_struct(columns: list[tuple[str, str, int]]) -> struct.Struct:
+    """Get the struct packing the file metadata covered by tree hashes.
+
+    Args:
+        columns (list[tuple[str, str, int]]): File column specs.
+
+    Returns:
+        struct.Struct: Little-endian struct of the covered columns.
+    """
+    fields = _tree_hash_fields([name for name, _, _ in columns])
+    return struct.Struct("<" + "".join(columns[idx][1] for idx in fields))
+
+
+def compute_tree_hashes(snapshot_data: SnapshotData) -> array:
+    """Compute Merkle tree hashes of the directories of a snapshot.
+
+    Args:
+        snapshot_data (SnapshotData): Sorted SnapshotData model.
+
+    Returns:
+        array: 64-bit tree hash per directory, aligned with dirs.
+    """
+    columns = snapshot_data.columns("files")
+    specs = _column_specs(columns)
+    pack = _tree_hash_struct(specs).pack
+    values = [list(columns.values())[idx] for idx in _tree_hash_fields(list(columns))]
+    hasher = TreeHasher()
+    for path, *row in zip(snapshot_data.files, *values):
+        hasher.add_file(path, pack(*row))
+    return hasher.finish(snapshot_data.dirs)
+
+
+def update_tree_hashes(snapshot_data: SnapshotData, changed: Iterable[str]) -> None:
+    """Recompute the tree hashes of changed directories and their ancestors.
+
+    Only the children of those directories are hashed, so the cost depends
+    on the changes rather than the size of the tree.
+
+    Args:
+        snapshot_data (SnapshotData): Sorted SnapshotData model with tree hashes.
+        changed (Iterable[str]): Directories whose children were added, removed
+            or modified, including new directories.
+    """
+    dirs = snapshot_data.dirs
+    hashes = snapshot_data.dir_tree_hashes
+    columns = snapshot_data.columns("files")
+    pack = _tree_hash_struct(_column_specs(columns)).pack
+    values = [list(columns.values())[idx] for idx in _tree_hash_fields(list(columns))]
+
+    affected = set()
+    for path in changed:
+        while path and path not in affected:
+            affected.add(path)
+            path = path.rpartition("/")[0]
+
+    # Deepest first, so child hashes are up to date before their parent.
+    for path in sorted(affected, key=lambda p: -p.count("/")):
+        idx = bisect_left(dirs, path)
+        if idx == len(dirs) or dirs[idx] != path:
+            continue
+        files = []
+        for child in _children(snapshot_data.files, path):
+            row = bisect_left(snapshot_data.files, child)
+            files.append((child.rpartition("/")[2], pack(*(v[row] for v in values))))
+        subdirs = [
+            (
+                child.rpartition("/")[2],
+                hashes[bisect_left(dirs, child)].to_bytes(TREE_HASH_SIZE, "little"),
+            )
+            for child in _children(dirs, path)
+        ]
+        hashes[idx] = int.from_bytes(dir_digest(files, subdirs), "little")
+
+
+def build_listings(
+    snapshot_data: SnapshotData, started_ns: Optional[int] = None
+) -> Optional[dict[str, DirListing]]:
+    """Index the directory listings of a snapshot by directory.
+
+    A directory modified shortly before the snapshot started is racily
+    clean, as in git: an entry added right after it was read may not have
+    moved its mtime on a filesystem with coarse timestamps. Such listings
+    are left out, so those directories are read again.
+
+    Args:
+        snapshot_data (SnapshotData): Snapshot with directory stats.
+        started_ns (Optional[int]): Time the snapshot started, in ns since
+            the epoch. Without it every listing is kept.
+
+    Returns:
+        Optional[dict[str, DirListing]]: Listings by relative directory path,
+            None if the snapshot has no directory stats.
+    """
+    dir_stats = snapshot_data.dir_stats
+    if dir_stats is None:
+        return None
+    racy_ns = None
+    if started_ns is not None:
+        racy_ns = started_ns - RACY_MTIME_WINDOW_NS
 
+    children = {path: [] for path in snapshot_data.dirs}
+    children[""] = []
+    for path, mode in zip(snapshot_data.dirs, dir_stats.mode):
+        siblings = children.get(path.rpartition("/")[0])
+        if siblings is not None:
+            siblings.append((path, True, not stat.S_ISLNK(mode)))
+    for path in snapshot_data.files:
+        siblings = children.get(path.rpartition("/")[0])
+        if siblings is not None:
+            siblings.append((path, False, False))
 
-def create_snapshot(dir: str) -> SnapshotData:
+    listings = {
+        path: DirListing(mtime_ns, inode, children[path])
+        for path, mtime_ns, inode in zip(
+            snapshot_data.dirs, dir_stats.mtime_ns, dir_stats.inode
+        )
+        if racy_ns is None or mtime_ns < racy_ns
+    }
+    instrument.add("snapshot.racy_dirs", len(snapshot_data.dirs) - len(listings))
+    return listings
+
+
+@instrument.timed("snapshot.create")
+def create_snapshot(
+    dir: str,
+    workers: int = WALK_WORKERS,
+    with_stats: bool = False,
+    with_hashes: bool = False,
+    hash_cache: Optional[HashCache] = None,
+    previous: Optional[SnapshotData] = None,
+    progress: Optional[SnapshotProgress] = None,
+    with_tree_hashes: bool = False,
+    rules: Optional[PathRules] = None,
+    previous_started_ns: Optional[int] = None,
+) -> SnapshotData:
     """Create snapshot of a directory.
 
     Args:
         dir (str): Directory to snapshot.
+        workers (int): Number of threads used to scan subdirectories.
+        with_stats (bool): Whether to record size, mtime, mode, inode and device.
+        with_hashes (bool): Whether to record content hashes of files.
+            Implies with_stats.
+        hash_cache (Optional[HashCache]): Hash cache, defaults to the one in
+            the settings directory.
+        previous (Optional[SnapshotData]): Previous snapshot of the directory
+            for an incremental snapshot. Directory stats are always recorded
+            in incremental mode so the result can serve as the next previous.
+        progress (Optional[SnapshotProgress]): Progress to update.
+        with_tree_hashes (bool): Whether to record Merkle tree hashes of
+            directories, which let comparisons skip identical subtrees.
+        rules (Optional[PathRules]): Rules of entries to leave out. The
+            previous snapshot must have been taken with the same rules.
+        previous_started_ns (Optional[int]): Time the previous snapshot
+            started, to read racily clean directories again.
 
     Returns:
-        SnapshotData: SnapshotData model.
+        SnapshotData: SnapshotData model with sorted relative paths.
+
+    Raises:
+        SnapshotCancelled: If the snapshot is cancelled through progress.
     """
-    snapshot_data = SnapshotData(dirs=[], files=[])
+    snapshot_data = _empty_snapshot(with_stats, with_hashes, previous is not None)
+    dir_stats = snapshot_data.dir_stats
+    file_stats = snapshot_data.file_stats
+    file_hashes = snapshot_data.file_hashes
 
-    for path in Path(dir).rglob("*"):
-        if path.is_dir():
-            snapshot_data.dirs.append(path.relative_to(dir).as_posix())
+    for entry in iter_snapshot(
+        dir,
+        workers,
+        with_stats,
+        with_hashes,
+        hash_cache,
+        previous,
+        progress,
+        rules,
+        previous_started_ns,
+    ):
+        if entry.is_dir:
+            snapshot_data.dirs.append(entry.path)
+            if dir_stats is not None:
+                dir_stats.append(entry.stat)
         else:
-            snapshot_data.files.append(path.relative_to(dir).as_posix())
+            snapshot_data.files.append(entry.path)
+            if file_stats is not None:
+                file_stats.append(entry.stat)
+            if file_hashes is not None:
+                file_hashes.append(entry.content_hash)
 
+    instrument.add(
+        "snapshot.entries", len(snapshot_data.dirs) + len(snapshot_data.files)
+    )
+    with instrument.span("snapshot.sort"):
+        snapshot_data = _sort_snapshot(snapshot_data)
+    if with_tree_hashes:
+        with instrument.span("snapshot.tree_hash"):
+            snapshot_data.dir_tree_hashes = compute_tree_hashes(snapshot_data)
     return snapshot_data
 
 
+def iter_snapshot(
+    dir: str,
+    workers: int = WALK_WORKERS,
+    with_stats: bool = False,
+    with_hashes: bool = False,
+    hash_cache: Optional[HashCache] = None,
+    previous: Optional[SnapshotData] = None,
+    progress: Optional[SnapshotProgress] = None,
+    rules: Optional[PathRules] = None,
+    previous_started_ns: Optional[int] = None,
+) -> Iterator[WalkEntry]:
+    """Stream snapshot entries of a directory as they are scanned.
+
+    With a previous snapshot, directories whose mtime and inode are unchanged
+    reuse their previous listing instead of being read again, so only one
+    lstat per directory plus the changed directories hit the filesystem.
+    Directory entries then always carry stats.
+
+    Args:
+        dir (str): Directory to snapshot.
+        workers (int): Number of threads used to scan subdirectories.
+        with_stats (bool): Whether to lstat each entry.
+        with_hashes (bool): Whether to hash file contents. Implies with_stats.
+        hash_cache (Optional[HashCache]): Hash cache, defaults to the one in
+            the settings directory.
+        previous (Optional[SnapshotData]): Previous snapshot of the directory.
+        progress (Optional[SnapshotProgress]): Progress to update.
+        rules (Optional[PathRules]): Rules of entries to leave out. Excluded
+            directories are never opened or stat'ed.
+        previous_started_ns (Optional[int]): Time the previous snapshot
+            started. Directories modified within RACY_MTIME_WINDOW_NS before
+            it are read again, see build_listings.
+
+    Yields:
+        WalkEntry: Entries in deterministic walk order.
+
+    Raises:
+        SnapshotCancelled: If the snapshot is cancelled through progress.
+    """
+    listings = None
+    if previous is not None:
+        listings = build_listings(previous, previous_started_ns) or {}
+    on_scan = None
+    if progress is not None:
+        on_scan = functools.partial(setattr, progress, "dirs_queued")
+    entries = walk(dir, workers, with_stats or with_hashes, listings, on_scan, rules)
+    if with_hashes:
+        cache = hash_cache or HashCache()
+        entries = hash_entries(dir, entries, cache)
+    try:
+        if progress is None:
+            yield from entries
+            return
+        for entry in entries:
+            if progress.cancelled:
+                raise SnapshotCancelled(dir)
+            progress.entries += 1
+            yield entry
+    finally:
+        entries.close()
+        if with_hashes and hash_cache is None:
+            cache.close()
+
+
+def _prepare_compare(
+    snap1: SnapshotData, snap2: SnapshotData
+) -> tuple[SnapshotData, SnapshotData, list[str]]:
+    """Get sorted snapshots and their identical subtrees for a comparison.
+
+    Args:
+        snap1 (SnapshotData): Snapshot data.
+        snap2 (SnapshotData): Snapshot data to compare.
+
+    Returns:
+        tuple[SnapshotData, SnapshotData, list[str]]: Sorted snapshots and
+            the topmost directories with matching tree hashes.
+    """
+    pruned = snap1.dir_tree_hashes is not None and snap2.dir_tree_hashes is not None
+    if not pruned:
+        snap1 = _sort_snapshot(snap1)
+        snap2 = _sort_snapshot(snap2)
+    instrument.add(
+        "compare.entries",
+        len(snap1.dirs) + len(snap1.files) + len(snap2.dirs) + len(snap2.files),
+    )
+    identical = []
+    if pruned:
+        identical = identical_subtrees(
+            snap1.dirs, snap1.dir_tree_hashes, snap2.dirs, snap2.dir_tree_hashes
+        )
+        instrument.add("compare.pruned_dirs", len(identical))
+    return snap1, snap2, identical
+
+
+def _modified_files(snap1: SnapshotData, snap2: SnapshotData, runs: list) -> list[str]:
+    """Get common files whose stats or hashes differ.
+
+    Args:
+        snap1 (SnapshotData): Sorted snapshot data.
+        snap2 (SnapshotData): Sorted snapshot data to compare.
+        runs (list): Runs of common files from diff_sorted.
+
+    Returns:
+        list[str]: Sorted modified files.
+    """
+    old_columns = snap1.columns("files")
+    new_columns = snap2.columns("files")
+    names = [
+        name
+        for name in (*MODIFIED_COLUMNS, HASH_COLUMN)
+        if name in old_columns and name in new_columns
+    ]
+    if not names:
+        return []
+    changed = diff_columns(
+        [old_columns[name] for name in names],
+        [new_columns[name] for name in names],
+        runs,
+    )
+    return [snap2.files[idx] for idx in changed]
+
+
+@instrument.timed("snapshot.compare")
 def compare_snapshot(snap1: SnapshotData, snap2: SnapshotData) -> SnapshotCompareData:
     """Compare two snapshot data.
 
+    Files present in both snapshots are reported as modified if their size,
+    mtime or mode differ, provided both snapshots recorded stats, or if
+    their content hashes differ, provided both snapshots recorded hashes.
+
+    If both snapshots recorded tree hashes, directories whose tree hashes
+    match are not descended into, so nearly identical snapshots are compared
+    in time proportional to the changed regions. Such snapshots are sorted by
+    construction, so their paths are not checked for order either.
+
+    Args:
+        snap1 (SnapshotData): Snapshot data.
+        snap2 (SnapshotData): Snapshot data to compare.
+
+    Returns:
+        SnapshotCompareData: SnapshotCompareData model with sorted paths.
+    """
+    snap1, snap2, identical = _prepare_compare(snap1, snap2)
+    runs = []
+    added_dirs, removed_dirs = diff_pruned(snap1.dirs, snap2.dirs, identical)
+    added_files, removed_files = diff_pruned(snap1.files, snap2.files, identical, runs)
+    return SnapshotCompareData(
+        added_dirs=added_dirs,
+        added_files=added_files,
+        removed_dirs=removed_dirs,
+        removed_files=removed_files,
+        modified_files=_modified_files(snap1, snap2, runs),
+    )
+
+
+def _subtree_range(paths: list[str], path: str) -> tuple[int, int]:
+    """Get the index range of the paths below a directory.
+
+    Args:
+        paths (list[str]): Sorted paths.
+        path (str): Directory path, empty for the root directory.
+
+    Returns:
+        tuple[int, int]: Start and end index.
+    """
+    if not path:
+        return 0, len(paths)
+    start = bisect_left(paths, path + "/")
+    return start, bisect_left(paths, path + "0", start)
+
+
+def _children(paths: list[str], path: str) -> list[str]:
+    """Get the direct children of a directory, skipping deeper subtrees.
+
+    Args:
+        paths (list[str]): Sorted paths.
+        path (str): Directory path, empty for the root directory.
+
+    Returns:
+        list[str]: Sorted child paths.
+    """
+    children = []
+    offset = len(path) + 1 if path else 0
+    idx, end = _subtree_range(paths, path)
+    while idx < end:
+        child = paths[idx]
+        slash = child.find("/", offset)
+        if slash < 0:
+            children.append(child)
+            idx += 1
+        else:
+            idx = bisect_left(paths, child[:slash] + "0", idx, end)
+    return children
+
+
+def summarize_subtree(snapshot_data: SnapshotData, path: str) -> SubtreeSummary:
+    """Count the directories, files and bytes below a directory.
+
+    Args:
+        snapshot_data (SnapshotData): Sorted SnapshotData model.
+        path (str): Directory path.
+
+    Returns:
+        SubtreeSummary: Summary of the subtree, without a size if the
+            snapshot has no stats.
+    """
+    dirs_start, dirs_end = _subtree_range(snapshot_data.dirs, path)
+    files_start, files_end = _subtree_range(snapshot_data.files, path)
+    size = None
+    if snapshot_data.file_stats is not None:
+        size = sum(snapshot_data.file_stats.size[files_start:files_end])
+    return SubtreeSummary(path, dirs_end - dirs_start, files_end - files_start, size)
+
+
+@instrument.timed("snapshot.compare_tree")
+def compare_snapshot_tree(
+    snap1: SnapshotData, snap2: SnapshotData
+) -> SnapshotTreeCompareData:
+    """Compare two snapshot data, collapsing added and removed subtrees.
+
+    Works like compare_snapshot, but an added or removed directory is
+    reported once with the size of its subtree, and the paths below it are
+    skipped rather than listed.
+
     Args:
         snap1 (SnapshotData): Snapshot data.
         snap2 (SnapshotData): Snapshot data to compare.
 
     Returns:
-        SnapshotCompareData: SnapshotCompareData model.
+        SnapshotTreeCompareData: Comparison result with sorted paths.
+    """
+    snap1, snap2, identical = _prepare_compare(snap1, snap2)
+    added_dirs, removed_dirs = diff_pruned(snap1.dirs, snap2.dirs, identical)
+    added_dirs = _topmost(added_dirs)
+    removed_dirs = _topmost(removed_dirs)
+    runs = []
+    added_files, removed_files = diff_pruned(
+        snap1.files, snap2.files, [*identical, *added_dirs, *removed_dirs], runs
+    )
+    return SnapshotTreeCompareData(
+        added_dirs=[summarize_subtree(snap2, path) for path in added_dirs],
+        added_files=added_files,
+        removed_dirs=[summarize_subtree(snap1, path) for path in removed_dirs],
+        removed_files=removed_files,
+        modified_files=_modified_files(snap1, snap2, runs),
+        old=snap1,
+        new=snap2,
+    )
+
+
+def compare_snapshot_files(
+    old_file: str, new_file: str, cache: Optional[CompareCache] = None
+) -> SnapshotTreeCompareData:
+    """Compare two snapshot files with compare_snapshot_tree, using a cache.
+
+    A cached result is returned without reading the files, and new results
+    are added to the cache.
+
+    Args:
+        old_file (str): Older snapshot file.
+        new_file (str): Newer snapshot file.
+        cache (Optional[CompareCache]): Cache, defaults to the process-wide one.
+
+    Returns:
+        SnapshotTreeCompareData: Comparison result.
     """
-    result_dirs = list(difflib.unified_diff(snap1.dirs, snap2.dirs))
-    result_files = list(difflib.unified_diff(snap1.files, snap2.files))
+    cache = cache or get_compare_cache()
+    data = cache.get(old_file, new_file)
+    if data is not None:
+        return SnapshotTreeCompareData.from_dict(data, old_file, new_file)
 
-    snap_compare = SnapshotCompareData(
-        added_dirs=[], added_files=[], removed_dirs=[], removed_files=[]
+    compare_data = compare_snapshot_tree(
+        read_snp_data(old_file), read_snp_data(new_file)
     )
+    compare_data.old_file = old_file
+    compare_data.new_file = new_file
+    cache.put(old_file, new_file, compare_data.to_dict())
+    return compare_data
 
-    for result in result_dirs:
-        if result.find("\n") == -1:
-            if result.startswith("+"):
-                snap_compare.added_dirs.append(result.strip("+"))
-            elif result.startswith("-"):
-                snap_compare.removed_dirs.append(result.strip("-"))
 
-    for result in result_files:
-        if result.find("\n") == -1:
-            if result.startswith("+"):
-                snap_compare.added_files.append(result.strip("+"))
-            elif result.startswith("-"):
-                snap_compare.removed_files.append(result.strip("-"))
+def _topmost(dirs: list[str]) -> list[str]:
+    """Get the directories whose parent is not listed as well.
 
-    return snap_compare
+    Args:
+        dirs (list[str]): Sorted added or removed directories.
+
+    Returns:
+        list[str]: Sorted topmost directories.
+    """
+    dir_set = set(dirs)
+    return [path for path in dirs if path.rpartition("/")[0] not in dir_set]
+
+
+_filename_lock = threading.Lock()
+_last_filename_time = datetime.datetime.min
 
 
 def generate_snp_filename(id: int) -> str:
-    """Generate snapshot filename.
+    """Generate a unique snapshot filename.
+
+    Names carry a timestamp with microseconds. Timestamps handed out by this
+    process only increase, and a timestamp whose file already exists, e.g.
+    written by another process, is skipped, so snapshots of the same
+    directory started in quick succession never share a file.
 
     Args:
         id (int): Snapshot id.
@@ -86,33 +902,1052 @@ def generate_snp_filename(id: int) -> str:
     Returns:
         str: Generated filename.
     """
-    now = datetime.datetime.now()
-    timestamp = now.strftime("%Y%m%d%H%M%S")
-    return (get_snapshot_dir() / f"snapshot-{id}-{timestamp}.snp").as_posix()
+    global _last_filename_time
+    snapshot_dir = get_snapshot_dir()
+    with _filename_lock:
+        now = max(
+            datetime.datetime.now(),
+            _last_filename_time + datetime.timedelta(microseconds=1),
+        )
+        while True:
+            timestamp = now.strftime("%Y%m%d%H%M%S%f")
+            file = snapshot_dir / f"snapshot-{id}-{timestamp}.snp"
+            if not file.exists():
+                break
+            now += datetime.timedelta(microseconds=1)
+        _last_filename_time = now
+    return file.as_posix()
 
 
-def write_snp_data(snapshot_data: SnapshotData, file: str) -> bool:
+def get_snp_file(snap_file: str) -> str:
+    """Get full path of a snapshot file registered in the database.
+
+    Args:
+        snap_file (str): Snapshot file name.
+
+    Returns:
+        str: Full path of snapshot file.
+    """
+    return (get_snapshot_dir() / snap_file).as_posix()
+
+
+def read_snp_meta(file: str) -> Optional[dict]:
+    """Read the metadata of a snapshot file without decoding its entries.
+
+    Args:
+        file (str): Snapshot file path.
+
+    Returns:
+        Optional[dict]: File metadata, empty for legacy files, None if the
+            file cannot be read.
+    """
+    if not is_snp_file(file):
+        return {} if Path(file).is_file() else None
+    try:
+        with SnpReader(file) as reader:
+            return reader.meta
+    except (OSError, ValueError):
+        return None
+
+
+def _chain_depth(file: str) -> Optional[int]:
+    """Get the delta chain depth of a snapshot file.
+
+    Args:
+        file (str): Snapshot file path.
+
+    Returns:
+        Optional[int]: 0 for full snapshots, the number of deltas down to the
+            keyframe for delta snapshots, None if the file cannot be read.
+    """
+    meta = read_snp_meta(file)
+    return None if meta is None else meta.get("depth", 0)
+
+
+def _keyframe_entries(file: str) -> Optional[int]:
+    """Get the number of entries of the keyframe of a snapshot file.
+
+    Deltas are at most half the size of their snapshot, so this estimates
+    the size of the snapshot without materializing its chain.
+
+    Args:
+        file (str): Snapshot file path.
+
+    Returns:
+        Optional[int]: Number of directories and files, None for legacy and
+            chunked files or if a file in the chain cannot be read.
+    """
+    for _ in range(SNP_KEYFRAME_INTERVAL):
+        if not is_snp_file(file):
+            return None
+        try:
+            with SnpReader(file) as reader:
+                kind = reader.meta.get("kind")
+                if kind == "chunked":
+                    return None
+                if kind != "delta":
+                    return reader.count("dirs") + reader.count("files")
+                file = Path(file).with_name(reader.meta["base"]).as_posix()
+        except (OSError, ValueError, KeyError):
+            return None
+    return None
+
+
+def _iter_section(reader: SnpReader, section: str) -> Iterator:
+    """Iterate over the rows of a section, as paths if it has no columns.
+
+    Args:
+        reader (SnpReader): Snapshot file reader.
+        section (str): Section name.
+
+    Returns:
+        Iterator: Sorted paths or (path, *values) tuples.
+    """
+    if section in reader.sections and reader.columns(section):
+        return reader.iter_rows(section)
+    return reader.iter_paths(section)
+
+
+def _iter_chain_rows(
+    file: str, section: str, max_depth: Optional[int] = None
+) -> Iterator:
+    """Stream the rows of a snapshot section, applying its delta chain.
+
+    Every file of the chain is read block by block, so memory does not grow
+    with the size of the snapshot.
+
+    Args:
+        file (str): Snapshot file path.
+        section (str): Section name.
+        max_depth (Optional[int]): Maximum chain depth expected for the file.
+
+    Yields:
+        Union[str, tuple]: Sorted paths or (path, *values) tuples.
+
+    Raises:
+        OSError: If a file in the chain cannot be read.
+        ValueError: If a file in the chain is corrupt, legacy or chunked.
+    """
+    if not is_snp_file(file):
+        raise SnpFormatError(f"{file}: legacy snapshots cannot be streamed")
+    with SnpReader(file) as reader:
+        meta = reader.meta
+        if meta.get("kind") == "chunked":
+            raise SnpFormatError(f"{file}: chunked snapshots cannot be streamed")
+        rows = _iter_section(reader, section)
+        if meta.get("kind") == "delta":
+            depth = meta["depth"]
+            if depth < 1 or (max_depth is not None and depth > max_depth):
+                raise SnpFormatError(f"{file}: broken delta chain")
+            base = Path(file).with_name(meta["base"]).as_posix()
+            rows = merge_delta(
+                _iter_chain_rows(base, section, depth - 1),
+                reader.iter_paths(f"removed_{section}"),
+                rows,
+            )
+        yield from rows
+
+
+def _stream_delta(
+    full_file: str, file: str, base_file: str, keyframe_interval: int
+) -> Optional[tuple[dict, dict, dict]]:
+    """Build delta sections of a full snapshot file against a base file.
+
+    Streaming counterpart of _build_delta. The rows of both files are
+    merged block by block, once to count the changes and once more for
+    each section as it is written, so memory does not grow with the size
+    of the tree.
+
+    Args:
+        full_file (str): Full snapshot file of the new snapshot.
+        file (str): File output path.
+        base_file (str): Previous snapshot file in the same directory.
+        keyframe_interval (int): Maximum chain length including the keyframe.
+
+    Returns:
+        Optional[tuple[dict, dict, dict]]: Lazy sections, column specs and
+            metadata, or None if a keyframe should be written instead.
+    """
+    if Path(base_file).parent.resolve() != Path(file).parent.resolve():
+        return None
+    depth = _chain_depth(base_file)
+    if depth is None or depth + 1 >= keyframe_interval or not is_snp_file(base_file):
+        return None
+    try:
+        with SnpReader(full_file) as reader, SnpReader(base_file) as base:
+            columns = {section: reader.columns(section) for section in SNP_SECTIONS}
+            for section in SNP_SECTIONS:
+                if base.columns(section) != columns[section]:
+                    return None
+            total = reader.count("dirs") + reader.count("files")
+            changes = 0
+            for section in SNP_SECTIONS:
+                rows = _iter_chain_rows(base_file, section)
+                for _ in diff_rows(rows, _iter_section(reader, section)):
+                    changes += 1
+                    # A delta larger than half the snapshot is not worth it.
+                    if changes * 2 > total:
+                        return None
+    except (OSError, ValueError, KeyError):
+        return None
+
+    def changed(section: str, upserted: bool) -> Iterator:
+        with SnpReader(full_file) as reader:
+            rows = _iter_chain_rows(base_file, section)
+            for is_upsert, row in diff_rows(rows, _iter_section(reader, section)):
+                if is_upsert == upserted:
+                    yield row
+
+    sections = {}
+    for section in SNP_SECTIONS:
+        sections[section] = changed(section, True)
+        sections[f"removed_{section}"] = changed(section, False)
+    meta = {"kind": "delta", "base": Path(base_file).name, "depth": depth + 1}
+    return sections, columns, meta
+
+
+def _build_delta(
+    snapshot_data: SnapshotData, file: str, base_file: str, keyframe_interval: int
+) -> Optional[tuple[dict, dict, dict]]:
+    """Build delta sections of a snapshot against a base snapshot file.
+
+    Args:
+        snapshot_data (SnapshotData): Sorted SnapshotData model.
+        file (str): File output path.
+        base_file (str): Previous snapshot file in the same directory.
+        keyframe_interval (int): Maximum chain length including the keyframe.
+
+    Returns:
+        Optional[tuple[dict, dict, dict]]: Sections, column specs and metadata,
+            or None if a keyframe should be written instead.
+    """
+    if Path(base_file).parent.resolve() != Path(file).parent.resolve():
+        return None
+    depth = _chain_depth(base_file)
+    if depth is None or depth + 1 >= keyframe_interval:
+        return None
+    base = _read_cached(base_file)[0]
+
+    sections = {}
+    columns = {}
+    changes = 0
+    for section in SNP_SECTIONS:
+        base_columns = base.columns(section)
+        new_columns = snapshot_data.columns(section)
+        if _column_specs(base_columns) != _column_specs(new_columns):
+            return None
+
+        paths = getattr(snapshot_data, section)
+        runs = []
+        added, removed = diff_sorted(getattr(base, section), paths, runs)
+        upserts = [bisect_left(paths, path) for path in added]
+        if new_columns:
+            upserts += diff_columns(
+                list(base_columns.values()), list(new_columns.values()), runs
+            )
+            upserts.sort()
+            columns[section] = _column_specs(new_columns)
+            sections[section] = zip(
+                [paths[i] for i in upserts],
+                *([col[i] for i in upserts] for col in new_columns.values()),
+            )
+        else:
+            sections[section] = [paths[i] for i in upserts]
+        sections[f"removed_{section}"] = removed
+        changes += len(upserts) + len(removed)
+
+    # A delta larger than half the snapshot is not worth the reconstruction.
+    if changes * 2 > len(snapshot_data.dirs) + len(snapshot_data.files):
+        return None
+    meta = {"kind": "delta", "base": Path(base_file).name, "depth": depth + 1}
+    return sections, columns, meta
+
+
+def _join(parent: str, name: str) -> str:
+    return f"{parent}/{name}" if parent else name
+
+
+def _write_chunks(snapshot_data: SnapshotData, store: ChunkStore) -> str:
+    """Store the listing of each directory of a snapshot as a chunk.
+
+    A chunk holds the column names, the names and column values of the
+    files of a directory, and those of its subdirectories with the digests
+    of their own chunks. Directories are visited children first, so the
+    chunk of the root directory identifies the whole tree, and unchanged
+    subtrees map to chunks that are already stored, even if they belong
+    to another snapshot directory.
+
+    Args:
+        snapshot_data (SnapshotData): Sorted SnapshotData model.
+        store (ChunkStore): Chunk store.
+
+    Returns:
+        str: Digest of the root directory chunk.
+
+    Raises:
+        OSError: If a chunk cannot be written.
+        ValueError: If a path has no parent directory in the snapshot.
+    """
+    dirs = snapshot_data.dirs
+    files = snapshot_data.files
+    dir_columns = snapshot_data.columns("dirs")
+    file_columns = snapshot_data.columns("files")
+    children = {path: ([], []) for path in ("", *dirs)}
+    for k, paths in enumerate((files, dirs)):
+        for idx, path in enumerate(paths):
+            entry = children.get(path.rpartition("/")[0])
+            if entry is None:
+                raise ValueError(f"{path}: parent directory missing")
+            entry[k].append(idx)
+
+    header = [list(dir_columns), list(file_columns)]
+    dir_values = list(dir_columns.values())
+    file_values = list(file_columns.values())
+    digests = {}
+    for path in (*reversed(dirs), ""):
+        file_idx, dir_idx = children[path]
+        file_rows = [
+            [files[i].rpartition("/")[2], *(col[i] for col in file_values)]
+            for i in file_idx
+        ]
+        dir_rows = [
+            [
+                dirs[i].rpartition("/")[2],
+                *(col[i] for col in dir_values),
+                digests.pop(dirs[i]),
+            ]
+            for i in dir_idx
+        ]
+        data = json.dumps([*header, file_rows, dir_rows], separators=(",", ":"))
+        digests[path] = store.put(data.encode())
+    return digests[""]
+
+
+def _read_chunks(store: ChunkStore, meta: dict) -> SnapshotData:
+    """Rebuild a snapshot from the chunks referenced by its manifest.
+
+    Rows are emitted in sorted path order, so no sort is needed. The rows
+    of a chunk are sorted by name, but the subtree of a subdirectory sorts
+    by its name followed by a slash, e.g. "a-b" before "a/x". The tree is
+    walked depth first, visiting subtrees in that order and emitting the
+    rows of each directory that sort before the next subtree.
+
+    Args:
+        store (ChunkStore): Chunk store.
+        meta (dict): Manifest metadata with the root digest and column specs.
+
+    Returns:
+        SnapshotData: Sorted SnapshotData model.
+
+    Raises:
+        OSError: If a chunk is missing.
+        ValueError: If a chunk is corrupt or its columns differ.
+    """
+    snapshot_data = SnapshotData(dirs=[], files=[])
+    specs = meta["columns"]
+    names = [[name for name, _, _ in specs[section]] for section in SNP_SECTIONS]
+    columns = {
+        section: [array(typecode) for _, typecode, _ in specs[section]]
+        for section in SNP_SECTIONS
+    }
+    # Per section: paths, columns, chunk rows index and end of the values.
+    outputs = (
+        (snapshot_data.files, columns["files"], 2, None),
+        (snapshot_data.dirs, columns["dirs"], 3, -1),
+    )
+    decoded = {}
+
+    def enter(path: str, digest: str) -> list:
+        chunk = decoded.get(digest)
+        if chunk is None:
+            chunk = decoded[digest] = json.loads(store.get(digest))
+            if chunk[:2] != names:
+                raise SnpFormatError(f"Chunk {digest}: columns differ from manifest")
+        subtrees = iter(sorted(chunk[3], key=lambda row: row[0] + "/"))
+        return [path, chunk, subtrees, 0, 0]
+
+    stack = [enter("", meta["root"])]
+    while stack:
+        frame = stack[-1]
+        path, chunk, subtrees = frame[:3]
+        subtree = next(subtrees, None)
+        for k, (paths, cols, rows_idx, end) in enumerate(outputs):
+            rows = chunk[rows_idx]
+            pos = frame[3 + k]
+            while pos < len(rows) and (
+                subtree is None or rows[pos][0] < subtree[0] + "/"
+            ):
+                row = rows[pos]
+                paths.append(_join(path, row[0]))
+                for col, value in zip(cols, row[1:end]):
+                    col.append(value)
+                pos += 1
+            frame[3 + k] = pos
+        if subtree is None:
+            stack.pop()
+        else:
+            stack.append(enter(_join(path, subtree[0]), subtree[-1]))
+    for section, section_names in zip(SNP_SECTIONS, names):
+        snapshot_data.set_columns(section, dict(zip(section_names, columns[section])))
+    return snapshot_data
+
+
+def _manifest_store(file: str, meta: dict) -> ChunkStore:
+    return open_chunk_store(Path(os.path.normpath(Path(file).parent / meta["store"])))
+
+
+def chunk_references(files: Iterable[str]) -> Optional[set[str]]:
+    """Get the digests of all chunks referenced by snapshot files.
+
+    Chunks shared by several snapshots are only decoded once.
+
+    Args:
+        files (Iterable[str]): Snapshot file paths.
+
+    Returns:
+        Optional[set[str]]: Chunk digests, None if a manifest or one of its
+            chunks cannot be read, so nothing must be deleted.
+    """
+    referenced = set()
+    for file in files:
+        meta = read_snp_meta(file)
+        if meta is None:
+            return None
+        if meta.get("kind") != "chunked":
+            continue
+        store = _manifest_store(file, meta)
+        pending = [meta["root"]]
+        try:
+            while pending:
+                digest = pending.pop()
+                if digest in referenced:
+                    continue
+                referenced.add(digest)
+                pending.extend(row[-1] for row in json.loads(store.get(digest))[3])
+        except (OSError, ValueError):
+            return None
+    return referenced
+
+
+@instrument.timed("snapshot.write")
+def write_snp_data(
+    snapshot_data: SnapshotData,
+    file: str,
+    base_file: Optional[str] = None,
+    keyframe_interval: int = SNP_KEYFRAME_INTERVAL,
+    meta: Optional[dict] = None,
+    store: Optional[ChunkStore] = None,
+) -> bool:
     """Write snapshot data to file.
 
+    If a base file is given, the snapshot is written as a delta of removed
+    and added or changed entries against it, unless the chain already holds
+    keyframe_interval snapshots, the columns differ or the delta is large, in
+    which case a full keyframe is written.
+
+    If a chunk store is given, the listing of each directory is stored there
+    instead and the file becomes a manifest referencing the root chunk, so
+    only directories that changed since any stored snapshot add data.
+
     Args:
         snapshot_data (SnapshotData): SnapshotData model.
         file (str): File output path.
+        base_file (Optional[str]): Previous snapshot file in the same directory.
+        keyframe_interval (int): Maximum chain length including the keyframe.
+        meta (Optional[dict]): Extra JSON serializable file metadata.
+        store (Optional[ChunkStore]): Chunk store to write a manifest for.
+            base_file and keyframe_interval are ignored then.
 
     Returns:
         bool: True if file was written successfully.
     """
+    snapshot_data = _sort_snapshot(snapshot_data)
     try:
-        with open(file, "wb") as f:
-            pickle.dump(snapshot_data.dirs, f)
-            pickle.dump(snapshot_data.files, f)
-    except OSError:
+        delta = None
+        if store is not None:
+            with instrument.span("snapshot.chunks"):
+                root = _write_chunks(snapshot_data, store)
+            sections = {section: [] for section in SNP_SECTIONS}
+            columns = {}
+            file_meta = {
+                "kind": "chunked",
+                "depth": 0,
+                "root": root,
+                "store": os.path.relpath(store.dir, Path(file).parent),
+                "columns": {
+                    section: _column_specs(snapshot_data.columns(section))
+                    for section in SNP_SECTIONS
+                },
+            }
+        elif base_file is not None:
+            delta = _build_delta(snapshot_data, file, base_file, keyframe_interval)
+        if delta is not None:
+            sections, columns, file_meta = delta
+        elif store is None:
+            sections = {}
+            columns = {}
+            file_meta = {"kind": "full", "depth": 0}
+            for section in SNP_SECTIONS:
+                paths = getattr(snapshot_data, section)
+                section_columns = snapshot_data.columns(section)
+                if section_columns:
+                    sections[section] = zip(paths, *section_columns.values())
+                    columns[section] = _column_specs(section_columns)
+                else:
+                    sections[section] = paths
+        write_snp_file(file, sections, columns, {**file_meta, **(meta or {})})
+        instrument.add(f"snapshot.{file_meta['kind']}_files")
+        instrument.add("snapshot.bytes_written", os.path.getsize(file))
+    except (OSError, ValueError, pickle.UnpicklingError):
+        Path(file).unlink(missing_ok=True)
         return False
     return True
 
 
+def _write_run(run_dir: str, sections: dict[str, list], columns: dict) -> str:
+    """Sort buffered rows and spill them to a temporary run file.
+
+    Args:
+        run_dir (str): Directory for run files.
+        sections (dict[str, list]): Buffered rows of each section.
+        columns (dict): Column specs per section.
+
+    Returns:
+        str: Run file path.
+    """
+    for rows in sections.values():
+        rows.sort()
+    fd, run_file = tempfile.mkstemp(suffix=APP_SNAPSHOT_EXT, dir=run_dir)
+    os.close(fd)
+    write_snp_file(run_file, sections, columns)
+    return run_file
+
+
+def _record_written(
+    file: str, progress: Optional[SnapshotProgress], counter: str
+) -> None:
+    """Add the size of a written file to progress and a counter.
+
+    Args:
+        file (str): Written file.
+        progress (Optional[SnapshotProgress]): Progress to update.
+        counter (str): Instrumentation counter name.
+    """
+    size = os.path.getsize(file)
+    instrument.add(counter, size)
+    if progress is not None:
+        progress.bytes_written += size
+
+
+def _entry_row(entry: WalkEntry) -> Union[str, tuple]:
+    """Get the snapshot file row of a streamed entry.
+
+    Args:
+        entry (WalkEntry): Snapshot entry.
+
+    Returns:
+        Union[str, tuple]: Path, or (path, *stat values[, hash]) if the entry
+            carries stats.
+    """
+    if entry.stat is None:
+        return entry.path
+    row = (entry.path, *SnapshotStats.values(entry.stat))
+    if entry.content_hash is not None:
+        row += (entry.content_hash,)
+    return row
+
+
+def _entry_columns(entry: WalkEntry) -> list[tuple[str, str, int]]:
+    """Get the column specs matching the row of a streamed entry.
+
+    Args:
+        entry (WalkEntry): Snapshot entry.
+
+    Returns:
+        list[tuple[str, str, int]]: Column specs.
+    """
+    template = _empty_snapshot(entry.stat is not None, entry.content_hash is not None)
+    return _column_specs(template.columns("files"))
+
+
+def _with_tree_hashes(sections: dict[str, Iterable], columns: dict) -> dict:
+    """Add a tree hash column to the dirs of streamed sorted sections.
+
+    Files are hashed as they are written, so they come first, and the much
+    smaller dirs section is buffered until the tree hashes are known.
+
+    Args:
+        sections (dict[str, Iterable]): Sorted rows of each section.
+        columns (dict): Column specs per section, updated with the hash column.
+
+    Returns:
+        dict: Sections in write order.
+    """
+    hasher = TreeHasher()
+    file_columns = columns.get("files", [])
+    pack = _tree_hash_struct(file_columns).pack
+    fields = [
+        idx + 1 for idx in _tree_hash_fields([name for name, _, _ in file_columns])
+    ]
+
+    def hashed_files() -> Iterator:
+        for row in sections["files"]:
+            if isinstance(row, str):
+                hasher.add_file(row)
+            else:
+                hasher.add_file(row[0], pack(*(row[idx] for idx in fields)))
+            yield row
+
+    def hashed_dirs() -> Iterator[tuple]:
+        rows = list(sections["dirs"])
+        paths = [row if isinstance(row, str) else row[0] for row in rows]
+        for row, tree_hash in zip(rows, hasher.finish(paths)):
+            yield (row, tree_hash) if isinstance(row, str) else (*row, tree_hash)
+
+    columns["dirs"] = [*columns.get("dirs", []), (TREE_HASH_COLUMN, "Q", 1)]
+    return {"files": hashed_files(), "dirs": hashed_dirs()}
+
+
+@instrument.timed("snapshot.write_stream")
+def write_snp_stream(
+    entries: Iterable[WalkEntry],
+    file: str,
+    chunk_size: int = SNP_CHUNK_SIZE,
+    progress: Optional[SnapshotProgress] = None,
+    with_tree_hashes: bool = False,
+    meta: Optional[dict] = None,
+) -> bool:
+    """Write streamed snapshot entries to file with bounded memory.
+
+    Entries are buffered in chunks of chunk_size, and each full chunk is
+    sorted and spilled to a temporary run file next to the output. The runs
+    are then merged block by block into the final file, so memory use is
+    bounded by the chunk size rather than the size of the tree. Stats and
+    hashes are recorded if the entries carry them. A partially written file
+    is removed on failure.
+
+    Args:
+        entries (Iterable[WalkEntry]): Snapshot entries, e.g. from iter_snapshot.
+        file (str): File output path.
+        chunk_size (int): Number of paths buffered before spilling a run.
+        progress (Optional[SnapshotProgress]): Progress to add the bytes of
+            run files and the output file to.
+        with_tree_hashes (bool): Whether to record Merkle tree hashes of
+            directories. Only the directory rows are kept in memory for this.
+        meta (Optional[dict]): JSON serializable file metadata.
+
+    Returns:
+        bool: True if file was written successfully.
+
+    Raises:
+        SnapshotCancelled: If the entries are cancelled through progress.
+    """
+    sections = {section: [] for section in SNP_SECTIONS}
+    columns = {}
+    buffered = 0
+    try:
+        with tempfile.TemporaryDirectory(dir=Path(file).parent) as run_dir:
+            runs = []
+            for entry in entries:
+                section = "dirs" if entry.is_dir else "files"
+                if section not in columns:
+                    columns[section] = _entry_columns(entry)
+                sections[section].append(_entry_row(entry))
+                buffered += 1
+                if buffered >= chunk_size:
+                    runs.append(_write_run(run_dir, sections, columns))
+                    sections = {section: [] for section in SNP_SECTIONS}
+                    buffered = 0
+                    _record_written(runs[-1], progress, "snapshot.run_bytes")
+
+            if not runs:
+                for rows in sections.values():
+                    rows.sort()
+                if with_tree_hashes:
+                    sections = _with_tree_hashes(sections, columns)
+                write_snp_file(file, sections, columns, meta)
+                _record_written(file, progress, "snapshot.bytes_written")
+                return True
+
+            if buffered:
+                runs.append(_write_run(run_dir, sections, columns))
+                _record_written(runs[-1], progress, "snapshot.run_bytes")
+            readers = [SnpReader(run) for run in runs]
+            try:
+                merged = {
+                    section: heapq.merge(
+                        *(
+                            (
+                                r.iter_rows(section)
+                                if columns.get(section)
+                                else r.iter_paths(section)
+                            )
+                            for r in readers
+                        )
+                    )
+                    for section in SNP_SECTIONS
+                }
+                if with_tree_hashes:
+                    merged = _with_tree_hashes(merged, columns)
+                write_snp_file(file, merged, columns, meta)
+            finally:
+                for reader in readers:
+                    reader.close()
+            _record_written(file, progress, "snapshot.bytes_written")
+    except BaseException as e:
+        Path(file).unlink(missing_ok=True)
+        if isinstance(e, OSError):
+            return False
+        raise
+    return True
+
+
+def _write_snp_stream_delta(
+    entries: Iterable[WalkEntry],
+    file: str,
+    base_file: str,
+    keyframe_interval: int = SNP_KEYFRAME_INTERVAL,
+    progress: Optional[SnapshotProgress] = None,
+    meta: Optional[dict] = None,
+) -> bool:
+    """Write streamed snapshot entries to file as a delta of a base file.
+
+    The entries are first written to a temporary full snapshot file with
+    write_snp_stream, which is then merged against the base file into the
+    delta sections, see _stream_delta. If a keyframe should be written
+    instead, the temporary file becomes the output file.
+
+    Args:
+        entries (Iterable[WalkEntry]): Snapshot entries, e.g. from iter_snapshot.
+        file (str): File output path.
+        base_file (str): Previous snapshot file in the same directory.
+        keyframe_interval (int): Maximum chain length including the keyframe.
+        progress (Optional[SnapshotProgress]): Progress to add written bytes to.
+        meta (Optional[dict]): Extra JSON serializable file metadata.
+
+    Returns:
+        bool: True if file was written successfully.
+
+    Raises:
+        SnapshotCancelled: If the entries are cancelled through progress.
+    """
+    meta = meta or {}
+    fd, full_file = tempfile.mkstemp(suffix=APP_SNAPSHOT_EXT, dir=Path(file).parent)
+    os.close(fd)
+    try:
+        full_meta = {"kind": "full", "depth": 0, **meta}
+        if not write_snp_stream(
+            entries, full_file, progress=progress, with_tree_hashes=True, meta=full_meta
+        ):
+            return False
+        with instrument.span("snapshot.delta"):
+            delta = _stream_delta(full_file, file, base_file, keyframe_interval)
+            if delta is None:
+                os.replace(full_file, file)
+                instrument.add("snapshot.full_files")
+                return True
+            sections, columns, file_meta = delta
+            write_snp_file(file, sections, columns, {**file_meta, **meta})
+        instrument.add("snapshot.delta_files")
+        _record_written(file, progress, "snapshot.bytes_written")
+    except (OSError, ValueError):
+        Path(file).unlink(missing_ok=True)
+        return False
+    finally:
+        Path(full_file).unlink(missing_ok=True)
+    return True
+
+
+@instrument.timed("snapshot.take")
+def take_snapshot(
+    dir: str,
+    file: str,
+    base_file: Optional[str] = None,
+    with_stats: bool = True,
+    progress: Optional[SnapshotProgress] = None,
+    rules: Optional[PathRules] = None,
+    store: Optional[ChunkStore] = None,
+) -> bool:
+    """Take a snapshot of a directory and write it to file.
+
+    The entries are streamed to a full snapshot file. With a base file, the
+    base snapshot drives an incremental walk and the result is written as a
+    delta of it, merged from both files block by block. Tree hashes are
+    recorded either way, so comparisons between snapshots can skip unchanged
+    subtrees.
+
+    Reusing listings needs the whole base snapshot in memory, so bases with
+    more than INCREMENTAL_WALK_MAX_ENTRIES entries are walked in full
+    instead, and memory use stays bounded for any size of tree.
+
+    The fingerprint of the rules is stored in the file metadata. Listings
+    of a base snapshot taken with other rules may lack entries that are no
+    longer excluded, so the tree is then walked in full.
+
+    The start time of the walk is stored as well, so the next snapshot reads
+    racily clean directories again. Base files without it fall back to their
+    own mtime, which is later than the start of their walk.
+
+    With a chunk store, the snapshot is built in memory and written as a
+    manifest of directory chunks, see write_snp_data.
+
+    Args:
+        dir (str): Directory to snapshot.
+        file (str): File output path.
+        base_file (Optional[str]): Previous snapshot file of the directory.
+        with_stats (bool): Whether to record size, mtime, mode, inode and device.
+        progress (Optional[SnapshotProgress]): Progress to update.
+        rules (Optional[PathRules]): Rules of entries to leave out.
+        store (Optional[ChunkStore]): Chunk store to write a manifest for.
+
+    Returns:
+        bool: True if file was written successfully.
+
+    Raises:
+        SnapshotCancelled: If the snapshot is cancelled through progress. No
+            file is left behind.
+    """
+    meta = {"rules": rules.fingerprint} if rules else {}
+    meta["started_ns"] = time.time_ns()
+    previous = None
+    previous_started_ns = None
+    base_meta = read_snp_meta(base_file) if base_file is not None else None
+    if base_meta is not None and base_meta.get("rules") == meta.get("rules"):
+        base_entries = _keyframe_entries(base_file)
+        if store is not None or (
+            base_entries is not None and base_entries <= INCREMENTAL_WALK_MAX_ENTRIES
+        ):
+            previous = read_snp_data(base_file)
+            previous_started_ns = base_meta.get("started_ns")
+        if previous is not None and previous_started_ns is None:
+            try:
+                previous_started_ns = os.stat(base_file).st_mtime_ns
+            except OSError:
+                previous = None
+
+    if store is None:
+        entries = iter_snapshot(
+            dir,
+            with_stats=with_stats,
+            previous=previous,
+            progress=progress,
+            rules=rules,
+            previous_started_ns=previous_started_ns,
+        )
+        if base_file is None:
+            return write_snp_stream(
+                entries, file, progress=progress, with_tree_hashes=True, meta=meta
+            )
+        return _write_snp_stream_delta(
+            entries, file, base_file, progress=progress, meta=meta
+        )
+
+    snapshot_data = create_snapshot(
+        dir,
+        with_stats=with_stats,
+        previous=previous,
+        progress=progress,
+        with_tree_hashes=True,
+        rules=rules,
+        previous_started_ns=previous_started_ns,
+    )
+    if not write_snp_data(snapshot_data, file, meta=meta, store=store):
+        return False
+    if progress is not None:
+        progress.bytes_written += os.path.getsize(file)
+    return True
+
+
+class _SnpUnpickler(pickle.Unpickler):
+    """Unpickler for legacy snapshot files that refuses to load any class."""
+
+    def find_class(self, module: str, name: str):
+        raise pickle.UnpicklingError(f"{module}.{name} is not allowed in .snp files")
+
+
+def _read_legacy_snp_data(file: str) -> SnapshotData:
+    """Read snapshot data from a legacy pickle file.
+
+    Both whole-list files and chunked files of the previous formats are
+    supported. Only builtin containers and strings are unpickled.
+
+    Args:
+        file (str): File input path.
+
+    Returns:
+        SnapshotData: SnapshotData model.
+    """
+    snapshot_data = SnapshotData(dirs=[], files=[])
+    with open(file, "rb") as f:
+        unpickler = _SnpUnpickler(f)
+        record = unpickler.load()
+        if isinstance(record, list):
+            snapshot_data.dirs = record
+            snapshot_data.files = unpickler.load()
+        else:
+            while record is not None:
+                kind, paths = record
+                getattr(snapshot_data, kind).extend(paths)
+                record = unpickler.load()
+    return snapshot_data
+
+
+def _file_key(file: str) -> tuple[str, int, int, int]:
+    """Get the path, size, mtime and inode of a file to validate caches.
+
+    Args:
+        file (str): File path.
+
+    Returns:
+        tuple[str, int, int, int]: File key.
+
+    Raises:
+        OSError: If the file cannot be stat'ed.
+    """
+    st = os.stat(file)
+    return file, st.st_size, st.st_mtime_ns, st.st_ino
+
+
+def _is_current(entry: tuple[list, SnapshotData]) -> bool:
+    """Check if the files a cached snapshot was read from are unchanged.
+
+    Args:
+        entry (tuple[list, SnapshotData]): File keys of the chain and snapshot.
+
+    Returns:
+        bool: True if every file still has the same size, mtime and inode.
+    """
+    try:
+        return all(_file_key(key[0]) == key for key in entry[0])
+    except OSError:
+        return False
+
+
+def _estimate_size(snapshot_data: SnapshotData) -> int:
+    """Estimate the memory held by snapshot data.
+
+    Args:
+        snapshot_data (SnapshotData): SnapshotData model.
+
+    Returns:
+        int: Estimated bytes of the paths and columns.
+    """
+    size = 0
+    for section in SNP_SECTIONS:
+        size += estimate_paths_size(getattr(snapshot_data, section))
+        for col in snapshot_data.columns(section).values():
+            size += col.itemsize * len(col)
+    return size
+
+
+def _read_cached(
+    file: str, max_depth: Optional[int] = None
+) -> tuple[SnapshotData, list]:
+    """Read snapshot data through the snapshot cache.
+
+    Args:
+        file (str): File input path.
+        max_depth (Optional[int]): Maximum chain depth expected for the file.
+
+    Returns:
+        tuple[SnapshotData, list]: SnapshotData model and the keys of the
+            files it was read from.
+
+    Raises:
+        OSError: If a file in the chain cannot be read.
+        ValueError: If a file in the chain is corrupt.
+    """
+    entry = SNAPSHOT_CACHE.get(file, _is_current)
+    if entry is not None:
+        instrument.add("cache.snapshot_hits")
+        return entry[1], entry[0]
+    instrument.add("cache.snapshot_misses")
+    chain = []
+    snapshot_data = _read_snp_data(file, max_depth, chain)
+    SNAPSHOT_CACHE.put(file, (chain, snapshot_data), _estimate_size(snapshot_data))
+    return snapshot_data, chain
+
+
+def _read_snp_data(
+    file: str, max_depth: Optional[int] = None, chain: Optional[list] = None
+) -> SnapshotData:
+    """Read snapshot data from file, materializing delta chains.
+
+    Bases of delta snapshots are read through the snapshot cache, so
+    snapshots sharing a base only decode it once.
+
+    Args:
+        file (str): File input path.
+        max_depth (Optional[int]): Maximum chain depth expected for the file,
+            guarding against broken or cyclic chains.
+        chain (Optional[list]): If given, receives the keys of the file and
+            its bases, taken before they are read.
+
+    Returns:
+        SnapshotData: SnapshotData model.
+
+    Raises:
+        OSError: If a file in the chain cannot be read.
+        ValueError: If a file in the chain is corrupt.
+    """
+    if chain is not None:
+        chain.append(_file_key(file))
+    if not is_snp_file(file):
+        return _read_legacy_snp_data(file)
+
+    with SnpReader(file) as reader:
+        meta = reader.meta
+        sections = {name: reader.read_section(name) for name in reader.sections}
+    instrument.add("snapshot.files_read")
+    instrument.add("snapshot.bytes_read", os.path.getsize(file))
+    snapshot_data = SnapshotData(dirs=[], files=[])
+
+    if meta.get("kind") == "chunked":
+        return _read_chunks(_manifest_store(file, meta), meta)
+
+    if meta.get("kind") == "delta":
+        depth = meta["depth"]
+        if depth < 1 or (max_depth is not None and depth > max_depth):
+            raise SnpFormatError(f"{file}: broken delta chain")
+        base, base_chain = _read_cached(
+            Path(file).with_name(meta["base"]).as_posix(), depth - 1
+        )
+        if chain is not None:
+            chain += base_chain
+        for section in SNP_SECTIONS:
+            base_columns = base.columns(section)
+            upsert_paths, upsert_columns = sections[section]
+            if list(upsert_columns) != list(base_columns):
+                raise SnpFormatError(f"{file}: columns differ from base")
+            paths, columns = apply_delta(
+                getattr(base, section),
+                list(base_columns.values()),
+                sections[f"removed_{section}"][0],
+                upsert_paths,
+                list(upsert_columns.values()),
+            )
+            sections[section] = paths, dict(zip(base_columns, columns))
+
+    for section in SNP_SECTIONS:
+        paths, columns = sections.get(section, ([], {}))
+        setattr(snapshot_data, section, paths)
+        snapshot_data.set_columns(section, columns)
+    return snapshot_data
+
+
+@instrument.timed("snapshot.read")
 def read_snp_data(file: str) -> SnapshotData:
     """Read snapshot data from file.
 
+    Version 2 files are memory-mapped and decoded block by block, and delta
+    snapshots are transparently rebuilt from their chain. Legacy pickle files
+    are detected by their header and still supported.
+
+    Decoded snapshots are kept in SNAPSHOT_CACHE, an LRU cache with a budget
+    in estimated bytes, and reused while the size, mtime and inode of the
+    file and its bases are unchanged. The returned snapshot may therefore be
+    shared with other callers and must not be modified.
+
     Args:
         file (str): File input path.
 
@@ -120,9 +1955,6 @@ def read_snp_data(file: str) -> SnapshotData:
         SnapshotData: SnapshotData model.
     """
     try:
-        with open(file, "rb") as f:
-            dir_data = pickle.load(f)
-            file_data = pickle.load(f)
-    except OSError:
-        return [], []
-    return SnapshotData(dirs=dir_data, files=file_data)
+        return _read_cached(file)[0]
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        return SnapshotData(dirs=[], files=[])
@@ -0,0 +1,479 @@
+"""Snapshot file module for the versioned binary .snp format.
+
+Layout of a version 2 file::
+
+    header   magic, version, flags
+    blocks   front-coded path blocks with their column values
+    index    JSON block index and file metadata
+    trailer  index offset, index length, magic
+
+Each section (e.g. "dirs" or "files") is a sorted sequence of paths split into
+blocks of up to SNP_BLOCK_SIZE entries. Within a block every path stores the
+length in characters of the prefix it shares with the previous path and the
+remaining suffix, and the first path of a block is stored in full, so blocks
+decode independently. Suffixes are encoded one by one and their lengths are
+counted in bytes, so undecodable names never merge across suffixes. Optional
+fixed-width columns are stored per block as raw little-endian arrays, one
+after another.
+"""
+
+import json
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+from dir_snapshot import SNP_BLOCK_SIZE
+
+SNP_MAGIC = b"DSNP"
+SNP_VERSION = 2
+
+_HEADER = struct.Struct("<4sHH")
+_TRAILER = struct.Struct("<QQ4s")
+_BLOCK_HEAD = struct.Struct("<II")
+# Header flag of files whose suffix lengths count bytes rather than characters.
+SNP_FLAG_BYTE_LENGTHS = 1
+
+ColumnSpec = tuple[str, str, int]
+
+
+class SnpFormatError(ValueError):
+    """Raised when a snapshot file is not a valid version 2 file."""
+
+
+def _to_le(values: array) -> bytes:
+    """Get array bytes in little-endian order.
+
+    Args:
+        values (array): Array to convert.
+
+    Returns:
+        bytes: Little-endian array bytes.
+    """
+    if sys.byteorder == "big" and values.itemsize > 1:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_le(typecode: str, data: bytes) -> array:
+    """Build array from little-endian bytes.
+
+    Args:
+        typecode (str): Array typecode.
+        data (bytes): Little-endian array bytes.
+
+    Returns:
+        array: Decoded array.
+    """
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big" and values.itemsize > 1:
+        values.byteswap()
+    return values
+
+
+def _common_prefix_len(a: str, b: str) -> int:
+    """Get length of the common prefix of two strings.
+
+    Args:
+        a (str): First string.
+        b (str): Second string.
+
+    Returns:
+        int: Length of the common prefix.
+    """
+    # Sorted sibling paths usually share the whole parent directory.
+    parent_len = a.rfind("/") + 1
+    lo = parent_len if b.startswith(a[:parent_len]) else 0
+    hi = min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a.startswith(b[:mid]):
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def is_snp_file(file: str) -> bool:
+    """Check if file starts with the version 2 snapshot header.
+
+    Args:
+        file (str): File path.
+
+    Returns:
+        bool: True if file is a version 2 snapshot file.
+    """
+    try:
+        with open(file, "rb") as f:
+            return f.read(len(SNP_MAGIC)) == SNP_MAGIC
+    except OSError:
+        return False
+
+
+class SnpWriter:
+    """Writer for version 2 snapshot files."""
+
+    def __init__(self, f: BinaryIO, meta: Optional[dict] = None):
+        """Constructor method.
+
+        Args:
+            f (BinaryIO): File object opened for binary writing.
+            meta (Optional[dict]): JSON serializable file metadata.
+        """
+        self._f = f
+        self._meta = meta or {}
+        self._sections = {}
+        self._offset = f.write(
+            _HEADER.pack(SNP_MAGIC, SNP_VERSION, SNP_FLAG_BYTE_LENGTHS)
+        )
+
+    def write_section(
+        self, name: str, rows: Iterable, columns: Iterable[ColumnSpec] = ()
+    ) -> int:
+        """Write a section of sorted rows.
+
+        Args:
+            name (str): Section name.
+            rows (Iterable): Paths sorted in ascending order, or (path, *values)
+                tuples if columns are given. Values of columns wider than one
+                item are bytes.
+            columns (Iterable[ColumnSpec]): (name, typecode, width) of each column.
+
+        Returns:
+            int: Number of rows written.
+        """
+        columns = [tuple(column) for column in columns]
+        section = {"count": 0, "columns": columns, "blocks": []}
+        self._sections[name] = section
+
+        block = []
+        for row in rows:
+            block.append(row)
+            if len(block) == SNP_BLOCK_SIZE:
+                self._write_block(section, block)
+                block = []
+        if block:
+            self._write_block(section, block)
+        return section["count"]
+
+    def _write_block(self, section: dict, block: list) -> None:
+        """Encode and write one block of rows.
+
+        Args:
+            section (dict): Section index entry.
+            block (list): Rows of the block.
+        """
+        columns = section["columns"]
+        paths = [row[0] for row in block] if columns else block
+
+        prefix_lens = array("H")
+        suffix_lens = array("H")
+        suffixes = []
+        prev = ""
+        for path in paths:
+            shared = _common_prefix_len(prev, path)
+            suffix = path[shared:].encode("utf-8", "surrogateescape")
+            prefix_lens.append(shared)
+            suffix_lens.append(len(suffix))
+            suffixes.append(suffix)
+            prev = path
+        text = b"".join(suffixes)
+
+        parts = [
+            _BLOCK_HEAD.pack(len(paths), len(text)),
+            _to_le(prefix_lens),
+            _to_le(suffix_lens),
+            text,
+        ]
+        for idx, (_, typecode, width) in enumerate(columns, 1):
+            values = array(typecode)
+            if width == 1:
+                values.extend(row[idx] for row in block)
+            else:
+                for row in block:
+                    values.frombytes(row[idx])
+            parts.append(_to_le(values))
+
+        data = b"".join(parts)
+        self._f.write(data)
+        section["blocks"].append([self._offset, len(data), len(paths), paths[0]])
+        section["count"] += len(paths)
+        self._offset += len(data)
+
+    def close(self) -> None:
+        """Write block index and trailer."""
+        index = json.dumps({"meta": self._meta, "sections": self._sections})
+        data = index.encode("utf-8", "surrogateescape")
+        self._f.write(data)
+        self._f.write(_TRAILER.pack(self._offset, len(data), SNP_MAGIC))
+
+
+class SnpReader:
+    """Memory-mapped reader for version 2 snapshot files.
+
+    Blocks are only decoded when they are accessed.
+    """
+
+    def __init__(self, file: str):
+        """Constructor method.
+
+        Args:
+            file (str): File input path.
+
+        Raises:
+            SnpFormatError: If file is not a valid version 2 snapshot file.
+        """
+        with open(file, "rb") as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as e:
+                raise SnpFormatError(f"{file}: {e}") from None
+
+        try:
+            self._index = self._load_index(file)
+        except BaseException:
+            self._mmap.close()
+            raise
+
+        self._first_paths = {
+            name: [block[3] for block in section["blocks"]]
+            for name, section in self._index["sections"].items()
+        }
+
+    def _load_index(self, file: str) -> dict:
+        """Validate header and trailer and load block index.
+
+        Args:
+            file (str): File input path used in error messages.
+
+        Returns:
+            dict: Block index.
+        """
+        buf = self._mmap
+        if len(buf) < _HEADER.size + _TRAILER.size:
+            raise SnpFormatError(f"{file}: file is truncated")
+        magic, version, self._flags = _HEADER.unpack_from(buf, 0)
+        if magic != SNP_MAGIC:
+            raise SnpFormatError(f"{file}: not a snapshot file")
+        if version != SNP_VERSION:
+            raise SnpFormatError(f"{file}: unsupported version {version}")
+        offset, length, magic = _TRAILER.unpack_from(buf, len(buf) - _TRAILER.size)
+        if magic != SNP_MAGIC or offset + length + _TRAILER.size != len(buf):
+            raise SnpFormatError(f"{file}: file is truncated")
+        try:
+            data = buf[offset : offset + length].decode("utf-8", "surrogateescape")
+            return json.loads(data)
+        except ValueError as e:
+            raise SnpFormatError(f"{file}: corrupt index: {e}") from None
+
+    def __enter__(self) -> "SnpReader":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close memory map."""
+        self._mmap.close()
+
+    @property
+    def meta(self) -> dict:
+        """Get file metadata.
+
+        Returns:
+            dict: File metadata.
+        """
+        return self._index["meta"]
+
+    @property
+    def sections(self) -> list[str]:
+        """Get section names.
+
+        Returns:
+            list[str]: Section names.
+        """
+        return list(self._index["sections"])
+
+    def count(self, section: str) -> int:
+        """Get number of rows in a section.
+
+        Args:
+            section (str): Section name.
+
+        Returns:
+            int: Number of rows, 0 if section does not exist.
+        """
+        return self._index["sections"].get(section, {}).get("count", 0)
+
+    def columns(self, section: str) -> list[ColumnSpec]:
+        """Get column specs of a section.
+
+        Args:
+            section (str): Section name.
+
+        Returns:
+            list[ColumnSpec]: (name, typecode, width) of each column.
+        """
+        return [tuple(c) for c in self._index["sections"][section]["columns"]]
+
+    def num_blocks(self, section: str) -> int:
+        """Get number of blocks in a section.
+
+        Args:
+            section (str): Section name.
+
+        Returns:
+            int: Number of blocks, 0 if section does not exist.
+        """
+        return len(self._first_paths.get(section, []))
+
+    def block(self, section: str, idx: int) -> tuple[list[str], dict[str, array]]:
+        """Decode one block.
+
+        Args:
+            section (str): Section name.
+            idx (int): Block index.
+
+        Returns:
+            tuple[list[str], dict[str, array]]: Paths and column values.
+        """
+        offset, length, _, _ = self._index["sections"][section]["blocks"][idx]
+        buf = self._mmap
+        count, text_len = _BLOCK_HEAD.unpack_from(buf, offset)
+        pos = offset + _BLOCK_HEAD.size
+        prefix_lens = _from_le("H", buf[pos : pos + 2 * count])
+        pos += 2 * count
+        suffix_lens = _from_le("H", buf[pos : pos + 2 * count])
+        pos += 2 * count
+        text = buf[pos : pos + text_len]
+        pos += text_len
+        if text.isascii() or not self._flags & SNP_FLAG_BYTE_LENGTHS:
+            # Byte and character lengths agree, decode the block at once.
+            text = text.decode("utf-8", "surrogateescape")
+            suffixes = None
+        else:
+            suffixes = memoryview(text)
+
+        paths = []
+        prev = ""
+        start = 0
+        for shared, size in zip(prefix_lens, suffix_lens):
+            end = start + size
+            if suffixes is None:
+                suffix = text[start:end]
+            else:
+                suffix = str(suffixes[start:end], "utf-8", "surrogateescape")
+            prev = prev[:shared] + suffix
+            paths.append(prev)
+            start = end
+
+        values = {}
+        for name, typecode, width in self.columns(section):
+            nbytes = count * width * array(typecode).itemsize
+            values[name] = _from_le(typecode, buf[pos : pos + nbytes])
+            pos += nbytes
+        if pos != offset + length:
+            raise SnpFormatError(f"corrupt block {idx} in section {section}")
+        return paths, values
+
+    def iter_paths(self, section: str) -> Iterator[str]:
+        """Iterate over paths of a section, decoding one block at a time.
+
+        Args:
+            section (str): Section name.
+
+        Yields:
+            str: Path.
+        """
+        for idx in range(self.num_blocks(section)):
+            yield from self.block(section, idx)[0]
+
+    def iter_rows(self, section: str) -> Iterator[tuple]:
+        """Iterate over (path, *values) rows of a section.
+
+        Args:
+            section (str): Section name.
+
+        Yields:
+            tuple: Path followed by one value per column. Values of columns
+                wider than one item are bytes.
+        """
+        columns = self.columns(section) if section in self._first_paths else []
+        for idx in range(self.num_blocks(section)):
+            paths, values = self.block(section, idx)
+            cols = []
+            for name, _, width in columns:
+                col = values[name]
+                if width > 1:
+                    raw = col.tobytes()
+                    col = [raw[i : i + width] for i in range(0, len(raw), width)]
+                cols.append(col)
+            yield from zip(paths, *cols)
+
+    def read_section(self, section: str) -> tuple[list[str], dict[str, array]]:
+        """Decode a whole section.
+
+        Args:
+            section (str): Section name.
+
+        Returns:
+            tuple[list[str], dict[str, array]]: Paths and column values.
+        """
+        paths = []
+        values = {}
+        if section in self._first_paths:
+            for name, typecode, _ in self.columns(section):
+                values[name] = array(typecode)
+        for idx in range(self.num_blocks(section)):
+            block_paths, block_values = self.block(section, idx)
+            paths.extend(block_paths)
+            for name, col in block_values.items():
+                values[name].extend(col)
+        return paths, values
+
+    def contains(self, section: str, path: str) -> bool:
+        """Check if a section contains a path, decoding at most one block.
+
+        Args:
+            section (str): Section name.
+            path (str): Path to look up.
+
+        Returns:
+            bool: True if the path is in the section.
+        """
+        first_paths = self._first_paths.get(section, [])
+        idx = bisect_right(first_paths, path) - 1
+        if idx < 0:
+            return False
+        paths = self.block(section, idx)[0]
+        pos = bisect_right(paths, path) - 1
+        return pos >= 0 and paths[pos] == path
+
+
+def write_snp_file(
+    file: str,
+    sections: dict[str, Iterable],
+    columns: Optional[dict[str, Iterable[ColumnSpec]]] = None,
+    meta: Optional[dict] = None,
+) -> None:
+    """Write sorted sections to a version 2 snapshot file.
+
+    Args:
+        file (str): File output path.
+        sections (dict[str, Iterable]): Sorted rows of each section.
+        columns (Optional[dict[str, Iterable[ColumnSpec]]]): Column specs per section.
+        meta (Optional[dict]): JSON serializable file metadata.
+
+    Raises:
+        OSError: If file could not be written.
+    """
+    columns = columns or {}
+    with open(file, "wb") as f:
+        writer = SnpWriter(f, meta)
+        for name, rows in sections.items():
+            writer.write_section(name, rows, columns.get(name, ()))
+        writer.close()
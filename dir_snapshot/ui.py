@@ -1,9 +1,63 @@
 """User interface module for custom widgets."""
 
+import itertools
+from bisect import bisect_right
+from typing import Optional, Union
+
+from rich.segment import Segment
+from rich.style import Style
 from textual.app import ComposeResult
-from textual.containers import Grid
+from textual.binding import Binding
+from textual.containers import Grid, Horizontal, Vertical
+from textual.events import Click
+from textual.geometry import Size
+from textual.message import Message
 from textual.screen import ModalScreen
-from textual.widgets import Button, Input, Label
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
+from textual.widgets import Button, DataTable, Input, Label, TextArea
+
+from dir_snapshot import instrument
+from dir_snapshot.pathindex import PathIndex
+from dir_snapshot.snapshot import (
+    SnapshotCompareData,
+    SnapshotProgress,
+    SnapshotTreeCompareData,
+    SubtreeSummary,
+)
+
+PROGRESS_REFRESH_INTERVAL = 0.25
+STATS_REFRESH_INTERVAL = 1.0
+PATH_HISTORY_LIMIT = 200
+
+# Category attribute, title and row prefix of comparison results.
+COMPARE_CATEGORIES = (
+    ("added_dirs", "Added Directories", "+ "),
+    ("added_files", "Added Files", "+ "),
+    ("removed_dirs", "Removed Directories", "- "),
+    ("removed_files", "Removed Files", "- "),
+    ("modified_files", "Modified Files", "~ "),
+)
+HEADER_STYLE = Style(bold=True, underline=True)
+CURSOR_STYLE = Style(reverse=True)
+
+
+def format_size(num_bytes: float) -> str:
+    """Format a byte count for display.
+
+    Args:
+        num_bytes (float): Number of bytes.
+
+    Returns:
+        str: Size with a binary unit, e.g. 1.5 MiB.
+    """
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if num_bytes < 1024:
+            break
+        num_bytes /= 1024
+    else:
+        unit = "TiB"
+    return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
 
 
 class ConfirmDialog(ModalScreen[bool]):
@@ -103,3 +157,649 @@ class AddDirDialog(ModalScreen[str | None]):
                 self.dismiss(path)
         else:
             self.dismiss(None)
+
+
+class RulesDialog(ModalScreen[list[str] | None]):
+    """Dialog screen to edit the exclude rules of a directory."""
+
+    DEFAULT_CSS = """
+    RulesDialog {
+        align: center middle;
+    }
+
+    #rules-dialog {
+        grid-size: 2 3;
+        grid-gutter: 1 2;
+        grid-rows: 1 1fr 3;
+        width: 70;
+        height: 24;
+        border: thick $background 80%;
+        background: $surface;
+    }
+
+    #rules-title, #rules-input {
+        column-span: 2;
+        width: 1fr;
+    }
+
+    Button {
+        width: 100%;
+    }
+    """
+
+    def __init__(self, dir: str, rules: list[str]):
+        """Constructor method.
+
+        Args:
+            dir (str): Directory the rules apply to.
+            rules (list[str]): Current rules, one per line.
+        """
+        super().__init__()
+        self.dir = dir
+        self.rules = rules
+
+    def compose(self) -> ComposeResult:
+        yield Grid(
+            Label(
+                f"Exclude rules for {self.dir} (.gitignore syntax)", id="rules-title"
+            ),
+            TextArea("\n".join(self.rules), id="rules-input"),
+            Button("Save", variant="success", id="save"),
+            Button("Cancel", variant="primary", id="cancel"),
+            id="rules-dialog",
+        )
+
+    def on_button_pressed(self, event: Button.Pressed) -> None:
+        if event.button.id == "save":
+            text = self.query_one(TextArea).text
+            self.dismiss([line for line in text.splitlines() if line.strip()])
+        else:
+            self.dismiss(None)
+
+
+class PathHistoryDialog(ModalScreen[None]):
+    """Dialog screen to look up paths in the snapshot history of a directory."""
+
+    DEFAULT_CSS = """
+    PathHistoryDialog {
+        align: center middle;
+    }
+
+    #history-dialog {
+        width: 100;
+        height: 30;
+        border: thick $background 80%;
+        background: $surface;
+    }
+
+    #history-dialog Label {
+        width: 1fr;
+    }
+
+    #history-table {
+        height: 1fr;
+    }
+
+    #history-dialog Button {
+        width: 100%;
+    }
+    """
+
+    def __init__(self, dir: str, index: PathIndex):
+        """Constructor method.
+
+        Args:
+            dir (str): Snapshot directory.
+            index (PathIndex): Path index of the directory, closed with the dialog.
+        """
+        super().__init__()
+        self.dir = dir
+        self.index = index
+        self.snap_files = index.snap_files
+
+    def compose(self) -> ComposeResult:
+        yield Vertical(
+            Label(
+                f"Path history of {self.dir} ({len(self.snap_files)} snapshots)",
+                id="history-title",
+            ),
+            Input(placeholder="Path or prefix, e.g. src/", id="history-input"),
+            DataTable(id="history-table", cursor_type="row"),
+            Button("Close", variant="primary", id="close"),
+            id="history-dialog",
+        )
+
+    def on_mount(self) -> None:
+        self.query_one(DataTable).add_columns(
+            "Path", "Type", "First Seen", "Last Seen", "Snapshots"
+        )
+        self.show("")
+
+    def show(self, prefix: str) -> None:
+        """Show the histories of the paths starting with a prefix.
+
+        Args:
+            prefix (str): Path prefix.
+        """
+        count = len(self.snap_files)
+        table = self.query_one(DataTable)
+        table.clear()
+        with instrument.span("ui.path_history"):
+            histories = self.index.search(prefix, PATH_HISTORY_LIMIT)
+        for h in histories:
+            last = "present" if h.last_seen is None else self.snap_files[h.last_seen]
+            table.add_row(
+                h.path,
+                "dir" if h.is_dir else "file",
+                self.snap_files[h.first_seen],
+                last,
+                f"{len(h.snapshots(count))}/{count}",
+            )
+
+    def on_input_changed(self, event: Input.Changed) -> None:
+        self.show(event.value)
+
+    def on_button_pressed(self, event: Button.Pressed) -> None:
+        self.index.close()
+        self.dismiss(None)
+
+
+class SnapshotProgressItem(Horizontal):
+    """Live progress of a running snapshot with a cancel button."""
+
+    DEFAULT_CSS = """
+    SnapshotProgressItem {
+        height: 3;
+    }
+
+    SnapshotProgressItem Label {
+        width: 1fr;
+        height: 3;
+        content-align: left middle;
+    }
+
+    SnapshotProgressItem Button {
+        width: 12;
+    }
+    """
+
+    def __init__(self, dir: str, progress: SnapshotProgress):
+        super().__init__()
+        self.dir = dir
+        self.progress = progress
+
+    def compose(self) -> ComposeResult:
+        yield Label(self._progress_text())
+        yield Button("Cancel", variant="error")
+
+    def on_mount(self) -> None:
+        self.set_interval(PROGRESS_REFRESH_INTERVAL, self.refresh_progress)
+
+    def _progress_text(self) -> str:
+        progress = self.progress
+        return (
+            f"{self.dir}: {progress.entries:,} entries "
+            f"({progress.entries_per_sec:,.0f}/s), "
+            f"{progress.dirs_queued:,} dirs queued, "
+            f"{format_size(progress.bytes_written)} written"
+        )
+
+    def refresh_progress(self) -> None:
+        """Refresh progress text from the snapshot thread's counters."""
+        self.query_one(Label).update(self._progress_text())
+
+    def on_button_pressed(self, event: Button.Pressed) -> None:
+        self.progress.cancelled = True
+        event.button.disabled = True
+
+
+class StatsTable(DataTable):
+    """Table of instrumentation spans and counters."""
+
+    def on_mount(self) -> None:
+        self.cursor_type = "row"
+        self.add_columns("Name", "Calls", "Total", "Max", "Value")
+        self.refresh_stats()
+        self.set_interval(STATS_REFRESH_INTERVAL, self.refresh_stats)
+
+    def refresh_stats(self) -> None:
+        """Refresh rows from the recorded spans and counters."""
+        stats = instrument.get_stats()
+        self.clear()
+        for name, span in stats["spans"].items():
+            self.add_row(
+                name,
+                f"{span['count']:,}",
+                f"{span['total_ns'] / 1e9:.3f}s",
+                f"{span['max_ns'] / 1e9:.3f}s",
+                "",
+            )
+        for name, value in stats["counters"].items():
+            if "bytes" in name:
+                value = format_size(value)
+            else:
+                value = f"{value:,}"
+            self.add_row(name, "", "", "", value)
+
+
+def _item_path(item: Union[str, SubtreeSummary]) -> str:
+    return item if isinstance(item, str) else item.path
+
+
+class CompareRows:
+    """Rows of a comparison result, optionally filtered by path substring.
+
+    Rows are a header per category followed by its paths. Paths are never
+    copied into rows; a row is resolved by bisecting the category offsets.
+    Collapsed directories of a SnapshotTreeCompareData can be expanded in
+    place, which inserts their children after them.
+    """
+
+    def __init__(
+        self,
+        compare_data: Union[SnapshotCompareData, SnapshotTreeCompareData],
+        filter: str = "",
+    ):
+        """Constructor method.
+
+        Args:
+            compare_data (Union[SnapshotCompareData, SnapshotTreeCompareData]):
+                Comparison result.
+            filter (str): Only include paths containing this substring.
+        """
+        self.compare_data = compare_data
+        self.filter = ""
+        self.sources = [
+            getattr(compare_data, attr) for attr, _, _ in COMPARE_CATEGORIES
+        ]
+        self.expanded: list[set[str]] = [set() for _ in COMPARE_CATEGORIES]
+        self.categories = [
+            (title, prefix, paths)
+            for (_, title, prefix), paths in zip(COMPARE_CATEGORIES, self.sources)
+        ]
+        self._update_offsets()
+        if filter:
+            self.narrow(filter)
+
+    def _update_offsets(self) -> None:
+        """Update the first row index of each category."""
+        sizes = [1 + len(paths) for _, _, paths in self.categories]
+        self.starts = [0, *itertools.accumulate(sizes)]
+
+    def __len__(self) -> int:
+        return self.starts[-1]
+
+    def _locate(self, idx: int) -> tuple[int, int]:
+        """Get the category of a row and its offset in the category.
+
+        Args:
+            idx (int): Row index.
+
+        Returns:
+            tuple[int, int]: Category index and offset, 0 for the header.
+        """
+        category = bisect_right(self.starts, idx) - 1
+        return category, idx - self.starts[category]
+
+    def __getitem__(self, idx: int) -> tuple[bool, str]:
+        """Get a row.
+
+        Args:
+            idx (int): Row index.
+
+        Returns:
+            tuple[bool, str]: Whether the row is a header, and its text.
+        """
+        category, offset = self._locate(idx)
+        title, prefix, paths = self.categories[category]
+        if offset == 0:
+            return True, f"{title} ({self._shown(category):,})"
+        item = paths[offset - 1]
+        expanded = self.expanded[category]
+        if not expanded:
+            return False, prefix + self._text(item)
+        path = _item_path(item)
+        indent = "  " * sum(path.startswith(e + "/") for e in expanded)
+        return False, prefix + indent + self._text(item, path in expanded)
+
+    @staticmethod
+    def _text(item: Union[str, SubtreeSummary], expanded: bool = False) -> str:
+        """Get the text of an item without prefix.
+
+        Args:
+            item (Union[str, SubtreeSummary]): Path or collapsed directory.
+            expanded (bool): Whether the directory is expanded.
+
+        Returns:
+            str: Path, with counts and size for directories.
+        """
+        if isinstance(item, str):
+            return item
+        details = f"{item.dirs:,} dirs, {item.files:,} files"
+        if item.size is not None:
+            details += f", {format_size(item.size)}"
+        return f"{'▾' if expanded else '▸'} {item.path}/ ({details})"
+
+    @property
+    def width(self) -> int:
+        """Get the width of the longest row.
+
+        Returns:
+            int: Width in characters.
+        """
+        longest = 0
+        for category, (_, _, paths) in enumerate(self.categories):
+            if self._collapses(category):
+                start = self.starts[category] + 1
+                texts = (self[start + k][1] for k in range(len(paths)))
+                longest = max(longest, *map(len, texts), 0)
+            else:
+                longest = max(longest, max(map(len, paths), default=0) + 2)
+        return max(longest, 40)
+
+    def _shown(self, category: int) -> int:
+        """Get the number of shown paths of a category, except expanded children.
+
+        Args:
+            category (int): Category index.
+
+        Returns:
+            int: Number of paths.
+        """
+        paths = self.categories[category][2]
+        expanded = self.expanded[category]
+        if not expanded:
+            return len(paths)
+        return sum(
+            not any(_item_path(item).startswith(e + "/") for e in expanded)
+            for item in paths
+        )
+
+    def counts(self) -> list[tuple[str, int, int]]:
+        """Get the number of shown and total paths per category.
+
+        Returns:
+            list[tuple[str, int, int]]: Title, shown and total count.
+        """
+        return [
+            (title, self._shown(category), len(getattr(self.compare_data, attr)))
+            for category, (attr, title, _) in enumerate(COMPARE_CATEGORIES)
+        ]
+
+    def _collapses(self, category: int) -> bool:
+        """Check if a category lists collapsed directories.
+
+        Args:
+            category (int): Category index.
+
+        Returns:
+            bool: True for directories of a SnapshotTreeCompareData.
+        """
+        return isinstance(
+            self.compare_data, SnapshotTreeCompareData
+        ) and COMPARE_CATEGORIES[category][0].endswith("_dirs")
+
+    def _filtered(self, category: int, paths: list, filter: str) -> list:
+        """Filter the paths of a category.
+
+        Args:
+            category (int): Category index.
+            paths (list): Paths or collapsed directories of the category.
+            filter (str): Only include paths containing this substring.
+
+        Returns:
+            list: Matching items, the same list if there is no filter.
+        """
+        if not filter:
+            return paths
+        if self._collapses(category):
+            return [item for item in paths if filter in _item_path(item)]
+        return [p for p in paths if filter in p]
+
+    def narrow(self, filter: str) -> None:
+        """Change the path filter.
+
+        A filter that extends the current one only rescans the paths that
+        matched so far, so typing a filter gets cheaper with each key.
+
+        Args:
+            filter (str): Only include paths containing this substring.
+        """
+        if filter.startswith(self.filter):
+            sources = [paths for _, _, paths in self.categories]
+        else:
+            sources = self.sources
+        self.categories = [
+            (title, prefix, self._filtered(category, paths, filter))
+            for category, ((_, title, prefix), paths) in enumerate(
+                zip(COMPARE_CATEGORIES, sources)
+            )
+        ]
+        self.filter = filter
+        self._update_offsets()
+
+    def toggle(self, idx: int) -> bool:
+        """Expand or collapse the directory of a row.
+
+        Args:
+            idx (int): Row index.
+
+        Returns:
+            bool: True if the rows changed.
+        """
+        category, offset = self._locate(idx)
+        title, prefix, paths = self.categories[category]
+        if offset == 0 or not isinstance(paths[offset - 1], SubtreeSummary):
+            return False
+        item = paths[offset - 1]
+        source = self.sources[category]
+        if source is getattr(self.compare_data, COMPARE_CATEGORIES[category][0]):
+            source = self.sources[category] = list(source)
+        pos = source.index(item)
+        expanded = self.expanded[category]
+        below = item.path + "/"
+        if item.path in expanded:
+            end = pos + 1
+            while end < len(source) and _item_path(source[end]).startswith(below):
+                end += 1
+            del source[pos + 1 : end]
+            expanded -= {e for e in expanded if e == item.path or e.startswith(below)}
+        else:
+            removed = COMPARE_CATEGORIES[category][0].startswith("removed")
+            dirs, files = self.compare_data.expand(item.path, removed)
+            source[pos + 1 : pos + 1] = [*dirs, *files]
+            expanded.add(item.path)
+        self.categories[category] = (
+            title,
+            prefix,
+            self._filtered(category, source, self.filter),
+        )
+        self._update_offsets()
+        return True
+
+
+class CompareResultView(ScrollView, can_focus=True):
+    """Virtualized view of comparison rows.
+
+    Only the visible rows are rendered, so scrolling and paging cost the
+    same regardless of the number of changes. Enter or a click on a
+    collapsed directory expands it.
+    """
+
+    BINDINGS = [
+        Binding("up", "cursor_up", "Cursor Up", show=False),
+        Binding("down", "cursor_down", "Cursor Down", show=False),
+        Binding("enter", "toggle", "Expand/Collapse"),
+    ]
+
+    class PageChanged(Message):
+        """Posted when the visible rows change."""
+
+        def __init__(self, first: int, last: int, total: int):
+            super().__init__()
+            self.first = first
+            self.last = last
+            self.total = total
+
+    class Toggled(Message):
+        """Posted when a directory is expanded or collapsed."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.rows: Optional[CompareRows] = None
+        self.cursor = 0
+
+    def set_rows(self, rows: CompareRows) -> None:
+        """Show rows from the top.
+
+        Args:
+            rows (CompareRows): Rows to show.
+        """
+        self.rows = rows
+        self.cursor = 0
+        self.virtual_size = Size(rows.width, len(rows))
+        self.scroll_to(0, 0, animate=False)
+        self.refresh()
+        self._post_page()
+
+    def _post_page(self) -> None:
+        total = len(self.rows) if self.rows is not None else 0
+        first = min(int(self.scroll_offset.y), total)
+        last = min(first + self.scrollable_content_region.height, total)
+        self.post_message(self.PageChanged(first, last, total))
+
+    def watch_scroll_y(self, old_value: float, new_value: float) -> None:
+        super().watch_scroll_y(old_value, new_value)
+        if round(old_value) != round(new_value):
+            self._post_page()
+
+    def on_resize(self) -> None:
+        self._post_page()
+
+    def move_cursor(self, row: int) -> None:
+        """Move the cursor to a row, scrolling it into view.
+
+        Args:
+            row (int): Row index.
+        """
+        if self.rows is None or not len(self.rows):
+            return
+        self.cursor = max(0, min(row, len(self.rows) - 1))
+        top = int(self.scroll_offset.y)
+        height = self.scrollable_content_region.height
+        if self.cursor < top:
+            self.scroll_to(y=self.cursor, animate=False)
+        elif self.cursor >= top + height:
+            self.scroll_to(y=self.cursor - height + 1, animate=False)
+        self.refresh()
+
+    def action_cursor_up(self) -> None:
+        self.move_cursor(self.cursor - 1)
+
+    def action_cursor_down(self) -> None:
+        self.move_cursor(self.cursor + 1)
+
+    def action_toggle(self) -> None:
+        """Expand or collapse the directory under the cursor."""
+        if self.rows is None or not self.rows.toggle(self.cursor):
+            return
+        self.virtual_size = Size(self.rows.width, len(self.rows))
+        self.refresh()
+        self.post_message(self.Toggled())
+        self._post_page()
+
+    def on_click(self, event: Click) -> None:
+        self.move_cursor(int(self.scroll_offset.y) + event.y)
+        self.action_toggle()
+
+    def render_line(self, y: int) -> Strip:
+        scroll_x, scroll_y = self.scroll_offset
+        idx = scroll_y + y
+        width = self.scrollable_content_region.width
+        if self.rows is None or idx >= len(self.rows):
+            return Strip.blank(width, self.rich_style)
+        is_header, text = self.rows[idx]
+        style = self.rich_style + HEADER_STYLE if is_header else self.rich_style
+        if idx == self.cursor and self.has_focus:
+            style += CURSOR_STYLE
+        strip = Strip([Segment(text, style)], len(text))
+        return strip.crop_extend(scroll_x, scroll_x + width, self.rich_style)
+
+
+class CompareResultPanel(Vertical):
+    """Comparison result with category counts, a path filter and paging."""
+
+    DEFAULT_CSS = """
+    CompareResultPanel {
+        height: 1fr;
+    }
+
+    CompareResultPanel Label {
+        width: 1fr;
+    }
+
+    CompareResultPanel Input {
+        margin: 1 0 0 0;
+    }
+
+    CompareResultView {
+        height: 1fr;
+    }
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.title = ""
+        self.rows: Optional[CompareRows] = None
+
+    def compose(self) -> ComposeResult:
+        yield Label(
+            "Select two snapshots and press 'c' to compare them.",
+            id="compare-counts",
+        )
+        yield Input(placeholder="Filter paths", id="compare-filter")
+        yield CompareResultView(id="compare-view")
+        yield Label("", id="compare-page")
+
+    def show(
+        self,
+        title: str,
+        compare_data: Union[SnapshotCompareData, SnapshotTreeCompareData],
+    ) -> None:
+        """Show a comparison result.
+
+        Args:
+            title (str): Title, e.g. the compared snapshot files.
+            compare_data (Union[SnapshotCompareData, SnapshotTreeCompareData]):
+                Comparison result.
+        """
+        self.title = title
+        self.rows = CompareRows(compare_data, self.query_one(Input).value)
+        self._update_rows()
+
+    def _update_rows(self) -> None:
+        self._update_counts()
+        self.query_one(CompareResultView).set_rows(self.rows)
+
+    def _update_counts(self) -> None:
+        counts = ", ".join(
+            f"{title}: {shown:,}" if shown == total else f"{title}: {shown:,}/{total:,}"
+            for title, shown, total in self.rows.counts()
+        )
+        self.query_one("#compare-counts", Label).update(f"{self.title}\n{counts}")
+
+    def on_input_changed(self, event: Input.Changed) -> None:
+        if self.rows is not None:
+            self.rows.narrow(event.value)
+            self._update_rows()
+
+    def on_compare_result_view_toggled(self, event: CompareResultView.Toggled) -> None:
+        self._update_counts()
+
+    def on_compare_result_view_page_changed(
+        self, event: CompareResultView.PageChanged
+    ) -> None:
+        text = ""
+        if event.total:
+            text = f"Rows {event.first + 1:,}-{event.last:,} of {event.total:,}"
+        self.query_one("#compare-page", Label).update(text)
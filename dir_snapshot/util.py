@@ -1,5 +1,6 @@
 """Utility module for Directory Snapshot App."""
 
+import functools
 import sys
 
 from pathlib import Path
@@ -9,6 +10,8 @@ from dir_snapshot import (
     APP_SETTINGS_DIR,
     APP_SNAPSHOT_DIR,
     APP_DB_FILE,
+    APP_PATH_INDEX_DIR,
+    APP_SQLITE_DB_FILE,
 )
 
 
@@ -40,6 +43,34 @@ def create_file(path: Path) -> None:
             sys.exit(1)
 
 
+@functools.cache
+def _ensure_dir(path: Path) -> Path:
+    """Create directory once per process.
+
+    Args:
+        path (Path): Path object of directory.
+
+    Returns:
+        Path: The same path object.
+    """
+    create_dir(path)
+    return path
+
+
+@functools.cache
+def _ensure_file(path: Path) -> Path:
+    """Create file once per process.
+
+    Args:
+        path (Path): Path object of file.
+
+    Returns:
+        Path: The same path object.
+    """
+    create_file(path)
+    return path
+
+
 def get_user_home() -> Path:
     """Get user's home directory.
 
@@ -55,9 +86,7 @@ def get_settings_dir() -> Optional[Path]:
     Returns:
         Optional[Path]: Path object of settings directory or None if there's an error.
     """
-    settings_dir = get_user_home() / APP_SETTINGS_DIR
-    create_dir(settings_dir)
-    return settings_dir
+    return _ensure_dir(get_user_home() / APP_SETTINGS_DIR)
 
 
 def get_snapshot_dir() -> Optional[Path]:
@@ -66,9 +95,7 @@ def get_snapshot_dir() -> Optional[Path]:
     Returns:
         Optional[Path]: Path object of snapshot directory or None if there's an error.
     """
-    snapshot_dir = get_settings_dir() / APP_SNAPSHOT_DIR
-    create_dir(snapshot_dir)
-    return snapshot_dir
+    return _ensure_dir(get_settings_dir() / APP_SNAPSHOT_DIR)
 
 
 def get_db_file() -> Optional[Path]:
@@ -77,9 +104,28 @@ def get_db_file() -> Optional[Path]:
     Returns:
         Optional[Path]: Path object of database file or None if there's an error.
     """
-    db_file = get_settings_dir() / APP_DB_FILE
-    create_file(db_file)
-    return db_file
+    return _ensure_file(get_settings_dir() / APP_DB_FILE)
+
+
+def get_sqlite_db_file() -> Optional[Path]:
+    """Get SQLite database file.
+
+    Returns:
+        Optional[Path]: Path object of SQLite database file or None if there's an error.
+    """
+    return get_settings_dir() / APP_SQLITE_DB_FILE
+
+
+def get_path_index_file(dir_id: int) -> Path:
+    """Get the path index file of a snapshot directory.
+
+    Args:
+        dir_id (int): Snapshot dir id.
+
+    Returns:
+        Path: Path object of index database file in the settings directory.
+    """
+    return get_settings_dir() / APP_PATH_INDEX_DIR / f"{dir_id}.sqlite3"
 
 
 def delete_files(files: list[str]) -> bool:
@@ -0,0 +1,268 @@
+"""Walker module to enumerate directory trees with os.scandir."""
+
+import functools
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterator, NamedTuple, Optional
+
+from dir_snapshot import WALK_WORKERS, instrument
+from dir_snapshot.rules import PathRules
+
+
+class WalkEntry(NamedTuple):
+    path: str
+    is_dir: bool
+    stat: Optional[os.stat_result] = None
+    content_hash: Optional[int] = None
+
+
+class _PendingDir(NamedTuple):
+    """Directory waiting to be scanned.
+
+    Only the fields scan_dir compares with a previous listing are kept, not
+    the whole stat result, since many directories may be waiting.
+    """
+
+    path: str
+    st_mtime_ns: Optional[int] = None
+    st_ino: Optional[int] = None
+
+    @classmethod
+    def from_entry(cls, entry: WalkEntry) -> "_PendingDir":
+        if entry.stat is None:
+            return cls(entry.path)
+        return cls(entry.path, entry.stat.st_mtime_ns, entry.stat.st_ino)
+
+    @property
+    def dir_stat(self) -> Optional["_PendingDir"]:
+        return self if self.st_ino is not None else None
+
+
+class DirListing(NamedTuple):
+    """Listing of a directory recorded by a previous snapshot.
+
+    Entries are (relative path, is_dir, descend) tuples of its children.
+    """
+
+    mtime_ns: int
+    inode: int
+    entries: list[tuple[str, bool, bool]]
+
+
+def _join(parent: str, name: str) -> str:
+    """Join relative parent path and entry name with POSIX separator.
+
+    Args:
+        parent (str): Relative parent path, empty for the root directory.
+        name (str): Entry name.
+
+    Returns:
+        str: Relative POSIX path.
+    """
+    return f"{parent}/{name}" if parent else name
+
+
+def _reuse_listing(
+    root: str,
+    listing: DirListing,
+    with_stats: bool,
+    rules: Optional[PathRules] = None,
+) -> tuple[list[WalkEntry], list[WalkEntry]]:
+    """Build scan results from a directory listing of a previous snapshot.
+
+    Args:
+        root (str): Root directory of the walk.
+        listing (DirListing): Listing of an unchanged directory.
+        with_stats (bool): Whether to lstat files as well as directories.
+        rules (Optional[PathRules]): Rules of entries to leave out.
+
+    Returns:
+        tuple[list[WalkEntry], list[WalkEntry]]: Entries sorted by name and
+            the subdirectories to descend into.
+    """
+    entries = []
+    subdirs = []
+    stat_calls = 0
+    excluded = 0
+    for rel_path, is_dir, descend in listing.entries:
+        if rules is not None and rules.is_excluded(rel_path, is_dir):
+            excluded += 1
+            continue
+        stat = None
+        if with_stats or is_dir:
+            stat_calls += 1
+            try:
+                stat = os.lstat(os.path.join(root, rel_path))
+            except OSError:
+                continue
+        entry = WalkEntry(rel_path, is_dir, stat)
+        entries.append(entry)
+        if descend:
+            subdirs.append(entry)
+
+    entries.sort()
+    subdirs.sort()
+    instrument.add("walk.dirs_reused")
+    instrument.add("walk.entries", len(entries))
+    instrument.add("walk.stat_calls", stat_calls)
+    instrument.add("walk.excluded", excluded)
+    return entries, subdirs
+
+
+@instrument.timed("walk.scan_dir")
+def scan_dir(
+    root: str,
+    rel_dir: str,
+    with_stats: bool = False,
+    listings: Optional[dict[str, DirListing]] = None,
+    dir_stat: Optional[os.stat_result] = None,
+    rules: Optional[PathRules] = None,
+) -> tuple[list[WalkEntry], list[WalkEntry]]:
+    """Scan a single directory.
+
+    Entry types come from the cached DirEntry information, so no extra stat
+    call is made on filesystems that report the type in readdir. Symlinks to
+    directories are reported as directories but are not descended into.
+    Entries excluded by rules are dropped before they are stat'ed, and
+    excluded directories are never opened.
+
+    If listings of a previous snapshot are given, subdirectories are always
+    lstat'ed, and a directory whose mtime and inode still match its previous
+    listing is not read again: adding, removing or renaming an entry updates
+    the directory mtime, so the previous listing is still accurate.
+
+    Args:
+        root (str): Root directory of the walk.
+        rel_dir (str): Directory to scan, relative to root.
+        with_stats (bool): Whether to lstat each entry. Entries that vanish
+            before they can be stat'ed are skipped.
+        listings (Optional[dict[str, DirListing]]): Directory listings of a
+            previous snapshot by relative path.
+        dir_stat (Optional[os.stat_result]): lstat result of the directory,
+            only its st_mtime_ns and st_ino are used.
+        rules (Optional[PathRules]): Rules of entries to leave out.
+
+    Returns:
+        tuple[list[WalkEntry], list[WalkEntry]]: Entries sorted by name and
+            the subdirectories to descend into.
+    """
+    if listings is not None and dir_stat is not None:
+        listing = listings.get(rel_dir)
+        if listing is not None and listing[:2] == (
+            dir_stat.st_mtime_ns,
+            dir_stat.st_ino,
+        ):
+            return _reuse_listing(root, listing, with_stats, rules)
+
+    entries = []
+    subdirs = []
+    stat_calls = 0
+    excluded = 0
+    try:
+        with os.scandir(os.path.join(root, rel_dir)) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                    descend = is_dir and not entry.is_symlink()
+                except OSError:
+                    is_dir = descend = False
+                rel_path = _join(rel_dir, entry.name)
+                if rules is not None and rules.is_excluded(rel_path, is_dir):
+                    excluded += 1
+                    continue
+                stat = None
+                if with_stats or (is_dir and listings is not None):
+                    stat_calls += 1
+                    try:
+                        stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                walk_entry = WalkEntry(rel_path, is_dir, stat)
+                entries.append(walk_entry)
+                if descend:
+                    subdirs.append(walk_entry)
+    except OSError:
+        instrument.add("walk.scan_errors")
+        return [], []
+
+    entries.sort()
+    subdirs.sort()
+    instrument.add("walk.dirs_scanned")
+    instrument.add("walk.entries", len(entries))
+    instrument.add("walk.stat_calls", stat_calls)
+    instrument.add("walk.excluded", excluded)
+    return entries, subdirs
+
+
+def walk(
+    root: str,
+    workers: int = WALK_WORKERS,
+    with_stats: bool = False,
+    listings: Optional[dict[str, DirListing]] = None,
+    on_scan: Optional[Callable[[int], None]] = None,
+    rules: Optional[PathRules] = None,
+) -> Iterator[WalkEntry]:
+    """Walk a directory tree, scanning subdirectories on a thread pool.
+
+    Directories are scanned in depth-first order with up to a few scans per
+    worker in flight, so latency-bound filesystems overlap their I/O. Only
+    the siblings of the directories on the current path wait to be scanned,
+    so memory does not grow with the size of the tree. Results are consumed
+    in submission order which keeps the output deterministic for a number
+    of workers. Callers sort the entries.
+
+    Args:
+        root (str): Directory to walk.
+        workers (int): Number of scanner threads. 1 scans in the calling thread.
+        with_stats (bool): Whether to lstat each entry.
+        listings (Optional[dict[str, DirListing]]): Directory listings of a
+            previous snapshot to reuse for unchanged directories.
+        on_scan (Optional[Callable[[int], None]]): Called after the entries of
+            each directory are yielded, with the number of directories still
+            queued or being scanned.
+        rules (Optional[PathRules]): Rules of entries to leave out. Excluded
+            directories are pruned with everything below them.
+
+    Yields:
+        WalkEntry: Entry relative to root.
+    """
+    scan = functools.partial(
+        scan_dir, root, with_stats=with_stats, listings=listings, rules=rules
+    )
+    # Stack of directories to scan, the next one last.
+    pending = [_PendingDir("")]
+
+    def push(subdirs: list[WalkEntry]) -> None:
+        pending.extend(_PendingDir.from_entry(subdir) for subdir in reversed(subdirs))
+
+    if workers <= 1:
+        while pending:
+            subdir = pending.pop()
+            entries, subdirs = scan(subdir.path, dir_stat=subdir.dir_stat)
+            yield from entries
+            del entries
+            push(subdirs)
+            if on_scan is not None:
+                on_scan(len(pending))
+        return
+
+    window = workers * 4
+    inflight: deque[Future] = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            while pending or inflight:
+                while pending and len(inflight) < window:
+                    subdir = pending.pop()
+                    inflight.append(
+                        executor.submit(scan, subdir.path, dir_stat=subdir.dir_stat)
+                    )
+                entries, subdirs = inflight.popleft().result()
+                yield from entries
+                del entries
+                push(subdirs)
+                if on_scan is not None:
+                    on_scan(len(pending) + len(inflight))
+        finally:
+            for future in inflight:
+                future.cancel()
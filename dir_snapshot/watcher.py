@@ -0,0 +1,565 @@
+"""Watcher module to journal changes of a directory tree with Linux inotify.
+
+A DirWatcher keeps an inotify watch on every directory of a tree and
+records which directories had entries added, removed or renamed, and which
+entries had their contents or attributes changed. A snapshot can then be
+taken by applying this change journal to the previous snapshot instead of
+walking the tree, so its cost depends on the number of changes.
+
+Whenever the journal may be incomplete, because the kernel event queue
+overflowed or the watch limit was reached, the next snapshot falls back to
+a regular walk.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from array import array
+from dataclasses import dataclass, field
+from typing import Optional
+
+from dir_snapshot import instrument
+from dir_snapshot.chunkstore import ChunkStore
+from dir_snapshot.diff import apply_delta
+from dir_snapshot.rules import PathRules
+from dir_snapshot.snapshot import (
+    SNP_SECTIONS,
+    SnapshotData,
+    SnapshotProgress,
+    SnapshotStats,
+    _children,
+    _subtree_range,
+    read_snp_data,
+    take_snapshot,
+    update_tree_hashes,
+    write_snp_data,
+)
+from dir_snapshot.walker import WalkEntry, scan_dir
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+    | IN_DONT_FOLLOW
+    | IN_EXCL_UNLINK
+)
+ENTRY_EVENTS = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+CHANGE_EVENTS = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE
+
+_EVENT = struct.Struct("iIII")
+READ_BUFFER_SIZE = 64 << 10
+
+
+def _load_libc() -> Optional[ctypes.CDLL]:
+    """Load the C library inotify functions, if the platform has them.
+
+    Returns:
+        Optional[ctypes.CDLL]: C library, None if inotify is unavailable.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+def is_supported() -> bool:
+    """Check if directory watching is supported on this platform.
+
+    Returns:
+        bool: True if inotify is available.
+    """
+    return _libc is not None
+
+
+def _join(parent: str, name: str) -> str:
+    return f"{parent}/{name}" if parent else name
+
+
+@dataclass
+class ChangeJournal:
+    """Changes of a directory tree since the journal was started.
+
+    Paths are relative POSIX paths, with the root directory as an empty
+    string.
+    """
+
+    dirty_dirs: set[str] = field(default_factory=set)
+    modified: set[str] = field(default_factory=set)
+    overflowed: bool = False
+
+    def __len__(self) -> int:
+        return len(self.dirty_dirs) + len(self.modified)
+
+
+class DirWatcher:
+    """Watch a directory tree and journal its changes on a background thread."""
+
+    def __init__(self, root: str, rules: Optional[PathRules] = None):
+        """Constructor method.
+
+        Args:
+            root (str): Directory to watch.
+            rules (Optional[PathRules]): Rules of entries to leave out of
+                snapshots. Excluded directories are not watched.
+        """
+        self.root = root
+        self.rules = rules
+        # Snapshot file the current journal applies to.
+        self.synced_file: Optional[str] = None
+        self.failed = False
+        self._fd = -1
+        self._wds: dict[int, str] = {}
+        self._paths: dict[str, int] = {}
+        self._journal = ChangeJournal()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop_r, self._stop_w = -1, -1
+
+    def __enter__(self) -> "DirWatcher":
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def start(self) -> bool:
+        """Watch every directory of the tree and start reading events.
+
+        Returns:
+            bool: True if the whole tree is watched. Otherwise the watcher
+                is marked as failed and snapshots fall back to walks.
+        """
+        if _libc is None:
+            self.failed = True
+            return False
+        self._fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            self.failed = True
+            return False
+        self._stop_r, self._stop_w = os.pipe()
+        with self._lock:
+            self._add_tree("")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return not self.failed
+
+    def stop(self) -> None:
+        """Stop reading events and remove all watches."""
+        if self._thread is not None:
+            os.write(self._stop_w, b"\0")
+            self._thread.join()
+            self._thread = None
+        for fd in (self._fd, self._stop_r, self._stop_w):
+            if fd >= 0:
+                os.close(fd)
+        self._fd = self._stop_r = self._stop_w = -1
+        self._wds.clear()
+        self._paths.clear()
+
+    @property
+    def watched(self) -> int:
+        """Get the number of watched directories.
+
+        Returns:
+            int: Number of watches.
+        """
+        return len(self._paths)
+
+    def swap_journal(self) -> ChangeJournal:
+        """Take the changes journaled so far and start a new journal.
+
+        Returns:
+            ChangeJournal: Changes since the previous swap.
+        """
+        with self._lock:
+            journal, self._journal = self._journal, ChangeJournal()
+        journal.overflowed |= self.failed
+        return journal
+
+    def _add_watch(self, rel_dir: str) -> bool:
+        """Watch a single directory.
+
+        Args:
+            rel_dir (str): Directory relative to the root.
+
+        Returns:
+            bool: True if the directory is watched or no longer exists.
+        """
+        path = os.path.join(self.root, rel_dir).encode("utf-8", "surrogateescape")
+        wd = _libc.inotify_add_watch(self._fd, path, WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOSPC, errno.ENOMEM):
+                # The watch limit is reached, so changes may go unnoticed.
+                self.failed = True
+                instrument.add("watch.limit_reached")
+                return False
+            return True
+        self._wds[wd] = rel_dir
+        self._paths[rel_dir] = wd
+        return True
+
+    def _add_tree(self, rel_dir: str, journal: Optional[ChangeJournal] = None) -> None:
+        """Watch a directory and all directories below it.
+
+        Entries created before a directory is watched raise no events, so
+        for a directory created or moved in, every directory of the tree is
+        journaled as dirty and scanned again by the next snapshot. This also
+        covers a directory recreated under the name of one that existed in
+        the previous snapshot.
+
+        Args:
+            rel_dir (str): Directory relative to the root.
+            journal (Optional[ChangeJournal]): Journal to mark the watched
+                directories dirty in.
+        """
+        pending = [rel_dir]
+        while pending and not self.failed:
+            current = pending.pop()
+            if not self._add_watch(current):
+                return
+            if journal is not None:
+                journal.dirty_dirs.add(current)
+            try:
+                with os.scandir(os.path.join(self.root, current)) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                path = _join(current, entry.name)
+                                if not self._is_excluded(path):
+                                    pending.append(path)
+                        except OSError:
+                            pass
+            except OSError:
+                pass
+        instrument.add("watch.dirs", len(self._paths))
+
+    def _is_excluded(self, rel_dir: str) -> bool:
+        return self.rules is not None and self.rules.is_excluded(rel_dir, True)
+
+    def _remove_tree(self, rel_dir: str) -> None:
+        """Stop watching a directory and all directories below it.
+
+        Args:
+            rel_dir (str): Directory relative to the root.
+        """
+        prefix = rel_dir + "/"
+        for path in [p for p in self._paths if p == rel_dir or p.startswith(prefix)]:
+            wd = self._paths.pop(path)
+            self._wds.pop(wd, None)
+            _libc.inotify_rm_watch(self._fd, wd)
+
+    def _run(self) -> None:
+        """Read and journal events until stopped."""
+        while True:
+            ready, _, _ = select.select([self._fd, self._stop_r], [], [])
+            if self._stop_r in ready:
+                return
+            try:
+                data = os.read(self._fd, READ_BUFFER_SIZE)
+            except BlockingIOError:
+                continue
+            except OSError:
+                self.failed = True
+                return
+            with self._lock:
+                self._handle_events(data)
+
+    def _handle_events(self, data: bytes) -> None:
+        """Journal a buffer of raw inotify events.
+
+        Args:
+            data (bytes): Events read from the inotify file descriptor.
+        """
+        journal = self._journal
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            instrument.add("watch.events")
+
+            if mask & IN_Q_OVERFLOW:
+                journal.overflowed = True
+                instrument.add("watch.overflows")
+                continue
+            parent = self._wds.get(wd)
+            if parent is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._wds[wd]
+                if self._paths.get(parent) == wd:
+                    del self._paths[parent]
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if not parent:
+                    # The root itself is gone or was renamed.
+                    journal.overflowed = True
+                continue
+
+            path = _join(parent, name.decode("utf-8", "surrogateescape"))
+            if mask & ENTRY_EVENTS:
+                journal.dirty_dirs.add(parent)
+                if mask & IN_ISDIR:
+                    if mask & IN_MOVED_FROM:
+                        self._remove_tree(path)
+                    elif mask & (IN_CREATE | IN_MOVED_TO):
+                        if not self._is_excluded(path):
+                            self._add_tree(path, journal)
+            if mask & CHANGE_EVENTS:
+                journal.modified.add(path if name else parent)
+
+
+def _stat_row(stat: os.stat_result, names: list[str]) -> tuple[int, ...]:
+    """Get the column values of a stat result in the order of a snapshot.
+
+    Args:
+        stat (os.stat_result): Result of os.lstat.
+        names (list[str]): Column names of the section.
+
+    Returns:
+        tuple[int, ...]: One value per column, 0 for the tree hash.
+    """
+    values = dict(zip(SnapshotStats().columns(), SnapshotStats.values(stat)))
+    return tuple(values.get(name, 0) for name in names)
+
+
+def _contains(paths: list[str], path: str) -> bool:
+    idx = _subtree_range(paths, path)[0] - 1 if path else -1
+    return 0 <= idx < len(paths) and paths[idx] == path
+
+
+def apply_journal(
+    root: str,
+    previous: SnapshotData,
+    journal: ChangeJournal,
+    rules: Optional[PathRules] = None,
+) -> Optional[SnapshotData]:
+    """Apply a change journal to the previous snapshot of a tree.
+
+    Dirty directories are scanned again and compared with their previous
+    listing. Removed entries are dropped with their subtrees and new
+    directories are walked. Modified entries are stat'ed again. The
+    entries of all other directories are carried over unchanged.
+
+    Args:
+        root (str): Root directory of the snapshot.
+        previous (SnapshotData): Sorted snapshot the journal started from,
+            with directory and file stats.
+        journal (ChangeJournal): Changes since the previous snapshot.
+        rules (Optional[PathRules]): Rules the previous snapshot was taken
+            with, applied to new entries.
+
+    Returns:
+        Optional[SnapshotData]: Updated snapshot, None if the journal cannot
+            be applied and the tree has to be walked.
+    """
+    if (
+        journal.overflowed
+        or previous.dir_stats is None
+        or previous.file_stats is None
+        or previous.file_hashes is not None
+    ):
+        return None
+
+    removed = {section: set() for section in SNP_SECTIONS}
+    upserts: dict[str, dict[str, os.stat_result]] = {s: {} for s in SNP_SECTIONS}
+    new_trees = []
+    changed_dirs = set()
+
+    def add_tree(rel_dir: str) -> None:
+        new_trees.append(rel_dir)
+        changed_dirs.add(rel_dir)
+        pending = [rel_dir]
+        while pending:
+            entries, subdirs = scan_dir(
+                root, pending.pop(), with_stats=True, listings={}, rules=rules
+            )
+            for entry in entries:
+                section = "dirs" if entry.is_dir else "files"
+                upserts[section][entry.path] = entry.stat
+                if entry.is_dir:
+                    changed_dirs.add(entry.path)
+            pending.extend(subdir.path for subdir in subdirs)
+
+    def in_new_tree(path: str) -> bool:
+        return any(path == t or path.startswith(t + "/") for t in new_trees)
+
+    for rel_dir in sorted(journal.dirty_dirs):
+        if in_new_tree(rel_dir) or (rel_dir and not _contains(previous.dirs, rel_dir)):
+            continue
+        entries, _ = scan_dir(root, rel_dir, with_stats=True, listings={}, rules=rules)
+        current: dict[str, WalkEntry] = {entry.path: entry for entry in entries}
+        changed_dirs.add(rel_dir)
+        for section in SNP_SECTIONS:
+            paths = getattr(previous, section)
+            for child in _children(paths, rel_dir):
+                entry = current.get(child)
+                if entry is not None and entry.is_dir == (section == "dirs"):
+                    continue
+                removed[section].add(child)
+                if section == "dirs":
+                    for sub in SNP_SECTIONS:
+                        sub_paths = getattr(previous, sub)
+                        start, end = _subtree_range(sub_paths, child)
+                        removed[sub].update(sub_paths[start:end])
+        for path, entry in current.items():
+            section = "dirs" if entry.is_dir else "files"
+            if (
+                _contains(getattr(previous, section), path)
+                and path not in removed[section]
+            ):
+                continue
+            upserts[section][path] = entry.stat
+            descend = entry.is_dir and not (entry.stat.st_mode & 0o170000 == 0o120000)
+            if descend:
+                add_tree(path)
+        if rel_dir:
+            journal.modified.add(rel_dir)
+
+    for path in journal.modified:
+        if not path or in_new_tree(path):
+            continue
+        for section in SNP_SECTIONS:
+            if path in removed[section] or not _contains(
+                getattr(previous, section), path
+            ):
+                continue
+            try:
+                upserts[section][path] = os.lstat(os.path.join(root, path))
+            except OSError:
+                continue
+            changed_dirs.add(path.rpartition("/")[0])
+
+    result = SnapshotData(dirs=[], files=[])
+    for section in SNP_SECTIONS:
+        columns = previous.columns(section)
+        names = list(columns)
+        upsert_paths = sorted(upserts[section])
+        upsert_columns = [array(col.typecode) for col in columns.values()]
+        for path in upsert_paths:
+            for col, value in zip(
+                upsert_columns, _stat_row(upserts[section][path], names)
+            ):
+                col.append(value)
+        paths, new_columns = apply_delta(
+            getattr(previous, section),
+            list(columns.values()),
+            sorted(removed[section]),
+            upsert_paths,
+            upsert_columns,
+        )
+        setattr(result, section, paths)
+        result.set_columns(section, dict(zip(names, new_columns)))
+        instrument.add(
+            "watch.applied_entries", len(upsert_paths) + len(removed[section])
+        )
+
+    if result.dir_tree_hashes is not None:
+        for path in removed["dirs"] | removed["files"]:
+            changed_dirs.add(path.rpartition("/")[0])
+        update_tree_hashes(result, changed_dirs)
+    return result
+
+
+@instrument.timed("watch.snapshot")
+def take_watched_snapshot(
+    watcher: DirWatcher,
+    file: str,
+    base_file: Optional[str] = None,
+    progress: Optional[SnapshotProgress] = None,
+    store: Optional[ChunkStore] = None,
+) -> bool:
+    """Take a snapshot of a watched directory and write it to file.
+
+    If the watcher has journaled all changes since base_file was taken, the
+    journal is applied to it and the result written as a delta. Otherwise
+    the directory is walked as by take_snapshot. Either way the watcher is
+    synced to the new file once it is written.
+
+    Args:
+        watcher (DirWatcher): Started watcher of the directory.
+        file (str): File output path.
+        base_file (Optional[str]): Previous snapshot file of the directory.
+        progress (Optional[SnapshotProgress]): Progress to update.
+        store (Optional[ChunkStore]): Chunk store to write a manifest for.
+
+    Returns:
+        bool: True if file was written successfully.
+    """
+    started_ns = time.time_ns()
+    journal = watcher.swap_journal()
+    snapshot_data = None
+    if base_file is not None and base_file == watcher.synced_file:
+        previous = read_snp_data(base_file)
+        if previous.dirs or previous.files:
+            snapshot_data = apply_journal(
+                watcher.root, previous, journal, watcher.rules
+            )
+
+    if snapshot_data is None:
+        instrument.add("watch.fallback_walks")
+        written = take_snapshot(
+            watcher.root,
+            file,
+            base_file,
+            progress=progress,
+            rules=watcher.rules,
+            store=store,
+        )
+    else:
+        instrument.add("watch.journal_snapshots")
+        meta = {"rules": watcher.rules.fingerprint} if watcher.rules else {}
+        # Changes after the swap are journaled for the next snapshot.
+        meta["started_ns"] = started_ns
+        written = write_snp_data(snapshot_data, file, base_file, meta=meta, store=store)
+        if written and progress is not None:
+            progress.entries += len(snapshot_data.dirs) + len(snapshot_data.files)
+            progress.bytes_written += os.path.getsize(file)
+    watcher.synced_file = file if written else None
+    return written
@@ -74,3 +74,15 @@ def snapshots():
         ],
     )
     return [snap1, snap2]
+
+
+@pytest.fixture
+def snapshot_tree(tmp_path):
+    """Fixture for a small directory tree to snapshot."""
+    (tmp_path / "some_test" / "nested").mkdir(parents=True)
+    (tmp_path / "empty").mkdir()
+    (tmp_path / "test1.txt").write_text("test1")
+    (tmp_path / "test1 - Copy.txt").write_text("test1")
+    (tmp_path / "some_test" / "test2.txt").write_text("test2")
+    (tmp_path / "some_test" / "nested" / "test3.txt").write_text("test3")
+    return tmp_path
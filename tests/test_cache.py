@@ -0,0 +1,123 @@
+"""Test cache module."""
+
+import os
+
+from dir_snapshot import SNAPSHOT_CACHE_BUDGET
+from dir_snapshot.cache import CompareCache, LRUCache, get_compare_cache
+from dir_snapshot.db import SQLiteSnapshotDB
+from dir_snapshot.snapshot import (
+    SNAPSHOT_CACHE,
+    compare_snapshot_files,
+    compare_snapshot_tree,
+    generate_snp_filename,
+    read_snp_data,
+    take_snapshot,
+)
+
+
+def test_lru_cache():
+    """Test entries are evicted least recently used first by size."""
+    cache = LRUCache(100)
+    cache.put("a", 1, 40)
+    cache.put("b", 2, 40)
+    assert cache.get("a") == 1
+    cache.put("c", 3, 40)
+    assert cache.get("b") is None
+    cache.put("d", 4, 101)
+    assert cache.keys() == ["a", "c"]
+    cache.discard(["a"])
+    assert cache.stats() == {
+        "entries": 1,
+        "size": 40,
+        "budget": 100,
+        "hits": 1,
+        "misses": 1,
+        "evictions": 1,
+    }
+
+
+def test_snapshot_cache(snapshot_tree, tmp_path_factory):
+    """Test decoded snapshots and delta bases are reused until files change."""
+    out_dir = tmp_path_factory.mktemp("out")
+    base_file = (out_dir / "base.snp").as_posix()
+    assert take_snapshot(snapshot_tree.as_posix(), base_file)
+    delta_files = []
+    for n in range(2):
+        (snapshot_tree / f"new{n}.txt").write_text("new")
+        delta_files.append((out_dir / f"delta{n}.snp").as_posix())
+        assert take_snapshot(snapshot_tree.as_posix(), delta_files[-1], base_file)
+
+    SNAPSHOT_CACHE.clear()
+    base = read_snp_data(base_file)
+    stats = SNAPSHOT_CACHE.stats()
+    assert read_snp_data(base_file) is base
+    for delta_file in delta_files:
+        assert "new0.txt" in read_snp_data(delta_file).files
+    assert SNAPSHOT_CACHE.stats()["hits"] - stats["hits"] == 3
+    assert SNAPSHOT_CACHE.stats()["misses"] - stats["misses"] == 2
+
+    st = os.stat(base_file)
+    os.utime(base_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+    assert read_snp_data(base_file) is not base
+    assert read_snp_data(delta_files[0]) == read_snp_data(delta_files[0])
+    SNAPSHOT_CACHE.resize(0)
+    assert len(SNAPSHOT_CACHE) == 0
+    SNAPSHOT_CACHE.resize(SNAPSHOT_CACHE_BUDGET)
+
+
+def test_compare_snapshot_files(snapshot_tree, tmp_path_factory):
+    """Test comparisons are cached on disk and dropped when files change."""
+    out_dir = tmp_path_factory.mktemp("out")
+    cache_dir = out_dir / "cache"
+    old_file = (out_dir / "old.snp").as_posix()
+    new_file = (out_dir / "new.snp").as_posix()
+    assert take_snapshot(snapshot_tree.as_posix(), old_file)
+    (snapshot_tree / "new_dir").mkdir()
+    (snapshot_tree / "new_dir" / "new.txt").write_text("new")
+    assert take_snapshot(snapshot_tree.as_posix(), new_file, old_file)
+
+    expected = compare_snapshot_tree(read_snp_data(old_file), read_snp_data(new_file))
+    cache = CompareCache(cache_dir)
+    assert compare_snapshot_files(old_file, new_file, cache) == expected
+    assert cache.memory.stats()["misses"] == 1
+
+    restarted = CompareCache(cache_dir)
+    compare_data = compare_snapshot_files(old_file, new_file, restarted)
+    assert compare_data == expected
+    assert restarted.memory.stats()["misses"] == 1
+    assert restarted.memory.size == cache.memory.size
+    assert compare_data.expand("new_dir") == ([], ["new_dir/new.txt"])
+    assert compare_snapshot_files(old_file, new_file, restarted) == expected
+    assert restarted.memory.stats()["hits"] == 1
+
+    # Rewriting the base changes the fingerprint of the delta built on it.
+    st = os.stat(old_file)
+    with open(old_file, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b"!")
+    os.utime(old_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+    assert CompareCache(cache_dir).get(old_file, new_file) is None
+
+    restarted.invalidate([new_file])
+    assert list(cache_dir.glob("*.json")) == []
+
+
+def test_delete_snapshot_dir_invalidates_cache(
+    monkeypatch, tmp_path_factory, snapshot_tree
+):
+    """Test deleting a directory drops cached comparisons of its snapshots."""
+    monkeypatch.setenv("HOME", tmp_path_factory.mktemp("home").as_posix())
+    db = SQLiteSnapshotDB()
+    db.add_snapshot_dir(snapshot_tree.as_posix())
+    snap_files = [generate_snp_filename(0) + str(n) for n in range(2)]
+    for snap_file in snap_files:
+        assert take_snapshot(snapshot_tree.as_posix(), snap_file)
+        db.update_snapshot_dir(0, snap_file)
+    compare_snapshot_files(*snap_files)
+    cache_dir = get_compare_cache().dir
+    assert len(list(cache_dir.glob("*.json"))) == 1
+
+    assert db.delete_snapshot_dir(0)
+    db.close()
+    assert not any(os.path.exists(f) for f in snap_files)
+    assert list(cache_dir.glob("*.json")) == []
@@ -0,0 +1,139 @@
+"""Test chunkstore module."""
+
+import os
+import time
+
+import pytest
+
+from dir_snapshot import instrument
+from dir_snapshot.chunkstore import (
+    ChunkStore,
+    chunk_digest,
+    get_chunk_store,
+    get_snapshot_store,
+)
+from dir_snapshot.snapshot import (
+    SnapshotData,
+    chunk_references,
+    create_snapshot,
+    read_snp_data,
+    read_snp_meta,
+    take_snapshot,
+    write_snp_data,
+)
+
+
+@pytest.fixture
+def counters():
+    instrument.enable()
+    instrument.reset()
+    yield lambda: instrument.get_stats()["counters"]
+    instrument.enable(False)
+
+
+def test_chunk_store(tmp_path):
+    """Test chunks are stored once and read back verified."""
+    store = ChunkStore(tmp_path / "chunks")
+    digest = store.put(b"listing")
+    assert digest == chunk_digest(b"listing")
+    assert store.put(b"listing") == digest
+    assert store.get(digest) == b"listing"
+    assert store.digests() == [digest]
+
+    other = store.put(b"other")
+    assert ChunkStore(store.dir).has(other)
+    assert store.remove_unreferenced([digest]) == 0
+    assert store.remove_unreferenced([digest], grace=0) == 1
+    assert not store.has(other)
+    with pytest.raises(OSError):
+        store.get(other)
+
+    (store.dir / digest[:2] / digest[2:]).write_bytes(b"garbage")
+    with pytest.raises(ValueError):
+        ChunkStore(store.dir).get(digest)
+
+
+def test_chunked_snapshots(tmp_path_factory, snapshot_tree, counters):
+    """Test snapshots only write the chunks of changed directories."""
+    out = tmp_path_factory.mktemp("out")
+    store = ChunkStore(out / "chunks")
+    dir = snapshot_tree.as_posix()
+    assert take_snapshot(dir, str(out / "0.snp"), store=store)
+    meta = read_snp_meta(str(out / "0.snp"))
+    assert meta["kind"] == "chunked"
+    assert meta["store"] == "chunks"
+    expected = create_snapshot(dir, with_stats=True, with_tree_hashes=True)
+    assert read_snp_data(str(out / "0.snp")) == expected
+    assert counters()["chunks.written"] == len(expected.dirs) + 1
+
+    instrument.reset()
+    assert take_snapshot(dir, str(out / "1.snp"), str(out / "0.snp"), store=store)
+    assert "chunks.written" not in counters()
+
+    nested = next(d for d in expected.dirs if d.count("/") == 1)
+    (snapshot_tree / nested / "new.txt").write_text("new")
+    instrument.reset()
+    assert take_snapshot(dir, str(out / "2.snp"), str(out / "1.snp"), store=store)
+    assert counters()["chunks.written"] == 3
+    expected = create_snapshot(dir, with_stats=True, with_tree_hashes=True)
+    assert read_snp_data(str(out / "2.snp")) == expected
+
+    # A registered subdirectory shares the chunks of its subtree.
+    instrument.reset()
+    subdir = nested.partition("/")[0]
+    assert take_snapshot(os.path.join(dir, subdir), str(out / "sub.snp"), store=store)
+    assert "chunks.written" not in counters()
+
+
+def test_chunk_references(tmp_path_factory, snapshot_tree):
+    """Test chunks of deleted snapshots are the only ones collected."""
+    out = tmp_path_factory.mktemp("out")
+    store = ChunkStore(out / "chunks")
+    dir = snapshot_tree.as_posix()
+    files = [str(out / f"{i}.snp") for i in range(3)]
+    assert take_snapshot(dir, files[0], store=store)
+    (snapshot_tree / "new.txt").write_text("new")
+    assert take_snapshot(dir, files[1], store=store)
+    assert take_snapshot(dir, files[2], store=store)
+
+    os.remove(files[0])
+    referenced = chunk_references(files[1:])
+    assert store.remove_unreferenced(referenced, grace=0) == 1
+    assert read_snp_data(files[2]) == create_snapshot(
+        dir, with_stats=True, with_tree_hashes=True
+    )
+    assert chunk_references(files) is None
+
+
+def test_chunk_gc_grace(tmp_path):
+    """Test reusing a chunk protects it from gc for the grace period."""
+    store = ChunkStore(tmp_path / "chunks")
+    digest = store.put(b"listing")
+    chunk_file = store.dir / digest[:2] / digest[2:]
+    old = time.time() - 7200
+    os.utime(chunk_file, (old, old))
+    assert store.put(b"listing") == digest
+    assert store.remove_unreferenced([]) == 0
+    os.utime(chunk_file, (old, old))
+    assert store.remove_unreferenced([]) == 1
+    assert store.digests() == []
+
+
+def test_chunked_snapshot_sort_order(tmp_path):
+    """Test names sorting around the separator are read back in path order."""
+    snapshot_data = SnapshotData(
+        dirs=["a", "a!", "a!/z", "a/b", "a0"],
+        files=["a!/y", "a-c", "a/b/x", "a/x", "a0/w", "b"],
+    )
+    file = str(tmp_path / "0.snp")
+    assert write_snp_data(snapshot_data, file, store=ChunkStore(tmp_path / "chunks"))
+    assert read_snp_data(file) == snapshot_data
+
+
+def test_snapshot_store_opt_in(monkeypatch, tmp_path):
+    """Test snapshots use the chunk store only when opted in."""
+    monkeypatch.setenv("HOME", tmp_path.as_posix())
+    monkeypatch.delenv("DIR_SNAPSHOT_CHUNKS", raising=False)
+    assert get_snapshot_store() is None
+    monkeypatch.setenv("DIR_SNAPSHOT_CHUNKS", "1")
+    assert get_snapshot_store() is get_chunk_store()
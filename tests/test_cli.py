@@ -0,0 +1,45 @@
+"""Test cli module."""
+
+import subprocess
+import sys
+
+from dir_snapshot.cli import main
+
+
+def test_cli_commands(monkeypatch, tmp_path_factory, snapshot_tree, capsys):
+    """Test adding, snapshotting, listing and comparing from the command line."""
+    monkeypatch.setenv("HOME", tmp_path_factory.mktemp("home").as_posix())
+    dir = snapshot_tree.as_posix()
+
+    assert main(["add", dir]) == 0
+    assert main(["add", dir]) == 1
+    assert main(["compare", dir]) == 1
+    assert main(["snapshot", dir]) == 0
+    (snapshot_tree / "new.txt").write_text("new")
+    assert main(["snapshot-all", "--workers", "1"]) == 0
+    capsys.readouterr()
+
+    assert main(["list"]) == 0
+    assert capsys.readouterr().out == f"0\t2\t{dir}\n"
+    assert main(["list", dir]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert [line.split("\t")[1] for line in lines] == ["7", "8"]
+    assert main(["compare", dir]) == 0
+    out = capsys.readouterr().out
+    assert "Added Files: 1\n  new.txt\n" in out
+    assert "Removed Files: 0\n" in out
+    assert main(["gc"]) == 0
+    assert capsys.readouterr().out.startswith("Deleted 0 chunks")
+
+
+def test_cli_does_not_import_textual(monkeypatch, tmp_path):
+    """Test headless commands start without importing Textual or Rich."""
+    monkeypatch.setenv("HOME", tmp_path.as_posix())
+    code = (
+        "import sys; from dir_snapshot.cli import main; main(['list']); "
+        "print(sorted({m.split('.')[0] for m in sys.modules} & {'textual', 'rich'}))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.splitlines()[-1] == "[]"
@@ -1,8 +1,16 @@
 """Test db module."""
 
+import json
+import sqlite3
+
 import pytest
 
-from dir_snapshot.db import SnapshotListData
+from dir_snapshot.db import (
+    SnapshotDB,
+    SnapshotDirData,
+    SnapshotListData,
+    SQLiteSnapshotDB,
+)
 
 
 def test_empty_db(empty_db):
@@ -45,3 +53,142 @@ def test_get_snapshot_dir(snapshot_db, id, path):
     """Test get_snapshot_dir method."""
     db = snapshot_db
     assert db.get_snapshot_dir(id).path == path
+
+
+@pytest.fixture
+def sqlite_db_file(monkeypatch, tmp_path, db_file_empty):
+    """Fixture for SQLite database file in a temporary directory."""
+    db_file = tmp_path / "test.sqlite3"
+    monkeypatch.setattr("dir_snapshot.db.get_db_file", db_file_empty)
+    monkeypatch.setattr("dir_snapshot.db.get_sqlite_db_file", lambda: db_file)
+    return db_file
+
+
+def test_sqlite_db(sqlite_db_file):
+    """Test SQLiteSnapshotDB changes persist without saving."""
+    db = SQLiteSnapshotDB()
+    assert db.is_empty
+    assert db.add_snapshot_dir("C:/temp")
+    assert db.add_snapshot_dir("C:/temp2")
+    assert not db.add_snapshot_dir("C:/temp")
+    db.update_snapshot_dir(1, "1_a.snp", 10)
+    db.update_snapshot_dir(1, "1_b.snp")
+    assert db.delete_snapshot_dir(0)
+
+    reopened = SQLiteSnapshotDB()
+    assert reopened.snapshot_data == db.snapshot_data
+    assert reopened.get_snapshot_dir_by_path("C:/temp2").snap_files == [
+        "1_a.snp",
+        "1_b.snp",
+    ]
+    files = reopened.get_snapshot_files(1)
+    assert [(f.snap_file, f.num_entries) for f in files] == [
+        ("1_a.snp", 10),
+        ("1_b.snp", None),
+    ]
+    assert reopened.add_snapshot_dir("C:/temp3")
+    assert reopened.get_id_by_path("C:/temp3") == 2
+    db.close()
+    reopened.close()
+
+
+def test_sqlite_db_rules(sqlite_db_file):
+    """Test exclude rules persist and version 1 databases are upgraded."""
+    conn = sqlite3.connect(sqlite_db_file)
+    conn.execute(
+        "CREATE TABLE dirs (id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE)"
+    )
+    conn.execute("INSERT INTO dirs VALUES (0, 'C:/temp')")
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+    conn.close()
+
+    db = SQLiteSnapshotDB()
+    assert db.get_snapshot_dir(0).rules == []
+    assert db.set_snapshot_dir_rules(0, [".git/", "*.pyc"])
+    assert not db.set_snapshot_dir_rules(1, [".git/"])
+    db.close()
+
+    db = SQLiteSnapshotDB()
+    assert db.get_snapshot_dir(0).rules == [".git/", "*.pyc"]
+    db.close()
+
+
+def test_sqlite_db_import_json(monkeypatch, tmp_path, sqlite_db_file):
+    """Test SQLiteSnapshotDB imports an existing JSON database once."""
+    json_file = tmp_path / "test.json"
+    dirs = [
+        {"id": 0, "path": "C:/temp", "snap_files": ["0_a.snp"]},
+        {"id": 2, "path": "C:/temp2", "snap_files": []},
+    ]
+    json_file.write_text(json.dumps({"dirs": dirs}))
+    monkeypatch.setattr("dir_snapshot.db.get_db_file", lambda: json_file)
+
+    db = SQLiteSnapshotDB()
+    assert db.snapshot_data == SnapshotListData(
+        dirs=[SnapshotDirData(**row) for row in dirs]
+    )
+    assert db.delete_snapshot_dir(2)
+    db.close()
+
+    db = SQLiteSnapshotDB()
+    assert [d.path for d in db.snapshot_dirs] == ["C:/temp"]
+    db.close()
+
+
+def test_delete_snapshot_dir(snapshot_db):
+    """Test indexes stay consistent after deleting a directory."""
+    db = snapshot_db
+    assert db.delete_snapshot_dir(2)
+    assert not db.delete_snapshot_dir(2)
+    assert db.get_snapshot_dir(2) is None
+    assert db.get_id_by_path("C:/temp3") is None
+    assert db.add_snapshot_dir("C:/temp3")
+    assert db.get_id_by_path("C:/temp3") == 3
+    db.update_snapshot_dir(3, "3_a.snp")
+    assert db.snapshot_dirs[-1].snap_files == ["3_a.snp"]
+    assert [d.id for d in db.snapshot_dirs] == [0, 1, 3]
+    assert db.num_dirs == 3
+
+
+def test_ids_not_reused_after_reopen(monkeypatch, tmp_path, sqlite_db_file):
+    """Test ids of deleted directories are not reused by a reopened database."""
+    for db_class in (SnapshotDB, SQLiteSnapshotDB):
+        json_file = tmp_path / f"{db_class.__name__}.json"
+        json_file.write_text('{"dirs": []}')
+        monkeypatch.setattr("dir_snapshot.db.get_db_file", lambda: json_file)
+        db = db_class()
+        assert db.add_snapshot_dir("C:/a") and db.add_snapshot_dir("C:/b")
+        assert db.delete_snapshot_dir(1)
+        assert db.save_data()
+        reopened = db_class()
+        assert reopened.add_snapshot_dir("C:/c")
+        assert reopened.get_id_by_path("C:/c") == 2
+
+
+def test_sqlite_db_upgrade_keeps_snapshots(sqlite_db_file):
+    """Test version 2 databases get AUTOINCREMENT ids and keep their snapshots."""
+    conn = sqlite3.connect(sqlite_db_file)
+    conn.execute(
+        "CREATE TABLE dirs (id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE, "
+        "rules TEXT NOT NULL DEFAULT '[]')"
+    )
+    conn.execute(
+        "CREATE TABLE snapshots (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "dir_id INTEGER NOT NULL REFERENCES dirs (id) ON DELETE CASCADE, "
+        "snap_file TEXT NOT NULL, created_at REAL NOT NULL, num_entries INTEGER)"
+    )
+    conn.execute("INSERT INTO dirs (id, path) VALUES (3, 'C:/temp')")
+    conn.execute("INSERT INTO snapshots VALUES (NULL, 3, '3_a.snp', 0, 1)")
+    conn.execute("PRAGMA user_version = 2")
+    conn.commit()
+    conn.close()
+
+    db = SQLiteSnapshotDB()
+    assert db.get_snapshot_dir(3).snap_files == ["3_a.snp"]
+    assert db.add_snapshot_dir("C:/temp2")
+    assert db.get_id_by_path("C:/temp2") == 4
+    # Deleting cascades to the snapshots of the rebuilt table.
+    db.delete_snapshot_dir(3)
+    assert db.get_snapshot_files(3) == []
+    db.close()
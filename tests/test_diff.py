@@ -0,0 +1,118 @@
+"""Test diff module."""
+
+import random
+from array import array
+
+from dir_snapshot.diff import (
+    apply_delta,
+    diff_columns,
+    diff_paths,
+    diff_pruned,
+    diff_rows,
+    diff_sorted,
+    identical_subtrees,
+    is_sorted,
+    merge_delta,
+)
+
+
+def test_diff_sorted():
+    """Test diff of sorted paths against set differences."""
+    rng = random.Random(0)
+    base = sorted(f"dir{i // 100}/file{i}.txt" for i in range(5000))
+    old = sorted(rng.sample(base, 4500))
+    new = sorted(rng.sample(base, 4500))
+
+    added, removed = diff_sorted(old, new)
+    assert added == sorted(set(new) - set(old))
+    assert removed == sorted(set(old) - set(new))
+
+
+def test_diff_paths_unordered():
+    """Test diff does not depend on walk order or path prefixes."""
+    old = ["+plus", "-minus", "b", "a"]
+    new = ["a", "-minus", "c", "b"]
+
+    assert not is_sorted(old)
+    assert diff_paths(old, new) == (["c"], ["+plus"])
+    assert diff_paths(old, list(reversed(old))) == ([], [])
+
+
+def test_diff_pruned():
+    """Test identical subtrees are skipped without changing the diff."""
+    old_dirs = ["a", "a!b", "a/x", "a/x/y", "b", "b/z"]
+    new_dirs = ["a", "a!b", "a/x", "a/x/y", "b", "b/w"]
+    old_hashes = array("Q", [1, 2, 3, 4, 5, 6])
+    new_hashes = array("Q", [1, 2, 3, 4, 7, 8])
+    old = ["a!b/f", "a/f", "a/x/f", "a/x/y/f", "b/f", "b/z/f", "c"]
+    new = ["a!b/g", "a/f", "a/x/f", "a/x/y/f", "b/f", "b/w/f", "c", "d"]
+
+    prefixes = identical_subtrees(old_dirs, old_hashes, new_dirs, new_hashes)
+    assert prefixes == ["a", "a!b"]
+    assert diff_pruned(old_dirs, new_dirs, prefixes) == diff_sorted(old_dirs, new_dirs)
+
+    runs = []
+    assert diff_pruned(old, new, ["a"], runs) == diff_sorted(old, new)
+    assert runs == [(4, 4, 1), (6, 6, 1)]
+
+
+def test_diff_columns():
+    """Test changed rows are found within common runs."""
+    old = ["a", "b", "c", "d"]
+    new = ["a", "c", "d", "e"]
+    old_sizes = array("q", [1, 2, 3, 4])
+    new_sizes = array("q", [1, 3, 5, 0])
+
+    runs = []
+    assert diff_sorted(old, new, runs) == (["e"], ["b"])
+    assert runs == [(0, 0, 1), (2, 1, 2)]
+    assert diff_columns([old_sizes], [new_sizes], runs) == [2]
+
+
+def test_apply_delta():
+    """Test applying removed and upserted rows against a dict reference."""
+    rng = random.Random(8)
+    base = {f"p{n:04d}": n for n in rng.sample(range(2000), 500)}
+    removed = sorted(rng.sample(sorted(base), 50))
+    upserts = {path: -1 for path in rng.sample(sorted(base), 20) if path not in removed}
+    upserts.update({f"p{n:04d}": n for n in range(2000, 2030)})
+    upserts.update({"a": 0, "p": 0, "q": 0})
+
+    expected = dict(base)
+    for path in removed:
+        del expected[path]
+    expected.update(upserts)
+
+    paths = sorted(base)
+    upsert_paths = sorted(upserts)
+    out_paths, out_columns = apply_delta(
+        paths,
+        [array("q", (base[p] for p in paths))],
+        removed,
+        upsert_paths,
+        [array("q", (upserts[p] for p in upsert_paths))],
+    )
+    assert out_paths == sorted(expected)
+    assert out_columns == [array("q", (expected[p] for p in out_paths))]
+
+
+def test_merge_delta_and_diff_rows():
+    """Test streamed deltas round trip against a dict reference."""
+    rng = random.Random(9)
+    base = {f"p{n:04d}": n for n in rng.sample(range(2000), 500)}
+    new = {path: n for path, n in base.items() if rng.random() > 0.1}
+    new.update({path: -1 for path in rng.sample(sorted(new), 20)})
+    new.update({f"p{n:04d}": n for n in range(2000, 2030)})
+    new.update({"a": 0, "q": 0})
+
+    old_rows = sorted(base.items())
+    new_rows = sorted(new.items())
+    changes = list(diff_rows(old_rows, new_rows))
+    removed = [row for upserted, row in changes if not upserted]
+    upserts = [row for upserted, row in changes if upserted]
+    assert removed == sorted(set(base) - set(new))
+    assert upserts == [row for row in new_rows if base.get(row[0]) != row[1]]
+    assert list(merge_delta(old_rows, removed, upserts)) == new_rows
+
+    assert list(diff_rows(["a", "b"], ["b", "c"])) == [(False, "a"), (True, "c")]
+    assert list(merge_delta(["a", "b"], ["a"], ["c"])) == ["b", "c"]
@@ -0,0 +1,54 @@
+"""Test hashing module."""
+
+import os
+
+from dir_snapshot.hashing import HashCache, hash_file
+from dir_snapshot.snapshot import compare_snapshot, create_snapshot
+
+
+def test_hash_file(tmp_path):
+    """Test hash_file function."""
+    file1 = tmp_path / "file1.txt"
+    file2 = tmp_path / "file2.txt"
+    file1.write_text("same")
+    file2.write_text("same")
+
+    assert hash_file(file1.as_posix()) == hash_file(file2.as_posix()) != 0
+    file2.write_text("different")
+    assert hash_file(file1.as_posix()) != hash_file(file2.as_posix())
+    assert hash_file((tmp_path / "missing").as_posix()) == 0
+
+
+def test_hash_cache(tmp_path):
+    """Test cached hashes are invalidated by size and mtime changes."""
+    file = tmp_path / "file.txt"
+    file.write_text("content")
+
+    with HashCache(tmp_path / "cache.db") as cache:
+        st = file.stat()
+        assert cache.get(st) is None
+        cache.put_many([(st, (1 << 64) - 1)])
+        assert cache.get(st) == (1 << 64) - 1
+        os.utime(file, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+        assert cache.get(file.stat()) is None
+
+
+def test_compare_snapshot_hashes(snapshot_tree, tmp_path_factory):
+    """Test content changes are detected even when mtime is preserved."""
+    cache_file = tmp_path_factory.mktemp("cache") / "cache.db"
+    file = snapshot_tree / "test1.txt"
+    with HashCache(cache_file) as cache:
+        snap1 = create_snapshot(
+            snapshot_tree.as_posix(), with_hashes=True, hash_cache=cache
+        )
+        st = file.stat()
+        file.write_text("TEST1")
+        os.utime(file, ns=(st.st_atime_ns, st.st_mtime_ns))
+        snap2 = create_snapshot(
+            snapshot_tree.as_posix(), with_hashes=True, hash_cache=cache
+        )
+
+    assert len(snap1.file_hashes) == len(snap1.files)
+    assert compare_snapshot(snap1, snap2).modified_files == ["test1.txt"]
+    snap2.file_hashes = None
+    assert compare_snapshot(snap1, snap2).modified_files == []
@@ -0,0 +1,49 @@
+"""Test instrument module."""
+
+import json
+
+import pytest
+
+from dir_snapshot import instrument
+from dir_snapshot.snapshot import create_snapshot, read_snp_data, write_snp_data
+
+
+@pytest.fixture
+def instrumented():
+    """Fixture enabling instrumentation with empty stats."""
+    instrument.reset()
+    instrument.enable()
+    yield
+    instrument.enable(False)
+    instrument.reset()
+
+
+def test_disabled_records_nothing():
+    """Test spans and counters are ignored while disabled."""
+    instrument.enable(False)
+    instrument.reset()
+    with instrument.span("test.span"):
+        instrument.add("test.counter")
+    assert instrument.get_stats() == {"spans": {}, "counters": {}}
+
+
+def test_pipeline_stats(instrumented, snapshot_tree, tmp_path_factory):
+    """Test pipeline stages record spans and counters."""
+    snp_file = (tmp_path_factory.mktemp("out") / "test.snp").as_posix()
+    snapshot_data = create_snapshot(snapshot_tree.as_posix(), with_stats=True)
+    write_snp_data(snapshot_data, snp_file)
+    read_snp_data(snp_file)
+
+    stats = json.loads(instrument.dump_json())
+    assert set(stats["spans"]) >= {
+        "snapshot.create",
+        "snapshot.write",
+        "snapshot.read",
+        "walk.scan_dir",
+    }
+    assert stats["spans"]["snapshot.create"]["count"] == 1
+    counters = stats["counters"]
+    assert counters["walk.dirs_scanned"] == 4
+    assert counters["walk.entries"] == counters["snapshot.entries"] == 7
+    assert counters["walk.stat_calls"] == 7
+    assert counters["snapshot.bytes_written"] == counters["snapshot.bytes_read"] > 0
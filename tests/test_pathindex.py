@@ -0,0 +1,110 @@
+"""Test pathindex module."""
+
+import shutil
+from pathlib import Path
+
+from dir_snapshot.db import SQLiteSnapshotDB
+from dir_snapshot.pathindex import (
+    PathIndex,
+    get_path_index_file,
+    open_path_index,
+    update_path_index,
+)
+from dir_snapshot.snapshot import (
+    SnapshotData,
+    generate_snp_filename,
+    get_snp_file,
+    take_snapshot,
+)
+
+
+def _take(db, dir_id, dir):
+    snap_files = db.get_snapshot_dir(dir_id).snap_files
+    base_file = get_snp_file(snap_files[-1]) if snap_files else None
+    snp_file = generate_snp_filename(dir_id)
+    assert take_snapshot(dir, snp_file, base_file)
+    db.update_snapshot_dir(dir_id, Path(snp_file).name)
+    assert update_path_index(dir_id, db.get_snapshot_dir(dir_id).snap_files)
+
+
+def test_path_index(monkeypatch, tmp_path_factory, snapshot_tree):
+    """Test the index tracks paths across snapshots as they are registered."""
+    monkeypatch.setenv("HOME", tmp_path_factory.mktemp("home").as_posix())
+    monkeypatch.setattr(
+        "dir_snapshot.db.get_sqlite_db_file",
+        lambda: tmp_path_factory.mktemp("db") / "test.sqlite3",
+    )
+    db = SQLiteSnapshotDB()
+    dir = snapshot_tree.as_posix()
+    assert db.add_snapshot_dir(dir)
+
+    _take(db, 0, dir)
+    (snapshot_tree / "new.txt").write_text("new")
+    _take(db, 0, dir)
+    (snapshot_tree / "new.txt").unlink()
+    shutil.rmtree(snapshot_tree / "some_test" / "nested")
+    _take(db, 0, dir)
+    (snapshot_tree / "new.txt").write_text("new again")
+    _take(db, 0, dir)
+
+    snap_files = db.get_snapshot_dir(0).snap_files
+    with open_path_index(0) as index:
+        assert index.snap_files == snap_files
+        [h] = index.history("new.txt")
+        assert h.runs == [(1, 2), (3, None)]
+        assert (h.first_seen, h.last_seen) == (1, None)
+        assert h.snapshots(4) == [1, 3]
+        assert not h.contains(2) and h.contains(3)
+        [h] = index.history("some_test/nested")
+        assert h.is_dir and h.runs == [(0, 2)] and h.last_seen == 1
+        assert index.history("missing.txt") == []
+        assert [h.path for h in index.search("some_test/")] == [
+            "some_test/nested",
+            "some_test/nested/test3.txt",
+            "some_test/test2.txt",
+        ]
+        assert len(index.search("", limit=2)) == 2
+
+    # A mismatching index is rebuilt from the snapshot files.
+    assert update_path_index(0, snap_files[1:])
+    with open_path_index(0) as index:
+        assert index.history("new.txt")[0].runs == [(0, 1), (2, None)]
+
+    assert db.delete_snapshot_dir(0)
+    assert not get_path_index_file(0).exists()
+    db.close()
+
+
+def test_path_index_undecodable_paths(tmp_path):
+    """Test paths that are not valid UTF-8 are indexed and searched by bytes."""
+    paths = ["a\udcff", "a\udcff/x", "a\udcff\udcff", "b", "é"]
+    with PathIndex(tmp_path / "index.sqlite3") as index:
+        empty = SnapshotData(dirs=[], files=[])
+        index.add_snapshot(0, "0.snp", empty, SnapshotData(dirs=[], files=paths))
+        assert index.history("a\udcff/x")[0].runs == [(0, None)]
+        assert [h.path for h in index.search("a\udcff")] == paths[:3]
+        assert [h.path for h in index.search("a\udcff\udcff")] == paths[2:3]
+        assert [h.path for h in index.search("")] == paths
+
+
+def test_path_index_type_change(tmp_path):
+    """Test a path that changes between file and directory keeps both histories."""
+    snapshots = [
+        SnapshotData(dirs=[], files=["x"]),
+        SnapshotData(dirs=["x"], files=["x/y"]),
+        SnapshotData(dirs=[], files=["x"]),
+    ]
+    with PathIndex(tmp_path / "index.sqlite3") as index:
+        previous = SnapshotData(dirs=[], files=[])
+        for idx, snapshot_data in enumerate(snapshots):
+            index.add_snapshot(idx, f"{idx}.snp", previous, snapshot_data)
+            previous = snapshot_data
+        file_history, dir_history = index.history("x")
+        assert not file_history.is_dir and file_history.runs == [(0, 1), (2, None)]
+        assert dir_history.is_dir and dir_history.runs == [(1, 2)]
+        assert not file_history.contains(1) and dir_history.contains(1)
+        assert [(h.path, h.is_dir) for h in index.search("x")] == [
+            ("x", False),
+            ("x", True),
+            ("x/y", False),
+        ]
@@ -0,0 +1,82 @@
+"""Test rules module."""
+
+import pytest
+
+from dir_snapshot import instrument
+from dir_snapshot.rules import PathRules, compile_rules
+from dir_snapshot.snapshot import create_snapshot, read_snp_data, take_snapshot
+
+RULES = [
+    "# comment",
+    ".git",
+    "node_modules/",
+    "*.pyc",
+    "!keep.pyc",
+    "/build",
+    "docs/**/*.tmp",
+    "a/**",
+    "!a/x",
+    "[Bb]ak*",
+    "**/x/y",
+]
+
+
+@pytest.mark.parametrize(
+    "path, is_dir, excluded",
+    [
+        ("src/.git", True, True),
+        ("node_modules", False, False),
+        ("lib/node_modules", True, True),
+        ("src/main.pyc", False, True),
+        ("src/keep.pyc", False, False),
+        ("build", True, True),
+        ("src/build", True, False),
+        ("docs/x.tmp", False, True),
+        ("docs/1/2/x.tmp", False, True),
+        ("a", True, False),
+        ("a/x", False, False),
+        ("a/y", False, True),
+        ("old/Bak1", False, True),
+        ("x/y", False, True),
+        ("q/x/y", True, True),
+        ("src/main.py", False, False),
+    ],
+)
+def test_path_rules(path, is_dir, excluded):
+    """Test rules follow .gitignore semantics with the last match winning."""
+    assert PathRules(RULES).is_excluded(path, is_dir) == excluded
+
+
+def test_compile_rules():
+    """Test empty rule lists compile to None and bad rules raise."""
+    assert compile_rules(None) is None
+    assert compile_rules(["", "# comment"]) is None
+    assert compile_rules(["*.pyc"]) == PathRules(["*.pyc"])
+    with pytest.raises(ValueError):
+        compile_rules(["/a/[z-a]"])
+
+
+def test_snapshot_rules(snapshot_tree, tmp_path_factory):
+    """Test excluded subtrees are pruned and rule changes rescan the tree."""
+    out = tmp_path_factory.mktemp("out")
+    rules = compile_rules(["some_test/", "*.txt", "!test1.txt"])
+    instrument.enable()
+    instrument.reset()
+    snapshot_data = create_snapshot(str(snapshot_tree), with_stats=True, rules=rules)
+    stats = instrument.get_stats()["counters"]
+    instrument.enable(False)
+    assert snapshot_data.dirs == ["empty"]
+    assert snapshot_data.files == ["test1.txt"]
+    # Only the root and "empty" are read, and excluded entries are not stat'ed.
+    assert stats["walk.dirs_scanned"] == 2
+    assert stats["walk.stat_calls"] == 2
+
+    file1 = str(out / "1.snp")
+    file2 = str(out / "2.snp")
+    assert take_snapshot(str(snapshot_tree), file1, rules=rules)
+    assert read_snp_data(file1).files == ["test1.txt"]
+    assert take_snapshot(str(snapshot_tree), file2, file1)
+    # Listings recorded under other rules are not reused.
+    assert read_snp_data(file2) == create_snapshot(
+        str(snapshot_tree), with_stats=True, with_tree_hashes=True
+    )
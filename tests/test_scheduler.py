@@ -0,0 +1,127 @@
+"""Test scheduler module."""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from dir_snapshot import scheduler
+from dir_snapshot.db import SQLiteSnapshotDB
+from dir_snapshot.pathindex import open_path_index
+from dir_snapshot.scheduler import BatchJob, group_by_device, run_batch, snapshot_all
+from dir_snapshot.snapshot import (
+    SnapshotProgress,
+    generate_snp_filename,
+    get_snp_file,
+    read_snp_data,
+)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_snapshot_all(monkeypatch, tmp_path_factory, snapshot_tree, workers):
+    """Test all directories are snapshotted and registered."""
+    monkeypatch.setenv("HOME", tmp_path_factory.mktemp("home").as_posix())
+    other_dir = tmp_path_factory.mktemp("other")
+    (other_dir / "file.txt").write_text("file")
+    missing_dir = other_dir / "missing"
+
+    db = SQLiteSnapshotDB()
+    for d in (snapshot_tree, other_dir, missing_dir):
+        db.add_snapshot_dir(d.as_posix())
+
+    results = snapshot_all(db, workers)
+    assert [r.num_entries for r in results] == [7, 1, None]
+    assert db.get_snapshot_dir(2).snap_files == []
+    snap_file = db.get_snapshot_dir(1).snap_files[0]
+    assert read_snp_data(get_snp_file(snap_file)).files == ["file.txt"]
+    assert [f.num_entries for f in db.get_snapshot_files(0)] == [7]
+    with open_path_index(1) as index:
+        assert index.snap_files == [snap_file]
+    db.close()
+
+
+def test_group_by_device(tmp_path):
+    """Test jobs are grouped by device of their directory."""
+    jobs = [
+        BatchJob(0, tmp_path.as_posix(), "0.snp", None),
+        BatchJob(1, (tmp_path / "missing").as_posix(), "1.snp", None),
+        BatchJob(2, os.path.dirname(tmp_path), "2.snp", None),
+    ]
+    assert group_by_device(jobs) == [[jobs[0], jobs[2]], [jobs[1]]]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_run_batch_progress(monkeypatch, tmp_path_factory, snapshot_tree, workers):
+    """Test batch progress is reported and cancelled jobs are skipped."""
+    monkeypatch.setenv("HOME", tmp_path_factory.mktemp("home").as_posix())
+    other_dir = tmp_path_factory.mktemp("other")
+    jobs = [
+        BatchJob(0, snapshot_tree.as_posix(), generate_snp_filename(0), None),
+        BatchJob(1, (other_dir / "missing").as_posix(), generate_snp_filename(1), None),
+        BatchJob(2, other_dir.as_posix(), generate_snp_filename(2), None),
+    ]
+    progress = [SnapshotProgress() for _ in jobs]
+    progress[2].cancelled = True
+    results = run_batch(jobs, workers, progress)
+    assert [r.num_entries for r in results] == [7, None, None]
+    assert [p.entries for p in progress] == [7, 0, 0]
+    assert not os.path.exists(jobs[2].snp_file)
+
+
+def test_generate_snp_filename_unique(monkeypatch, tmp_path):
+    """Test snapshot file names never repeat, even within one clock tick."""
+    monkeypatch.setenv("HOME", tmp_path.as_posix())
+    names = [generate_snp_filename(0) for _ in range(1000)]
+    assert len(set(names)) == len(names)
+    assert names == sorted(names)
+
+
+class _ThreadPoolExecutor(ThreadPoolExecutor):
+    """Thread pool standing in for the process pool, to fail groups in-process."""
+
+    def __init__(self, max_workers, mp_context=None, **kwargs):
+        super().__init__(max_workers, **kwargs)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_run_batch_failing_job(monkeypatch, tmp_path_factory, snapshot_tree, workers):
+    """Test a failing job or group does not discard the other results."""
+    monkeypatch.setenv("HOME", tmp_path_factory.mktemp("home").as_posix())
+    other_dir = tmp_path_factory.mktemp("other")
+    (other_dir / "file.txt").write_text("file")
+    jobs = [
+        BatchJob(0, snapshot_tree.as_posix(), generate_snp_filename(0), None),
+        BatchJob(1, other_dir.as_posix(), generate_snp_filename(1), None),
+    ]
+    monkeypatch.setattr(
+        "dir_snapshot.scheduler.group_by_device", lambda jobs: [[job] for job in jobs]
+    )
+    if workers == 1:
+        take_snapshot = scheduler.take_snapshot
+
+        def failing_take_snapshot(dir, *args, **kwargs):
+            if dir == other_dir.as_posix():
+                raise RuntimeError("walk failed")
+            return take_snapshot(dir, *args, **kwargs)
+
+        monkeypatch.setattr(
+            "dir_snapshot.scheduler.take_snapshot", failing_take_snapshot
+        )
+    else:
+        run_group = scheduler._run_group
+
+        def failing_run_group(group, progress=None):
+            if group[0][1].dir == other_dir.as_posix():
+                raise BrokenProcessPool("worker died")
+            return run_group(group, progress)
+
+        monkeypatch.setattr("dir_snapshot.scheduler._shared_progress", None)
+        monkeypatch.setattr("dir_snapshot.scheduler._run_group", failing_run_group)
+        monkeypatch.setattr(
+            "dir_snapshot.scheduler.ProcessPoolExecutor", _ThreadPoolExecutor
+        )
+    results = run_batch(jobs, workers)
+    assert [r.num_entries for r in results] == [7, None]
+    assert os.path.exists(jobs[0].snp_file)
+    assert not os.path.exists(jobs[1].snp_file)
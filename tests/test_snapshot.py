@@ -1,6 +1,47 @@
 """Test snapshot module."""
 
-from dir_snapshot.snapshot import compare_snapshot
+import os
+import pickle
+import time
+from array import array
+from pathlib import Path
+
+import pytest
+
+from dir_snapshot import instrument
+from dir_snapshot.snapshot import (
+    HASH_COLUMN,
+    SnapshotCancelled,
+    SnapshotData,
+    SnapshotProgress,
+    SubtreeSummary,
+    compare_snapshot,
+    compare_snapshot_tree,
+    create_snapshot,
+    iter_snapshot,
+    read_snp_data,
+    take_snapshot,
+    write_snp_data,
+    write_snp_stream,
+)
+from dir_snapshot.snpfile import SnpReader
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_create_snapshot(snapshot_tree, workers):
+    """Test create snapshot function against a pathlib walk."""
+    expected_dirs = []
+    expected_files = []
+    for path in Path(snapshot_tree).rglob("*"):
+        rel_path = path.relative_to(snapshot_tree).as_posix()
+        if path.is_dir():
+            expected_dirs.append(rel_path)
+        else:
+            expected_files.append(rel_path)
+
+    snapshot_data = create_snapshot(snapshot_tree.as_posix(), workers=workers)
+    assert snapshot_data.dirs == sorted(expected_dirs)
+    assert snapshot_data.files == sorted(expected_files)
 
 
 def test_compare_snapshot(snapshots):
@@ -12,3 +53,272 @@ def test_compare_snapshot(snapshots):
     assert compare_data.added_files == ["new_test/test1.txt", "some_test/test2.txt"]
     assert compare_data.removed_dirs == []
     assert compare_data.removed_files == ["test1 - Copy.txt", "test1.txt"]
+
+
+def test_write_snp_stream(snapshot_tree, tmp_path_factory):
+    """Test streamed snapshot file matches the in-memory snapshot."""
+    snp_file = (tmp_path_factory.mktemp("snapshots") / "test.snp").as_posix()
+
+    assert write_snp_stream(iter_snapshot(snapshot_tree.as_posix()), snp_file, 2)
+    assert read_snp_data(snp_file) == create_snapshot(snapshot_tree.as_posix())
+
+
+def test_write_snp_data(snapshots, tmp_path):
+    """Test snapshot file round trip."""
+    snp_file = (tmp_path / "test.snp").as_posix()
+
+    assert write_snp_data(snapshots[0], snp_file)
+    snapshot_data = read_snp_data(snp_file)
+    assert snapshot_data.dirs == sorted(snapshots[0].dirs)
+    assert snapshot_data.files == sorted(snapshots[0].files)
+
+
+def test_read_legacy_snp_data(snapshots, tmp_path):
+    """Test legacy pickle snapshot files are still readable."""
+    whole_file = tmp_path / "whole.snp"
+    with whole_file.open("wb") as f:
+        pickle.dump(snapshots[0].dirs, f)
+        pickle.dump(snapshots[0].files, f)
+    chunked_file = tmp_path / "chunked.snp"
+    with chunked_file.open("wb") as f:
+        pickle.dump(("dirs", snapshots[1].dirs), f)
+        pickle.dump(("files", snapshots[1].files[:2]), f)
+        pickle.dump(("files", snapshots[1].files[2:]), f)
+        pickle.dump(None, f)
+    unsafe_file = tmp_path / "unsafe.snp"
+    unsafe_file.write_bytes(pickle.dumps(Path("unsafe")))
+
+    assert read_snp_data(whole_file.as_posix()) == snapshots[0]
+    assert read_snp_data(chunked_file.as_posix()) == snapshots[1]
+    assert read_snp_data(unsafe_file.as_posix()) == SnapshotData(dirs=[], files=[])
+
+
+def test_snapshot_stats(snapshot_tree, tmp_path_factory):
+    """Test stats are recorded and survive both writers."""
+    snapshot_data = create_snapshot(snapshot_tree.as_posix(), with_stats=True)
+    assert len(snapshot_data.file_stats.size) == len(snapshot_data.files)
+    idx = snapshot_data.files.index("test1.txt")
+    stat = (snapshot_tree / "test1.txt").stat()
+    assert snapshot_data.file_stats.size[idx] == stat.st_size
+    assert snapshot_data.file_stats.mtime_ns[idx] == stat.st_mtime_ns
+    assert snapshot_data.file_stats.inode[idx] == stat.st_ino
+
+    snp_dir = tmp_path_factory.mktemp("snapshots")
+    snp_file = (snp_dir / "data.snp").as_posix()
+    stream_file = (snp_dir / "stream.snp").as_posix()
+    entries = iter_snapshot(snapshot_tree.as_posix(), with_stats=True)
+    assert write_snp_data(snapshot_data, snp_file)
+    assert write_snp_stream(entries, stream_file, 2)
+    assert read_snp_data(snp_file) == snapshot_data
+    assert read_snp_data(stream_file) == snapshot_data
+
+
+def test_compare_snapshot_modified(snapshot_tree):
+    """Test modified files are detected from stats."""
+    snap1 = create_snapshot(snapshot_tree.as_posix(), with_stats=True)
+    (snapshot_tree / "test1.txt").write_text("modified")
+    (snapshot_tree / "new.txt").write_text("new")
+    snap2 = create_snapshot(snapshot_tree.as_posix(), with_stats=True)
+
+    compare_data = compare_snapshot(snap1, snap2)
+    assert compare_data.added_files == ["new.txt"]
+    assert compare_data.modified_files == ["test1.txt"]
+    assert compare_snapshot(snap1, snap1).modified_files == []
+
+
+def test_compare_snapshot_tree_hashes(snapshot_tree, tmp_path_factory):
+    """Test tree hashes round trip and prune unchanged subtrees in compare."""
+    (snapshot_tree / "other").mkdir()
+    (snapshot_tree / "other" / "test4.txt").write_text("test4")
+    snp_dir = tmp_path_factory.mktemp("snapshots")
+    stream_file = (snp_dir / "stream.snp").as_posix()
+    entries = iter_snapshot(snapshot_tree.as_posix(), with_stats=True)
+    snap1 = create_snapshot(
+        snapshot_tree.as_posix(), with_stats=True, with_tree_hashes=True
+    )
+    assert write_snp_stream(entries, stream_file, 2, with_tree_hashes=True)
+    assert read_snp_data(stream_file) == snap1
+
+    (snapshot_tree / "some_test" / "nested" / "test3.txt").write_text("modified")
+    (snapshot_tree / "empty" / "new.txt").write_text("new")
+    snap2 = create_snapshot(
+        snapshot_tree.as_posix(), with_stats=True, with_tree_hashes=True
+    )
+    changed = [
+        path
+        for path, old, new in zip(
+            snap1.dirs, snap1.dir_tree_hashes, snap2.dir_tree_hashes
+        )
+        if old != new
+    ]
+    assert changed == ["empty", "some_test", "some_test/nested"]
+
+    instrument.enable()
+    instrument.reset()
+    compare_data = compare_snapshot(snap1, snap2)
+    assert instrument.get_stats()["counters"]["compare.pruned_dirs"] == 1
+    instrument.enable(False)
+    snap1.dir_tree_hashes = snap2.dir_tree_hashes = None
+    assert compare_snapshot(snap1, snap2) == compare_data
+    assert compare_data.added_files == ["empty/new.txt"]
+    assert compare_data.modified_files == ["some_test/nested/test3.txt"]
+
+
+def test_compare_snapshot_tree(snapshot_tree):
+    """Test added and removed subtrees are collapsed and expand lazily."""
+    snap1 = create_snapshot(snapshot_tree.as_posix(), with_stats=True)
+    for n in range(3):
+        (snapshot_tree / "build" / f"obj{n}").mkdir(parents=True)
+        (snapshot_tree / "build" / f"obj{n}" / "a.o").write_bytes(b"x" * 10)
+    (snapshot_tree / "build" / "log.txt").write_bytes(b"x" * 5)
+    (snapshot_tree / "build!").write_text("")
+    (snapshot_tree / "some_test" / "nested" / "test3.txt").unlink()
+    (snapshot_tree / "some_test" / "nested").rmdir()
+    snap2 = create_snapshot(snapshot_tree.as_posix(), with_stats=True)
+
+    compare_data = compare_snapshot_tree(snap1, snap2)
+    assert compare_data.added_dirs == [SubtreeSummary("build", 3, 4, 35)]
+    assert compare_data.added_files == ["build!"]
+    assert compare_data.removed_dirs == [SubtreeSummary("some_test/nested", 0, 1, 5)]
+    assert compare_data.removed_files == []
+
+    dirs, files = compare_data.expand("build")
+    assert [d.path for d in dirs] == ["build/obj0", "build/obj1", "build/obj2"]
+    assert files == ["build/log.txt"]
+    assert compare_data.expand("some_test/nested", removed=True) == (
+        [],
+        ["some_test/nested/test3.txt"],
+    )
+
+
+def test_create_snapshot_incremental(snapshot_tree, monkeypatch):
+    """Test incremental snapshot only reads changed directories."""
+    snap1 = create_snapshot(snapshot_tree.as_posix(), with_stats=True)
+    (snapshot_tree / "some_test" / "nested" / "new.txt").write_text("new")
+
+    scanned = []
+    scandir = os.scandir
+
+    def scandir_spy(path):
+        scanned.append(Path(path).relative_to(snapshot_tree).as_posix())
+        return scandir(path)
+
+    monkeypatch.setattr("dir_snapshot.walker.os.scandir", scandir_spy)
+    snap2 = create_snapshot(snapshot_tree.as_posix(), previous=snap1)
+
+    assert sorted(scanned) == [".", "some_test/nested"]
+    assert snap2.dirs == snap1.dirs
+    assert snap2.files == sorted(snap1.files + ["some_test/nested/new.txt"])
+    assert snap2.dir_stats is not None and snap2.file_stats is None
+    assert compare_snapshot(snap1, snap2).added_files == ["some_test/nested/new.txt"]
+
+
+def test_create_snapshot_racy_listing(snapshot_tree):
+    """Test directories modified just before a snapshot are read again."""
+    started_ns = time.time_ns()
+    snap1 = create_snapshot(snapshot_tree.as_posix(), with_stats=True)
+    nested = snapshot_tree / "some_test" / "nested"
+    st = os.stat(nested)
+    # An entry added within the same mtime tick leaves the mtime unchanged.
+    (nested / "new.txt").write_text("new")
+    os.utime(nested, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    snap2 = create_snapshot(snapshot_tree.as_posix(), previous=snap1)
+    assert "some_test/nested/new.txt" not in snap2.files
+    snap2 = create_snapshot(
+        snapshot_tree.as_posix(), previous=snap1, previous_started_ns=started_ns
+    )
+    assert "some_test/nested/new.txt" in snap2.files
+
+
+def test_write_snp_data_delta(tmp_path):
+    """Test delta chains round trip and restart with keyframes."""
+    snap_files = []
+    snapshot_data = SnapshotData(
+        dirs=[f"d{n:03d}" for n in range(100)],
+        files=[f"f{n:03d}" for n in range(100)],
+        file_hashes=array("Q", range(100)),
+    )
+    for n in range(5):
+        snapshot_data.dirs.remove(f"d{n:03d}")
+        snapshot_data.dirs.append(f"e{n:03d}")
+        snapshot_data.files.append(f"g{n:03d}")
+        snapshot_data.file_hashes.append(n)
+        snapshot_data.file_hashes[n] += 1000
+
+        snp_file = (tmp_path / f"{n}.snp").as_posix()
+        base_file = snap_files[-1] if snap_files else None
+        assert write_snp_data(snapshot_data, snp_file, base_file, keyframe_interval=3)
+        snap_files.append(snp_file)
+        assert read_snp_data(snp_file) == snapshot_data
+
+    kinds = []
+    for snp_file in snap_files:
+        with SnpReader(snp_file) as reader:
+            kinds.append((reader.meta["kind"], reader.meta["depth"]))
+            if reader.meta["kind"] == "delta":
+                assert reader.count("files") == 2
+                assert reader.columns("files")[0][0] == HASH_COLUMN
+    assert kinds == [
+        ("full", 0),
+        ("delta", 1),
+        ("delta", 2),
+        ("full", 0),
+        ("delta", 1),
+    ]
+
+    Path(snap_files[3]).unlink()
+    assert read_snp_data(snap_files[4]) == SnapshotData(dirs=[], files=[])
+
+
+@pytest.mark.parametrize("max_entries", [0, 1 << 20])
+def test_take_snapshot_delta(monkeypatch, snapshot_tree, tmp_path_factory, max_entries):
+    """Test take_snapshot merges a streamed delta that round trips."""
+    monkeypatch.setattr(
+        "dir_snapshot.snapshot.INCREMENTAL_WALK_MAX_ENTRIES", max_entries
+    )
+    out_dir = tmp_path_factory.mktemp("out")
+    dir = snapshot_tree.as_posix()
+    base_file = (out_dir / "base.snp").as_posix()
+    assert take_snapshot(dir, base_file)
+
+    (snapshot_tree / "some_test" / "new.txt").write_text("new")
+    (snapshot_tree / "test1.txt").unlink()
+    instrument.enable()
+    instrument.reset()
+    try:
+        delta_file = (out_dir / "delta.snp").as_posix()
+        assert take_snapshot(dir, delta_file, base_file)
+        counters = instrument.get_stats()["counters"]
+    finally:
+        instrument.enable(False)
+    full_file = (out_dir / "full.snp").as_posix()
+    assert take_snapshot(dir, full_file)
+
+    with SnpReader(delta_file) as reader:
+        assert reader.meta["kind"] == "delta"
+        assert reader.meta["base"] == "base.snp"
+        assert reader.count("files") == 1
+        assert list(reader.iter_paths("removed_files")) == ["test1.txt"]
+    assert read_snp_data(delta_file) == read_snp_data(full_file)
+    assert ("snapshot.files_read" in counters) == (max_entries > 0)
+    assert sorted(os.listdir(out_dir)) == ["base.snp", "delta.snp", "full.snp"]
+
+
+def test_take_snapshot_cancelled(snapshot_tree, tmp_path_factory):
+    """Test take_snapshot reports progress and cleans up when cancelled."""
+    out_dir = tmp_path_factory.mktemp("out")
+    snp_file = (out_dir / "full.snp").as_posix()
+    progress = SnapshotProgress()
+    assert take_snapshot(snapshot_tree.as_posix(), snp_file, progress=progress)
+    assert progress.entries == 7
+    assert progress.dirs_queued == 0
+    assert progress.bytes_written == os.path.getsize(snp_file)
+
+    delta_file = (out_dir / "delta.snp").as_posix()
+    progress = SnapshotProgress(cancelled=True)
+    with pytest.raises(SnapshotCancelled):
+        take_snapshot(snapshot_tree.as_posix(), delta_file, snp_file, progress=progress)
+    with pytest.raises(SnapshotCancelled):
+        take_snapshot(snapshot_tree.as_posix(), delta_file, progress=progress)
+    assert os.listdir(out_dir) == ["full.snp"]
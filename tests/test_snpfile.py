@@ -0,0 +1,68 @@
+"""Test snpfile module."""
+
+from array import array
+
+import pytest
+
+from dir_snapshot.snpfile import (
+    SnpFormatError,
+    SnpReader,
+    is_snp_file,
+    write_snp_file,
+)
+
+
+@pytest.fixture
+def sorted_paths():
+    """Fixture for sorted paths spanning several blocks."""
+    paths = [f"dir{i // 7}/sub/file{i:05d}.txt" for i in range(3000)]
+    paths.append("odd \udcff name")
+    paths.append("été/\U0001f600.txt")
+    return sorted(paths)
+
+
+def test_snp_file_round_trip(tmp_path, sorted_paths):
+    """Test sections and columns are read back unchanged."""
+    snp_file = (tmp_path / "test.snp").as_posix()
+    sizes = array("q", range(len(sorted_paths)))
+    digests = [bytes([i % 256]) * 4 for i in range(len(sorted_paths))]
+    write_snp_file(
+        snp_file,
+        {"dirs": [], "files": zip(sorted_paths, sizes, digests)},
+        columns={"files": [("size", "q", 1), ("digest", "B", 4)]},
+        meta={"kind": "full"},
+    )
+
+    assert is_snp_file(snp_file)
+    with SnpReader(snp_file) as reader:
+        assert reader.meta == {"kind": "full"}
+        assert reader.count("dirs") == 0
+        assert reader.num_blocks("files") > 1
+        paths, values = reader.read_section("files")
+        assert paths == sorted_paths
+        assert values["size"] == sizes
+        assert values["digest"].tobytes() == b"".join(digests)
+        assert list(reader.iter_rows("files"))[5] == (paths[5], 5, digests[5])
+        assert reader.contains("files", "odd \udcff name")
+        assert reader.contains("files", sorted_paths[-1])
+        assert not reader.contains("files", "dir0/sub/missing.txt")
+        assert not reader.contains("dirs", "dir0")
+
+
+def test_snp_file_undecodable_suffixes(tmp_path):
+    """Test undecodable bytes at suffix boundaries do not merge into one char."""
+    snp_file = (tmp_path / "test.snp").as_posix()
+    paths = ["a\udc80\udcc3", "a\udca9", "b\udcff"]
+    write_snp_file(snp_file, {"files": paths})
+    with SnpReader(snp_file) as reader:
+        assert reader.read_section("files")[0] == paths
+
+
+def test_snp_file_truncated(tmp_path, sorted_paths):
+    """Test truncated files are rejected."""
+    snp_file = tmp_path / "test.snp"
+    write_snp_file(snp_file.as_posix(), {"files": sorted_paths})
+    snp_file.write_bytes(snp_file.read_bytes()[:-1])
+
+    with pytest.raises(SnpFormatError):
+        SnpReader(snp_file.as_posix())
@@ -0,0 +1,158 @@
+"""Test app module."""
+
+import asyncio
+
+from textual.widgets import SelectionList
+
+from dir_snapshot import instrument
+from dir_snapshot.app import DirSnapshotApp
+from dir_snapshot.snapshot import (
+    SnapshotCompareData,
+    SnapshotData,
+    SnapshotTreeCompareData,
+    SubtreeSummary,
+    get_snp_file,
+    read_snp_data,
+)
+from dir_snapshot.ui import CompareResultPanel, CompareResultView, CompareRows
+
+
+def test_take_snapshot_in_background(monkeypatch, tmp_path_factory, snapshot_tree):
+    """Test snapshots run on worker threads and are registered when done."""
+    monkeypatch.setenv("HOME", tmp_path_factory.mktemp("home").as_posix())
+    dir = snapshot_tree.as_posix()
+
+    async def run() -> None:
+        app = DirSnapshotApp()
+        instrument_enabled = instrument.is_enabled()
+        async with app.run_test() as pilot:
+            assert instrument.is_enabled()
+            await app.workers.wait_for_complete()
+            await pilot.pause()
+            app.db.add_snapshot_dir(dir)
+            for _ in range(2):
+                app._start_snapshot(dir)
+                assert dir in app.running_snapshots
+                await app.workers.wait_for_complete()
+                await pilot.pause()
+                assert app.running_snapshots == {}
+
+            app.selected_dir = dir
+            app._refresh_snapshot_list()
+            app.query_one(SelectionList).select_all()
+            app.action_compare_snapshots()
+            await app.workers.wait_for_complete()
+            await pilot.pause()
+            rows = app.query_one(CompareResultPanel).rows
+            assert [count[2] for count in rows.counts()] == [0, 0, 0, 0, 0]
+
+        assert instrument.is_enabled() == instrument_enabled
+        snap_files = app.db.get_snapshot_dir_by_path(dir).snap_files
+        assert len(snap_files) == 2
+        snapshots = [read_snp_data(get_snp_file(f)) for f in snap_files]
+        assert snapshots[0].files == snapshots[1].files
+        assert all(s.file_stats is not None for s in snapshots)
+        assert [f.num_entries for f in app.db.get_snapshot_files(0)] == [7, 7]
+
+    asyncio.run(run())
+
+
+def test_compare_rows():
+    """Test comparison rows are indexed and filtered across categories."""
+    compare_data = SnapshotCompareData(
+        added_dirs=["new"],
+        added_files=["a.txt", "new/b.txt"],
+        removed_dirs=[],
+        removed_files=["c.txt"],
+    )
+    rows = CompareRows(compare_data)
+    assert [rows[i] for i in range(len(rows))] == [
+        (True, "Added Directories (1)"),
+        (False, "+ new"),
+        (True, "Added Files (2)"),
+        (False, "+ a.txt"),
+        (False, "+ new/b.txt"),
+        (True, "Removed Directories (0)"),
+        (True, "Removed Files (1)"),
+        (False, "- c.txt"),
+        (True, "Modified Files (0)"),
+    ]
+
+    rows.narrow("new")
+    assert len(rows) == 7
+    rows.narrow("new/")
+    assert [count[1:] for count in rows.counts()] == [
+        (0, 1),
+        (1, 2),
+        (0, 0),
+        (0, 1),
+        (0, 0),
+    ]
+    rows.narrow("txt")
+    assert rows[2] == (False, "+ a.txt")
+
+
+def test_compare_rows_expand():
+    """Test collapsed directories expand in place and collapse again."""
+    snapshot_data = SnapshotData(
+        dirs=["new", "new/sub"],
+        files=["new/a.txt", "new/sub/b.txt"],
+    )
+    compare_data = SnapshotTreeCompareData(
+        added_dirs=[SubtreeSummary("new", 1, 2)],
+        added_files=[],
+        removed_dirs=[],
+        removed_files=[],
+        new=snapshot_data,
+    )
+    rows = CompareRows(compare_data)
+    assert rows[1] == (False, "+ ▸ new/ (1 dirs, 2 files)")
+    assert not rows.toggle(0)
+    assert rows.toggle(1)
+    assert [rows[i][1] for i in range(1, 4)] == [
+        "+ ▾ new/ (1 dirs, 2 files)",
+        "+   ▸ new/sub/ (0 dirs, 1 files)",
+        "+   new/a.txt",
+    ]
+    assert rows.counts()[0][1:] == (1, 1)
+    assert rows.toggle(2)
+    assert rows[3] == (False, "+     new/sub/b.txt")
+
+    rows.narrow("b.txt")
+    assert len(rows) == 6
+    rows.narrow("")
+    assert rows.toggle(1)
+    assert len(rows) == 6
+    assert compare_data.added_dirs == [SubtreeSummary("new", 1, 2)]
+
+
+def test_compare_result_view_large(monkeypatch, tmp_path_factory):
+    """Test the result view only renders visible rows of a large diff."""
+    monkeypatch.setenv("HOME", tmp_path_factory.mktemp("home").as_posix())
+    compare_data = SnapshotCompareData(
+        added_dirs=[],
+        added_files=[f"d{i // 100:05d}/f{i:07d}.dat" for i in range(1_000_000)],
+        removed_dirs=[],
+        removed_files=["gone.txt"],
+    )
+
+    async def run() -> None:
+        app = DirSnapshotApp()
+        async with app.run_test(size=(100, 40)) as pilot:
+            app._show_compare("old -> new", compare_data)
+            await pilot.pause()
+            view = app.query_one(CompareResultView)
+            assert view.virtual_size.height == 1_000_006
+            assert view.render_line(0).text.startswith("Added Directories (0)")
+            assert view.render_line(2).text.startswith("+ d00000/f0000000.dat")
+
+            view.scroll_to(y=999_990, animate=False)
+            await pilot.pause()
+            assert view.render_line(0).text.startswith("+ d09999/f0999988.dat")
+
+            app.query_one("#compare-filter").value = "gone"
+            await pilot.pause()
+            assert view.virtual_size.height == 6
+            assert view.render_line(4).text.startswith("- gone.txt")
+
+    asyncio.run(run())
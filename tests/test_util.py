@@ -0,0 +1,22 @@
+"""Test util module."""
+
+from dir_snapshot import util
+
+
+def test_settings_dir_created_once(monkeypatch, tmp_path):
+    """Test settings paths are created once and then served from cache."""
+    monkeypatch.setenv("HOME", tmp_path.as_posix())
+    created = []
+    create_dir = util.create_dir
+    monkeypatch.setattr(
+        util, "create_dir", lambda p: created.append(p) or create_dir(p)
+    )
+
+    for _ in range(3):
+        snapshot_dir = util.get_snapshot_dir()
+        db_file = util.get_db_file()
+    assert snapshot_dir.is_dir() and db_file.is_file()
+    assert created == [
+        tmp_path / ".dir_snapshot",
+        tmp_path / ".dir_snapshot" / "snapshots",
+    ]
@@ -0,0 +1,40 @@
+"""Test walker module."""
+
+import tracemalloc
+
+import pytest
+
+from dir_snapshot.walker import walk
+
+
+def _make_tree(root, depth, fanout=3):
+    pending = [(root, depth)]
+    while pending:
+        dir, level = pending.pop()
+        (dir / "f.txt").write_text("x")
+        if level:
+            for i in range(fanout):
+                (dir / f"d{i}").mkdir()
+                pending.append((dir / f"d{i}", level - 1))
+
+
+def _walk_peak(root, workers):
+    tracemalloc.start()
+    try:
+        count = sum(1 for _ in walk(root.as_posix(), workers, with_stats=True))
+        return count, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_walk_memory_flat(tmp_path_factory, workers):
+    """Test peak memory of a walk does not grow with the size of the tree."""
+    small = tmp_path_factory.mktemp("small")
+    large = tmp_path_factory.mktemp("large")
+    _make_tree(small, 4)
+    _make_tree(large, 7)
+    small_count, small_peak = _walk_peak(small, workers)
+    large_count, large_peak = _walk_peak(large, workers)
+    assert large_count > small_count * 20
+    assert large_peak < small_peak * 2
@@ -0,0 +1,101 @@
+"""Test watcher module."""
+
+import os
+import shutil
+import time
+
+import pytest
+
+from dir_snapshot import instrument
+from dir_snapshot.snapshot import create_snapshot, read_snp_data
+from dir_snapshot.watcher import (
+    ChangeJournal,
+    DirWatcher,
+    apply_journal,
+    is_supported,
+    take_watched_snapshot,
+)
+
+pytestmark = pytest.mark.skipif(not is_supported(), reason="requires inotify")
+
+EVENT_DELAY = 0.3
+
+
+def _make_tree(root):
+    for i in range(3):
+        os.makedirs(root / f"a{i}" / "b")
+        (root / f"a{i}" / "b" / "f.txt").write_text("x")
+    (root / "top.txt").write_text("t")
+
+
+def test_take_watched_snapshot(tmp_path_factory):
+    """Test snapshots from the change journal match a full walk."""
+    root = tmp_path_factory.mktemp("tree")
+    out = tmp_path_factory.mktemp("out")
+    _make_tree(root)
+    instrument.enable()
+    instrument.reset()
+    with DirWatcher(str(root)) as watcher:
+        assert watcher.watched == 7
+        assert take_watched_snapshot(watcher, str(out / "0.snp"))
+
+        (root / "new.txt").write_text("n")
+        os.makedirs(root / "a0" / "b" / "c" / "d")
+        (root / "a0" / "b" / "c" / "d" / "g").write_text("g")
+        shutil.rmtree(root / "a1")
+        (root / "a2" / "b" / "f.txt").write_text("changed")
+        os.rename(root / "a2", root / "z2")
+        time.sleep(EVENT_DELAY)
+        assert take_watched_snapshot(watcher, str(out / "1.snp"), str(out / "0.snp"))
+
+        (root / "z2" / "b" / "q").mkdir()
+        (root / "z2" / "b" / "q" / "h").write_text("h")
+        os.chmod(root / "top.txt", 0o600)
+        time.sleep(EVENT_DELAY)
+        assert take_watched_snapshot(watcher, str(out / "2.snp"), str(out / "1.snp"))
+        assert watcher.synced_file == str(out / "2.snp")
+
+    stats = instrument.get_stats()["counters"]
+    instrument.enable(False)
+    assert stats["watch.journal_snapshots"] == 2
+    assert stats["watch.fallback_walks"] == 1
+    expected = create_snapshot(str(root), with_stats=True, with_tree_hashes=True)
+    assert read_snp_data(str(out / "2.snp")) == expected
+
+
+def test_apply_journal_fallback(tmp_path_factory):
+    """Test overflowed journals and unsynced base files walk the tree."""
+    root = tmp_path_factory.mktemp("tree")
+    out = tmp_path_factory.mktemp("out")
+    _make_tree(root)
+    previous = create_snapshot(str(root), with_stats=True, with_tree_hashes=True)
+    assert apply_journal(str(root), previous, ChangeJournal(overflowed=True)) is None
+    assert apply_journal(str(root), previous, ChangeJournal()) == previous
+
+    with DirWatcher(str(root)) as watcher:
+        assert take_watched_snapshot(watcher, str(out / "0.snp"))
+        (root / "new.txt").write_text("n")
+        time.sleep(EVENT_DELAY)
+        watcher.synced_file = None
+        assert take_watched_snapshot(watcher, str(out / "1.snp"), str(out / "0.snp"))
+    expected = create_snapshot(str(root), with_stats=True, with_tree_hashes=True)
+    assert read_snp_data(str(out / "1.snp")) == expected
+
+
+def test_take_watched_snapshot_recreated_dir(tmp_path_factory):
+    """Test files in a directory replaced under the same name are not lost."""
+    root = tmp_path_factory.mktemp("tree")
+    out = tmp_path_factory.mktemp("out")
+    _make_tree(root)
+    (root / "a0" / "obj").mkdir()
+    with DirWatcher(str(root)) as watcher:
+        assert take_watched_snapshot(watcher, str(out / "0.snp"))
+        (root / "a0" / "obj").rmdir()
+        (out / "obj").mkdir()
+        (out / "obj" / "x.o").write_text("x")
+        os.rename(out / "obj", root / "a0" / "obj")
+        time.sleep(EVENT_DELAY)
+        assert take_watched_snapshot(watcher, str(out / "1.snp"), str(out / "0.snp"))
+    assert "a0/obj/x.o" in read_snp_data(str(out / "1.snp")).files
+    expected = create_snapshot(str(root), with_stats=True, with_tree_hashes=True)
+    assert read_snp_data(str(out / "1.snp")) == expected